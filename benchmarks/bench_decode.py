@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure ``utils.decode`` against the old implementation.
+
+Builds megabyte-sized synthetic outputs, like those of `mdfind -0` and
+`mdls`, and times decoding them record by record with the old
+``decode``, and as whole buffers with ``decode_records`` and ``decode``.
+
+Usage: ``python benchmarks/bench_decode.py [records]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import sys
+import time
+import unicodedata
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from metadata import utils
+
+
+def legacy_decode(text, encoding='utf-8', normalization='NFC'):
+    """The ``decode`` that the fast path replaced.
+
+    """
+    if isinstance(text, bytes):
+        text = text.decode(encoding)
+    if not isinstance(text, utils.text_type):
+        return text
+    if re.search(r'\\U\d{3,}', text):
+        text = text.replace('\\U', '\\u')\
+                   .encode('ascii', 'backslashreplace')\
+                   .decode('unicode-escape')
+    return unicodedata.normalize(normalization, text)
+
+
+def paths(count, name):
+    return [('/Users/someone/Documents/Projects/{:07d}/' + name)
+            .format(i).encode('utf-8') for i in range(count)]
+
+
+def timed(label, size, func):
+    start = time.time()
+    func()
+    seconds = time.time() - start
+    print('{:<34} {:8.3f} s   {:8.1f} MB/s'.format(label, seconds,
+                                                  size / seconds / 1e6))
+
+
+def main(count=100000):
+    # OS X file systems hand out decomposed (NFD) names
+    nfd = unicodedata.normalize('NFD', 'Résumé Tōnÿ.pdf')
+    outputs = [('ASCII paths', paths(count, 'report final.pdf')),
+               ('NFC paths', paths(count, 'Résumé Tōnÿ.pdf')),
+               ('NFD paths', paths(count, nfd))]
+    for label, records in outputs:
+        data = b'\0'.join(records) + b'\0'
+        print('{}: {} records, {:.1f} MB'.format(label, count,
+                                                 len(data) / 1e6))
+        timed('  old decode() per record', len(data),
+              lambda: [legacy_decode(record)
+                       for record in data.split(b'\0') if record])
+        timed('  decode() per record', len(data),
+              lambda: [utils.decode(record)
+                       for record in data.split(b'\0') if record])
+        timed('  decode_records()', len(data),
+              lambda: utils.decode_records(data))
+        assert utils.decode_records(data) == [
+            legacy_decode(record) for record in data.split(b'\0') if record]
+    # `mdls` text output, with Cocoa escapes
+    line = '    "T\\U014dn\\U00ff St\\U00e5rk {:07d}",\n'
+    data = ''.join(line.format(i) for i in range(count)).encode('utf-8')
+    print('Cocoa escapes: {} lines, {:.1f} MB'.format(count,
+                                                      len(data) / 1e6))
+    timed('  old decode() per line', len(data),
+          lambda: [legacy_decode(line) for line in data.split(b'\n')])
+    timed('  decode() per line', len(data),
+          lambda: [utils.decode(line) for line in data.split(b'\n')])
+    timed('  decode() of buffer', len(data), lambda: utils.decode(data))
+    # query predicates
+    predicates = ['*report {}*'.format(i) for i in range(count)]
+    size = sum(len(predicate) for predicate in predicates)
+    print('Predicates: {}'.format(count))
+    timed('  old decode()', size,
+          lambda: [legacy_decode(predicate) for predicate in predicates])
+    timed('  decode()', size,
+          lambda: [utils.decode(predicate) for predicate in predicates])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
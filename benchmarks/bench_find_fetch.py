@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure ``find()`` followed by listing each result against
+``find(fetch=...)``, which gets the same attributes from `mdfind -attr`.
+
+Usage: ``python benchmarks/bench_find_fetch.py [files]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + os.environ['PATH']
+
+import metadata
+
+FETCH = ['content_type', 'logical_size', 'content_creation_date']
+
+
+def report(label, count, seconds):
+    print('{:<26} {:8.3f} s   {:10.1f} results/s'.format(
+        label, seconds, count / seconds))
+
+
+def main(count=200):
+    root = tempfile.mkdtemp()
+    try:
+        for i in range(count):
+            open(os.path.join(root, 'file {:06d}.pdf'.format(i)), 'wb').close()
+        query = metadata.content_type == 'com.adobe.pdf'
+        start = time.time()
+        results = [(path, metadata.list(path, attrs=FETCH))
+                   for path in metadata.find(query, only_in=root)]
+        report('find() + list() per path', len(results), time.time() - start)
+        start = time.time()
+        paths = metadata.find(query, only_in=root)
+        results = [pair for pair in metadata.list_many(paths, attrs=FETCH)]
+        report('find() + list_many()', len(results), time.time() - start)
+        start = time.time()
+        fetched = metadata.find(query, only_in=root, fetch=FETCH)
+        report('find(fetch=...)', len(fetched), time.time() - start)
+        assert sorted(fetched) == sorted(results)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure ``find()`` with a query that is any of many file names, run as
+one `mdfind` process and split into chunks run side by side.
+
+Usage: ``python benchmarks/bench_find_split.py [files] [names]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + os.environ['PATH']
+
+import metadata
+from metadata import planner, utils
+
+NAME = metadata.MDAttribute('kMDItemFSName')
+
+
+def report(label, count, seconds):
+    print('{:<30} {:8.3f} s   {:6d} results'.format(label, seconds, count))
+
+
+def main(count=200, names=5000):
+    root = tempfile.mkdtemp()
+    try:
+        for i in range(count):
+            open(os.path.join(root, 'file {:06d}.txt'.format(i)),
+                 'wb').close()
+        query = metadata.MDExpression(' || ', *[
+            NAME == 'file {:06d}.txt'.format(i * 3) for i in range(names)])
+        size = len(utils.text_type(query).encode('utf-8'))
+        print('query: {} names, {:.1f} KB'.format(names, size / 1e3))
+        budget = planner.QUERY_BUDGET
+        planner.QUERY_BUDGET = size
+        start = time.time()
+        try:
+            results = metadata.find(query, only_in=root)
+            report('one mdfind', len(results), time.time() - start)
+        except OSError as err:
+            print('one mdfind: {}'.format(err))
+        planner.QUERY_BUDGET = budget
+        for max_workers in (1, 4):
+            start = time.time()
+            results = metadata.find(query, only_in=root,
+                                    max_workers=max_workers)
+            report('split, max_workers={}'.format(max_workers),
+                   len(results), time.time() - start)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
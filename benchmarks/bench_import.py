@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure ``import metadata`` and first attribute access times.
+
+Each sample runs in a fresh interpreter with the stand-in `mdimport` from
+``benchmarks/bin`` on ``$PATH``:
+
+* ``import``: bare ``import metadata``
+* ``cold``: import plus ``metadata.name`` with an empty catalog cache
+* ``warm``: import plus ``metadata.name`` with the cache already written
+
+Usage: ``python benchmarks/bench_import.py [samples]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+IMPORT_ONLY = 'import metadata'
+IMPORT_AND_ACCESS = 'import metadata; metadata.name'
+
+
+def run(code, env):
+    """Time one fresh interpreter running ``code``, in milliseconds.
+
+    """
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', code], env=env, cwd=ROOT)
+    return (time.time() - start) * 1000
+
+
+def main(samples=10):
+    cache_dir = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + env['PATH']
+    env['METADATA_CACHE_DIR'] = cache_dir
+    env['FAKE_MDIMPORT_ATTRIBUTES'] = '500'
+    # measure installed-package conditions, with bytecode written
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    # baseline: interpreter start-up alone
+    results = {'python': [], 'import': [], 'cold': [], 'warm': []}
+    try:
+        for _ in range(samples):
+            results['python'].append(run('pass', env))
+            results['import'].append(run(IMPORT_ONLY, env))
+            shutil.rmtree(cache_dir)
+            results['cold'].append(run(IMPORT_AND_ACCESS, env))
+            results['warm'].append(run(IMPORT_AND_ACCESS, env))
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for name in ('python', 'import', 'cold', 'warm'):
+        times = sorted(results[name])
+        print('{:<8} min {:8.2f} ms   median {:8.2f} ms'.format(
+            name, times[0], times[len(times) // 2]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure queries answered by an ``Index`` of synthetic files, against
+checking every file with the compiled query.
+
+Usage: ``python benchmarks/bench_index.py [files]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import random
+import shutil
+import datetime
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import metadata
+
+NAME = metadata.MDAttribute('kMDItemFSName')
+SIZE = metadata.MDAttribute('kMDItemLogicalSize')
+TYPE = metadata.MDAttribute('kMDItemContentType')
+CREATED = metadata.MDAttribute('kMDItemContentCreationDate')
+WORDS = ['résumé', 'Report', 'photo', 'Notes', 'Ünïcode', 'invoice',
+         'draft', 'scan']
+TYPES = [('pdf', 'com.adobe.pdf'), ('txt', 'public.plain-text'),
+         ('jpg', 'public.jpeg'), ('py', 'public.python-script')]
+
+
+def records(count, seed=0):
+    """``(path, metadata)`` pairs of ``count`` synthetic files.
+
+    """
+    rand = random.Random(seed)
+    start = datetime.datetime(2010, 1, 1)
+    for i in range(count):
+        extension, content_type = TYPES[i % len(TYPES)]
+        name = '{} {} {:07d}.{}'.format(WORDS[i % 8], WORDS[i // 8 % 8], i,
+                                        extension)
+        yield ('/Volumes/Data/{:04d}/{}'.format(i // 1000, name), {
+            'name': name,
+            'logical_size': rand.randint(0, 10 ** 7),
+            'content_type': content_type,
+            'content_creation_date': start + datetime.timedelta(
+                seconds=rand.randint(0, 10 ** 9)),
+        })
+
+
+def queries():
+    return [
+        ('name ==', NAME == 'RESUME scan 0012344.pdf'),
+        ('name prefix', NAME == 'Draft Notes 00123*'),
+        ('*name*', NAME == '*0012345*'),
+        ('size range', metadata.optimize((SIZE >= 5000000) &
+                                         (SIZE <= 5000100))),
+        ('date range', metadata.optimize(
+            (CREATED >= datetime.datetime(2012, 3, 1)) &
+            (CREATED <= datetime.datetime(2012, 3, 2)))),
+        ('&& of four', (TYPE == 'com.adobe.pdf') & (NAME == '*invoice*') &
+         (SIZE > 9990000) & (CREATED > datetime.datetime(2015, 1, 1))),
+        ('|| of names', (NAME == '*0000042*') | (NAME == '*0900042*')),
+    ]
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best, result
+
+
+def main(count=1000000):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        index = metadata.Index('/Volumes/Data',
+                               attrs=[NAME, SIZE, TYPE, CREATED],
+                               path=os.path.join(tmp_dir, 'index'),
+                               backend=metadata.LocalBackend())
+        data = list(records(count))
+        start = time.time()
+        index.build(data)
+        print('build: {:.1f} s for {} files'.format(time.time() - start,
+                                                   count))
+        start = time.time()
+        metadata.Index(index.root, attrs=index.attrs, path=index.path,
+                       backend=index.backend)
+        print('load: {:.1f} s'.format(time.time() - start))
+        for label, query in queries():
+            seconds, results = timed(lambda: index.find(query))
+            matches = query.compile()
+            scan, _ = timed(lambda: [path for path, md_dict in data
+                                     if matches(md_dict)], 1)
+            print('{:<14} {:9.2f} ms   {:9.1f} ms scanning   {:6d} results'
+                  .format(label, seconds * 1000, scan * 1000, len(results)))
+        # changes as an `Updater` applies them, in batches of 500
+        changed = [(path, dict(md_dict, logical_size=0))
+                   for path, md_dict in data[::max(1, count // 1000)]]
+        start = time.time()
+        for begin in range(0, len(changed), 500):
+            index.update(changed[begin:begin + 500])
+        print('update: {:.1f} ms for {} changed files'.format(
+            (time.time() - start) * 1000, len(changed)))
+        for label, query in queries()[:3]:
+            seconds, results = timed(lambda: index.find(query))
+            print('{:<14} {:9.2f} ms after the update'.format(
+                label, seconds * 1000))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
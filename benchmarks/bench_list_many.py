@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure `mdls` throughput of ``list()`` against ``list_many()``.
+
+Lists a directory of generated files with the stand-in `mdls` from
+``benchmarks/bin``, once per file with ``list()`` and then with
+``list_many()`` at increasing chunk sizes, and finally fetching only
+three attributes with ``attrs``. Each file is padded with ``width`` extra
+synthetic attributes.
+
+Usage: ``python benchmarks/bench_list_many.py [files] [width]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + os.environ['PATH']
+
+import metadata
+
+CHUNK_SIZES = (10, 100, 1000)
+ATTRS = ['content_type', 'logical_size', 'content_creation_date']
+
+
+def make_files(count):
+    root = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        path = os.path.join(root, 'file {:06d}.pdf'.format(i))
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n' * (i % 50))
+        paths.append(path)
+    return root, paths
+
+
+def report(label, count, seconds):
+    print('{:<22} {:8.3f} s   {:10.1f} files/s'.format(
+        label, seconds, count / seconds))
+
+
+def main(count=2000, width=100):
+    os.environ['FAKE_MDLS_WIDTH'] = str(width)
+    root, paths = make_files(count)
+    try:
+        # one process per file is slow, so only time a sample
+        sample = paths[:min(count, 50)]
+        start = time.time()
+        for path in sample:
+            metadata.list(path)
+        report('list()', len(sample), time.time() - start)
+        for chunk_size in CHUNK_SIZES:
+            start = time.time()
+            listed = sum(1 for _ in metadata.list_many(paths, chunk_size))
+            assert listed == count
+            report('list_many({})'.format(chunk_size), count,
+                   time.time() - start)
+        start = time.time()
+        listed = sum(1 for _ in metadata.list_many(paths, 100, attrs=ATTRS))
+        assert listed == count
+        report('list_many(100, attrs)', count, time.time() - start)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure parsing of `mdls -plist -` output against the old line parser.
+
+Renders synthetic listings for many files with the stand-in tools in
+``benchmarks/bin``, both as the plain `mdls` text and as `mdls -plist -`
+property lists, then times parsing each. No processes are started.
+
+Usage: ``python benchmarks/bench_parse_listing.py [files] [extra attributes]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, os.path.join(HERE, 'bin'))
+
+import fakespotlight
+from metadata import functions, utils
+
+
+def legacy_parse_listing(output):
+    """The `split('=')` line parser that `mdls -plist -` replaced.
+
+    """
+    md = [[y.strip()
+           for y in line.split('=')]
+          for line in output]
+    listed_item, md_dict, last_key = [], {}, None
+    for item in md:
+        if len(item) == 2:
+            k, v = item
+            if last_key is not None and k <= last_key:
+                yield md_dict
+                md_dict = {}
+            last_key = k
+            if v == '(':
+                listed_key = utils.clean_attribute(k)
+            else:
+                try:
+                    val = int(v)
+                except (ValueError, TypeError):
+                    val = v.replace('"', '')
+                if val in ('""', '(null)'):
+                    val = None
+                key = utils.clean_attribute(k)
+                md_dict[key] = val
+        elif len(item) == 1 and item[0] != ')':
+            value = item[0].replace('"', '')
+            listed_item.append(value)
+        elif len(item) == 1 and item[0] == ')':
+            md_dict[listed_key] = listed_item
+            listed_item = []
+    if last_key is not None:
+        yield md_dict
+
+
+def make_outputs(count, width):
+    stat = os.stat(HERE)
+    listings, plists = [], []
+    for i in range(count):
+        attrs = fakespotlight.attributes('/Volumes/Fake/résumé {:07d}.pdf'
+                                         .format(i), stat, width)
+        listings.append(fakespotlight.format_listing(attrs))
+        plists.append(fakespotlight.format_plist(attrs))
+    return (''.join(listings).encode('utf-8'),
+            ''.join(plists).encode('utf-8'))
+
+
+def report(label, count, size, seconds):
+    print('{:<18} {:8.3f} s   {:10.1f} files/s   {:8.1f} MB/s'.format(
+        label, seconds, count / seconds, size / seconds / 1e6))
+
+
+def main(count=5000, width=0):
+    listing, plist = make_outputs(count, width)
+    start = time.time()
+    parsed = [md_dict for md_dict in
+              legacy_parse_listing(utils.output_lines(listing))]
+    report('line parser', count, len(listing), time.time() - start)
+    assert len(parsed) == count
+    start = time.time()
+    parsed = [md_dict for md_dict in functions._parse_plists(plist)]
+    report('plist parser', count, len(plist), time.time() - start)
+    assert len(parsed) == count
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure in-process filtering of metadata records with compiled queries.
+
+Usage: ``python benchmarks/bench_predicates.py [records]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from metadata import MDAttribute
+
+NAME = MDAttribute('kMDItemFSName')
+SIZE = MDAttribute('kMDItemLogicalSize')
+CREATED = MDAttribute('kMDItemContentCreationDate')
+TYPE = MDAttribute('kMDItemContentType')
+
+QUERIES = [
+    ('string wildcard', NAME == '*résumé 1*'),
+    ('number', SIZE > 500000),
+    ('date range', CREATED.in_range('2014-01-01', '2014-06-30')),
+    ('expression', ((NAME == '*.pdf') & (SIZE < 100000)) |
+                   (TYPE == 'public.jpeg')),
+]
+
+
+def make_records(count):
+    extensions = ('pdf', 'jpg', 'txt')
+    return [{'name': 'résumé {}.{}'.format(i, extensions[i % 3]),
+             'logical_size': (i * 7919) % 1000000,
+             'content_type': ('com.adobe.pdf', 'public.jpeg',
+                              'public.plain-text')[i % 3],
+             'content_creation_date': '2014-{:02d}-{:02d} 12:00:00 +0000'
+                                      .format(i % 12 + 1, i % 28 + 1)}
+            for i in range(count)]
+
+
+def main(count=200000):
+    records = make_records(count)
+    for label, query in QUERIES:
+        start = time.time()
+        predicate = query.compile()
+        compiled = time.time() - start
+        start = time.time()
+        matched = sum(1 for record in records if predicate(record))
+        seconds = time.time() - start
+        print('{:<16} compile {:7.3f} ms   filter {:7.3f} s   '
+              '{:10.0f} records/s   {} matches'.format(
+                  label, compiled * 1000, seconds, count / seconds, matched))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure building and rendering many similar query expressions.
+
+Builds ``count`` expressions from a small vocabulary of comparisons, as
+generated queries tend to be, renders each twice and reports the time
+and the memory the expressions hold.
+
+Usage: ``python benchmarks/bench_query_build.py [expressions]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from metadata import MDAttribute
+from metadata.utils import text_type
+
+NAME = MDAttribute('kMDItemFSName')
+SIZE = MDAttribute('kMDItemLogicalSize')
+TYPE = MDAttribute('kMDItemContentType')
+TYPES = ('com.adobe.pdf', 'public.jpeg', 'public.plain-text')
+
+
+def build(count):
+    return [((NAME == '*report {}*'.format(i % 100)) &
+             (SIZE > (i % 7) * 1000)) |
+            (TYPE == TYPES[i % 3])
+            for i in range(count)]
+
+
+def main(count=50000):
+    tracemalloc.start()
+    start = time.time()
+    expressions = build(count)
+    built = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    print('{:<10} {:8.3f} s   {:8.1f} MB'.format('build', built, size / 1e6))
+    for label in ('render', 'render again'):
+        start = time.time()
+        for expression in expressions:
+            text_type(expression)
+        print('{:<10} {:8.3f} s'.format(label, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
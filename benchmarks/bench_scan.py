@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure ``scan()`` throughput as the number of workers grows.
+
+Scans a tree of generated files with the stand-in `mdls` from
+``benchmarks/bin``.
+
+Usage: ``python benchmarks/bench_scan.py [files]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+os.environ['PATH'] = os.path.join(HERE, 'bin') + os.pathsep + os.environ['PATH']
+
+import metadata
+
+WORKERS = (1, 2, 4, 8)
+
+
+def make_tree(count, per_dir=100):
+    root = tempfile.mkdtemp()
+    for i in range(count):
+        subdir = os.path.join(root, 'dir {:04d}'.format(i // per_dir))
+        if not os.path.isdir(subdir):
+            os.mkdir(subdir)
+        with open(os.path.join(subdir, 'file {:06d}.txt'.format(i)),
+                  'wb') as f:
+            f.write(b'x' * (i % 100))
+    return root
+
+
+def main(count=5000):
+    root = make_tree(count)
+    try:
+        for workers in WORKERS:
+            start = time.time()
+            scanned = sum(1 for _ in metadata.scan(root, workers=workers,
+                                                   batch_size=100))
+            seconds = time.time() - start
+            assert scanned == count
+            print('workers={:<3} {:8.3f} s   {:10.1f} files/s'.format(
+                workers, seconds, count / seconds))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
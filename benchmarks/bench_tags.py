@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Measure bulk tagging with ``write_tags()`` and ``read_tags()``.
+
+Tags a directory of generated files, tags them again with the same tags
+(which skips every write), and reads the tags back. If an `xattr` command
+is on ``$PATH``, a sample is also tagged with ``write()`` for comparison.
+
+Usage: ``python benchmarks/bench_tags.py [files]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import metadata
+
+TAGS = ['Red', 'Projects', 'Tōnÿ Stårk']
+
+
+def report(label, count, seconds):
+    print('{:<22} {:8.3f} s   {:10.1f} files/s'.format(
+        label, seconds, count / seconds))
+
+
+def has_xattr_command():
+    return any(os.access(os.path.join(directory, 'xattr'), os.X_OK)
+               for directory in os.environ['PATH'].split(os.pathsep))
+
+
+def main(count=10000):
+    root = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(count):
+            path = os.path.join(root, 'file {:06d}.txt'.format(i))
+            open(path, 'wb').close()
+            paths.append(path)
+        start = time.time()
+        assert len(metadata.write_tags(paths, TAGS)) == count
+        report('write_tags()', count, time.time() - start)
+        start = time.time()
+        assert metadata.write_tags(paths, TAGS) == []
+        report('write_tags(), same', count, time.time() - start)
+        start = time.time()
+        assert len(metadata.read_tags(paths)) == count
+        report('read_tags()', count, time.time() - start)
+        if has_xattr_command():
+            sample = paths[:min(count, 100)]
+            start = time.time()
+            for path in sample:
+                metadata.write(path, TAGS)
+            report('write() per file', len(sample), time.time() - start)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,301 @@
+# encoding: utf-8
+"""Shared helpers for the stand-in Spotlight command line tools.
+
+Attributes are derived from ``os.stat`` and the file extension. Set
+``FAKE_MDLS_WIDTH`` to pad every file with that many extra synthetic
+attributes.
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import re
+import sys
+import time
+import fnmatch
+import calendar
+import unicodedata
+
+CONTENT_TYPES = {
+    '.pdf': ('com.adobe.pdf', ['com.adobe.pdf', 'public.data',
+                               'public.item', 'public.composite-content',
+                               'public.content']),
+    '.txt': ('public.plain-text', ['public.plain-text', 'public.text',
+                                   'public.data', 'public.item',
+                                   'public.content']),
+    '.jpg': ('public.jpeg', ['public.jpeg', 'public.image', 'public.data',
+                             'public.item', 'public.content']),
+    '.py': ('public.python-script', ['public.python-script',
+                                     'public.shell-script', 'public.script',
+                                     'public.source-code',
+                                     'public.plain-text', 'public.text',
+                                     'public.data', 'public.item',
+                                     'public.content']),
+}
+DEFAULT_TYPE = ('public.data', ['public.data', 'public.item'])
+
+if sys.version_info[0] == 2:
+    text_type = unicode
+    integer_types = (int, long)
+else:
+    text_type = str
+    integer_types = (int,)
+
+
+class Date(float):
+    """Timestamp that `mdls` prints as a date."""
+
+
+def stdout():
+    return getattr(sys.stdout, 'buffer', sys.stdout)
+
+
+def fs_path(path):
+    """``path`` as text, whatever type ``sys.argv`` or ``os`` returned.
+
+    """
+    if not isinstance(path, text_type):
+        path = path.decode('utf-8', 'surrogateescape'
+                           if sys.version_info[0] > 2 else 'replace')
+    return path
+
+
+def fs_bytes(path):
+    """``path`` as bytes, ready to write to stdout.
+
+    """
+    if isinstance(path, bytes):
+        return path
+    if hasattr(os, 'fsencode'):
+        return os.fsencode(path)
+    return path.encode('utf-8')
+
+
+def attributes(path, stat=None, width=None):
+    """Synthetic Spotlight attributes for ``path``, keyed by attribute id.
+
+    """
+    if stat is None:
+        stat = os.stat(path)
+    if width is None:
+        width = int(os.environ.get('FAKE_MDLS_WIDTH', 0))
+    name = unicodedata.normalize('NFC', os.path.basename(fs_path(path)))
+    content_type, type_tree = CONTENT_TYPES.get(
+        os.path.splitext(name)[1].lower(), DEFAULT_TYPE)
+    attrs = {
+        '_kMDItemOwnerUserID': stat.st_uid,
+        'kMDItemContentCreationDate': Date(stat.st_ctime),
+        'kMDItemContentModificationDate': Date(stat.st_mtime),
+        'kMDItemContentType': content_type,
+        'kMDItemContentTypeTree': type_tree,
+        'kMDItemDateAdded': Date(stat.st_ctime),
+        'kMDItemDisplayName': name,
+        'kMDItemFSContentChangeDate': Date(stat.st_mtime),
+        'kMDItemFSCreationDate': Date(stat.st_ctime),
+        'kMDItemFSCreatorCode': '',
+        'kMDItemFSFinderFlags': 0,
+        'kMDItemFSHasCustomIcon': None,
+        'kMDItemFSInvisible': int(name.startswith('.')),
+        'kMDItemFSIsExtensionHidden': 0,
+        'kMDItemFSIsStationery': None,
+        'kMDItemFSLabel': 0,
+        'kMDItemFSName': name,
+        'kMDItemFSNodeCount': None,
+        'kMDItemFSOwnerGroupID': stat.st_gid,
+        'kMDItemFSOwnerUserID': stat.st_uid,
+        'kMDItemFSSize': stat.st_size,
+        'kMDItemFSTypeCode': '',
+        'kMDItemKind': content_type.split('.')[-1].upper(),
+        'kMDItemLogicalSize': stat.st_size,
+        'kMDItemPhysicalSize': (stat.st_size // 4096 + 1) * 4096,
+        'kMDItemUserTags': ['fake', 'tag ☆'],
+    }
+    for i in range(width):
+        attrs['kMDItemSynthetic{:05d}'.format(i)] = (
+            'synthetic value {} of {}'.format(i, name))
+    return attrs
+
+
+## `mdls` output  -------------------------------------------------------------
+
+def cocoa_escape(text):
+    """Escape non-ASCII characters the way Cocoa describes strings.
+
+    """
+    return ''.join(char if ord(char) < 128 else '\\U{:04x}'.format(ord(char))
+                   for char in unicodedata.normalize('NFD', text))
+
+
+def format_value(value, in_array=False):
+    if value is None:
+        return '(null)'
+    if isinstance(value, Date):
+        return time.strftime('%Y-%m-%d %H:%M:%S +0000', time.gmtime(value))
+    if isinstance(value, (int, float)):
+        return '{}'.format(value)
+    text = value.replace('\\', '\\\\').replace('"', '\\"')
+    if in_array:
+        text = cocoa_escape(text)
+    return '"' + text + '"'
+
+
+def format_listing(attrs, names=None):
+    """Render ``attrs`` the way `mdls` prints a single file.
+
+    """
+    lines = []
+    for key in names or sorted(attrs):
+        value = attrs.get(key)
+        if isinstance(value, list):
+            lines.append('{:<30} = ('.format(key))
+            lines.append(',\n'.join('    ' + format_value(item, True)
+                                    for item in value))
+            lines.append(')')
+        else:
+            lines.append('{:<30} = {}'.format(key, format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def format_attr(value):
+    """Render ``value`` the way `mdfind -attr` prints it.
+
+    """
+    if isinstance(value, list):
+        return '(\n{}\n)'.format(',\n'.join('    ' + format_value(item, True)
+                                           for item in value))
+    if isinstance(value, text_type):
+        return value
+    return format_value(value)
+
+
+PLIST_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" '
+                '"http://www.apple.com/DTDs/PropertyList-1.0.dtd">\n'
+                '<plist version="1.0">\n')
+
+
+def plist_value(value):
+    if isinstance(value, Date):
+        return '<date>{}</date>'.format(
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(value)))
+    if isinstance(value, bool):
+        return '<true/>' if value else '<false/>'
+    if isinstance(value, integer_types):
+        return '<integer>{}</integer>'.format(value)
+    if isinstance(value, float):
+        return '<real>{!r}</real>'.format(value)
+    if isinstance(value, list):
+        return '<array>\n{}\n\t</array>'.format(
+            '\n'.join('\t\t' + plist_value(item) for item in value))
+    text = value.replace('&', '&amp;').replace('<', '&lt;')\
+                .replace('>', '&gt;')
+    return '<string>{}</string>'.format(text)
+
+
+def format_plist(attrs, names=None):
+    """Render ``attrs`` the way `mdls -plist -` prints a single file.
+
+    Attributes without a value are left out, as `mdls` does.
+
+    """
+    lines = [PLIST_HEADER + '<dict>']
+    for key in names or sorted(attrs):
+        value = attrs.get(key)
+        if value is None:
+            continue
+        lines.append('\t<key>{}</key>'.format(key))
+        lines.append('\t' + plist_value(value))
+    lines.append('</dict>\n</plist>\n')
+    return '\n'.join(lines)
+
+
+## Query evaluation  ----------------------------------------------------------
+
+COMPARISON_RE = re.compile(
+    r'InRange\((?P<range_attr>\w+), (?P<low>[^,]+), (?P<high>[^)]+\)?)\)'
+    r'|(?P<attr>\w+) (?P<op>==|!=|<=|>=|<|>) '
+    r'(?P<value>"(?:[^"\\]|\\.)*"\w*|\$time\.iso\([^)]*\)|[-\d.]+)')
+
+
+def parse_value(text):
+    """Turn a query value into a Python value and string modifiers.
+
+    """
+    if text.startswith('$time.iso('):
+        iso = text[len('$time.iso('):-1]
+        return calendar.timegm(time.strptime(iso[:19],
+                                             '%Y-%m-%dT%H:%M:%S')), ''
+    if text.startswith('"'):
+        end = text.rindex('"')
+        value = re.sub(r'\\(.)', r'\1', text[1:end])
+        return value, text[end + 1:]
+    return float(text), ''
+
+
+def compare(actual, op, expected, modifiers):
+    if actual is None:
+        return op == '!='
+    if isinstance(actual, list):
+        matches = [compare(item, '==', expected, modifiers)
+                   for item in actual]
+        return any(matches) if op == '==' else not any(matches)
+    if isinstance(expected, text_type):
+        actual = '{}'.format(actual)
+        if 'c' in modifiers:
+            actual, expected = actual.lower(), expected.lower()
+        if 'd' in modifiers:
+            actual = strip_diacritics(actual)
+            expected = strip_diacritics(expected)
+        matched = fnmatch.fnmatchcase(actual, expected)
+        return matched if op == '==' else not matched
+    return {'==': actual == expected, '!=': actual != expected,
+            '<': actual < expected, '>': actual > expected,
+            '<=': actual <= expected, '>=': actual >= expected}[op]
+
+
+def strip_diacritics(text):
+    return ''.join(char for char in unicodedata.normalize('NFD', text)
+                   if not unicodedata.combining(char))
+
+
+def matcher(query):
+    """Compile a Spotlight query string into a predicate over attributes.
+
+    Supports comparisons of strings (with wildcards and modifiers),
+    numbers and `$time.iso()` dates, ``InRange``, ``&&``, ``||`` and
+    parentheses.
+
+    """
+    comparisons = []
+
+    def replace(match):
+        comparisons.append(match)
+        return ' _c({}) '.format(len(comparisons) - 1)
+
+    source = COMPARISON_RE.sub(replace, query)
+    source = source.replace('&&', ' and ').replace('||', ' or ')
+    code = compile(source.strip() or 'True', '<query>', 'eval')
+
+    def evaluate(attrs):
+        def _c(i):
+            match = comparisons[i]
+            if match.group('range_attr'):
+                actual = attrs.get(match.group('range_attr'))
+                low, _ = parse_value(match.group('low').strip())
+                high, _ = parse_value(match.group('high').strip())
+                return actual is not None and low <= actual <= high
+            value, modifiers = parse_value(match.group('value'))
+            return compare(attrs.get(match.group('attr')),
+                           match.group('op'), value, modifiers)
+        return eval(code, {'_c': _c, '__builtins__': {}})
+
+    return evaluate
+
+
+def walk(root):
+    """Generate full paths of files and directories under ``root``.
+
+    """
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in sorted(dirnames) + sorted(filenames):
+            yield os.path.join(dirpath, name)
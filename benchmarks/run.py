@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Run the benchmark suite against the stand-in Spotlight tools.
+
+Everything runs on plain Linux: `mdfind`, `mdls`, `mdimport` and `xattr`
+in ``benchmarks/bin`` generate synthetic output (non-ASCII names, as wide
+as asked for) in place of a Spotlight index. Measured:
+
+* ``import``: ``import metadata`` in a fresh interpreter, less the
+  interpreter's own start-up
+* ``find_latency``: ``find()`` with 10 results
+* ``find``/``iter_find``: results per second at each result count
+* ``list_parse``: parsing `mdls -plist -` output, without processes
+* ``list_many``: ``list_many()`` through the stand-in `mdls`
+* ``render``: building and rendering query expressions
+* ``write``: ``write()`` through the stand-in `xattr`
+* ``backend_*``: ``find()`` and ``list_many()`` over a generated tree,
+  through each backend: the stand-in Spotlight tools and the in-process
+  ``LocalBackend``
+* ``index``: building an ``Index`` of synthetic files, and the mean time
+  of the queries in ``bench_index.py``
+
+Each run is appended as one JSON line to the results file, and compared
+with the last run there from the same host, Python and scale, so that
+regressions show up as they happen.
+
+Usage: ``python benchmarks/run.py [--scale small|medium|large]
+[--results 10,1000] [--width 50] [--output results.jsonl] [--no-record]``
+
+"""
+from __future__ import unicode_literals, print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BIN = os.path.join(HERE, 'bin')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BIN)
+sys.path.insert(0, HERE)
+os.environ['PATH'] = BIN + os.pathsep + os.environ['PATH']
+
+import fakespotlight
+import bench_index
+import metadata
+from metadata import functions, utils
+
+# result counts for `find`, files for `list_many`, expressions to render
+SCALES = {
+    'small': {'results': [10, 1000], 'files': 1000, 'queries': 10000},
+    'medium': {'results': [10, 10000, 100000], 'files': 10000,
+               'queries': 50000},
+    'large': {'results': [10, 10000, 100000, 1000000], 'files': 100000,
+              'queries': 200000},
+}
+RESULTS_FILE = os.path.join(HERE, 'results.jsonl')
+# changes smaller than this are noise
+THRESHOLD = 0.10
+
+
+def timed(func, repeat=1):
+    """Best time of ``repeat`` calls of ``func``, in seconds.
+
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        seconds = time.time() - start
+        if best is None or seconds < best:
+            best = seconds
+    return best
+
+
+## Benchmarks  ----------------------------------------------------------------
+
+def bench_import(samples=5):
+    """Milliseconds ``import metadata`` adds to interpreter start-up.
+
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run(code):
+        return timed(lambda: subprocess.check_call(
+            [sys.executable, '-c', code], env=env, cwd=ROOT), samples)
+
+    return {'import_ms': (run('import metadata') - run('pass')) * 1000}
+
+
+def bench_find(counts):
+    results = {}
+    query = metadata.MDAttribute('kMDItemFSName') == '*'
+    for count in counts:
+        os.environ['FAKE_MDFIND_RESULTS'] = str(count)
+        try:
+            if count <= 10:
+                seconds = timed(lambda: metadata.find(query), 10)
+                results['find_latency_ms'] = seconds * 1000
+                continue
+            seconds = timed(lambda: metadata.find(query))
+            results['find_{}_per_s'.format(count)] = count / seconds
+            seconds = timed(lambda: [path for path in
+                                     metadata.iter_find(query)])
+            results['iter_find_{}_per_s'.format(count)] = count / seconds
+        finally:
+            del os.environ['FAKE_MDFIND_RESULTS']
+    return results
+
+
+def bench_list_parse(count, width):
+    stat = os.stat(HERE)
+    output = ''.join(
+        fakespotlight.format_plist(fakespotlight.attributes(
+            '/Volumes/Fake/Dokumente/résumé {:07d}.pdf'.format(i),
+            stat, width))
+        for i in range(count)).encode('utf-8')
+    seconds = timed(lambda: [md_dict for md_dict in
+                             functions._parse_plists(output)], 3)
+    return {'list_parse_files_per_s': count / seconds,
+            'list_parse_mb_per_s': len(output) / seconds / 1e6}
+
+
+def bench_list_many(count, width):
+    paths = ['/Volumes/Fake/Dokumente/résumé {:07d}.pdf'.format(i)
+             for i in range(count)]
+    os.environ['FAKE_MDLS_SYNTHETIC'] = '1'
+    os.environ['FAKE_MDLS_WIDTH'] = str(width)
+    try:
+        seconds = timed(lambda: [pair for pair in metadata.list_many(paths)])
+        projected = timed(lambda: [pair for pair in metadata.list_many(
+            paths, attrs=['name', 'logical_size'])])
+    finally:
+        del os.environ['FAKE_MDLS_SYNTHETIC'], os.environ['FAKE_MDLS_WIDTH']
+    return {'list_many_files_per_s': count / seconds,
+            'list_many_attrs_files_per_s': count / projected}
+
+
+def bench_render(count):
+    name = metadata.MDAttribute('kMDItemFSName')
+    size = metadata.MDAttribute('kMDItemLogicalSize')
+    kind = metadata.MDAttribute('kMDItemContentType')
+    kinds = ('com.adobe.pdf', 'public.jpeg', 'public.plain-text')
+
+    def build():
+        return [((name == '*résumé {}*'.format(i % 100)) &
+                 (size > (i % 7) * 1000)) | (kind == kinds[i % 3])
+                for i in range(count)]
+
+    built = timed(build, 3)
+    expressions = build()
+    rendered = timed(lambda: [utils.text_type(expression)
+                              for expression in expressions], 3)
+    names = metadata.MDExpression(' || ', *[
+        name == 'Dokument {:05d}.pdf'.format(i) for i in range(20000)])
+    fan_out = timed(lambda: utils.text_type(metadata.optimize(names)), 3)
+    return {'render_build_us': built / count * 1e6,
+            'render_us': rendered / count * 1e6,
+            'render_20000_names_ms': fan_out * 1000}
+
+
+def bench_write(count):
+    root = tempfile.mkdtemp()
+    os.environ['FAKE_XATTR_DRY_RUN'] = '1'
+    try:
+        paths = []
+        for i in range(count):
+            path = os.path.join(root, 'Résumé {:05d}.txt'.format(i))
+            open(path, 'wb').close()
+            paths.append(path)
+        seconds = timed(lambda: [metadata.write(path, ['Red', 'Tōnÿ'])
+                                 for path in paths])
+    finally:
+        del os.environ['FAKE_XATTR_DRY_RUN']
+        shutil.rmtree(root)
+    return {'write_files_per_s': count / seconds}
+
+
+def bench_backends(count):
+    root = tempfile.mkdtemp()
+    extensions = ('.pdf', '.txt', '.jpg', '.py', '')
+    try:
+        paths = []
+        for i in range(count):
+            directory = os.path.join(root, 'Dossier {:03d}'.format(i // 1000))
+            if not os.path.isdir(directory):
+                os.mkdir(directory)
+            path = os.path.join(directory, 'résumé {:07d}{}'.format(
+                i, extensions[i % len(extensions)]))
+            with open(path, 'wb') as fp:
+                fp.write(b'x' * (i % 500))
+            paths.append(path)
+        name = metadata.MDAttribute('kMDItemFSName')
+        size = metadata.MDAttribute('kMDItemLogicalSize')
+        query = (name == '*.pdf') & (size > 250)
+        results = {}
+        backends = (('spotlight', metadata.SpotlightBackend()),
+                    ('local', metadata.LocalBackend()))
+        for label, backend in backends:
+            previous = metadata.set_backend(backend)
+            try:
+                seconds = timed(lambda: metadata.find(query, only_in=root))
+                listed = timed(lambda: [pair for pair in metadata.list_many(
+                    paths, attrs=['name', 'logical_size'])])
+            finally:
+                metadata.set_backend(previous)
+            results['backend_{}_find_files_per_s'.format(label)] = \
+                count / seconds
+            results['backend_{}_list_many_files_per_s'.format(label)] = \
+                count / listed
+    finally:
+        shutil.rmtree(root)
+    return results
+
+
+def bench_index_queries(count):
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        index = metadata.Index('/Volumes/Data', attrs=[
+            bench_index.NAME, bench_index.SIZE, bench_index.TYPE,
+            bench_index.CREATED], path=os.path.join(tmp_dir, 'index'),
+            backend=metadata.LocalBackend())
+        records = [record for record in bench_index.records(count)]
+        built = timed(lambda: index.build(records))
+        queries = [query for _, query in bench_index.queries()]
+        seconds = timed(lambda: [index.find(query) for query in queries], 5)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return {'index_build_files_per_s': count / built,
+            'index_query_ms': seconds / len(queries) * 1000}
+
+
+## Recording  -----------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            stderr=open(os.devnull, 'wb')).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_run(path, run):
+    """Last recorded run comparable with ``run``, if any.
+
+    """
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path) as fp:
+        for line in fp:
+            record = json.loads(line)
+            if all(record.get(key) == run[key]
+                   for key in ('host', 'python', 'scale')):
+                previous = record
+    return previous
+
+
+def report(run, previous):
+    for name in sorted(run['metrics']):
+        value = run['metrics'][name]
+        line = '{:<40} {:14.2f}'.format(name, value)
+        old = (previous or {}).get('metrics', {}).get(name)
+        if old:
+            change = (value - old) / old
+            # for times lower is better, for rates higher is
+            worse = change > 0 if name.endswith(('_ms', '_us')) \
+                else change < 0
+            flag = ''
+            if abs(change) >= THRESHOLD:
+                flag = '  REGRESSION' if worse else '  improved'
+            line += '   {:+7.1%} vs {}{}'.format(
+                change, previous.get('commit') or 'previous', flag)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--results', help='comma-separated result counts '
+                        'for find, up to 1000000')
+    parser.add_argument('--width', type=int, default=50,
+                        help='extra synthetic attributes per file')
+    parser.add_argument('--output', default=RESULTS_FILE)
+    parser.add_argument('--no-record', action='store_true')
+    args = parser.parse_args(argv)
+    scale = dict(SCALES[args.scale])
+    if args.results:
+        scale['results'] = [int(count) for count in args.results.split(',')]
+    cache_dir = tempfile.mkdtemp()
+    os.environ['METADATA_CACHE_DIR'] = cache_dir
+    metrics = {}
+    try:
+        metrics.update(bench_import())
+        metrics.update(bench_find(scale['results']))
+        metrics.update(bench_list_parse(scale['files'], args.width))
+        metrics.update(bench_list_many(scale['files'], args.width))
+        metrics.update(bench_render(scale['queries']))
+        metrics.update(bench_write(min(scale['files'], 1000)))
+        metrics.update(bench_backends(min(scale['files'], 10000)))
+        metrics.update(bench_index_queries(scale['files']))
+    finally:
+        shutil.rmtree(cache_dir)
+    run = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'scale': '{} width={} results={}'.format(
+            args.scale, args.width,
+            ','.join(str(count) for count in scale['results'])),
+        'metrics': metrics,
+    }
+    report(run, previous_run(args.output, run))
+    if not args.no_record:
+        with open(args.output, 'a') as fp:
+            fp.write(json.dumps(run, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
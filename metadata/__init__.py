@@ -9,45 +9,79 @@ __license__ = 'MIT'
 __copyright__ = 'Copyright © 2014 Stephen Margheim'
 
 import sys
-import itertools
+import types
 
-import utils
-from functions import find, list, write
-from classes import MDAttribute, MDComparison, MDExpression
+from . import utils
+from . import catalog
+from .functions import find, iter_find, list, list_many, write
+from .functions import SpotlightBackend, set_backend
+from .backends import Backend, LocalBackend
+from .index import Index
+from .updater import Updater
+from .tags import read_tags, write_tags
+from .scanner import scan
+from .watcher import watch
+from .cache import FindCache, MetadataCache
+from .optimizer import optimize
+from .utils import Executor, ProcessTimeout, set_executor
+from .classes import MDAttribute, MDComparison, MDExpression
+from .items import MDItem, Page
+from .catalog import attributes_generator
 
+# coroutines, from `metadata.aio`; importing `asyncio` is slow, so they
+# are only imported when first used
+_ASYNC_NAMES = ('async_find', 'async_list', 'async_list_many', 'async_write')
 
-def attributes_generator():
-    """Generate dictionaries with data for all OS X metadata attributes
 
-    :returns: data on all OS X metadata attributes
-    :rtype: ``generator`` of ``dict``s
+class _AttributeModule(types.ModuleType):
+    """Module type that resolves metadata attributes on first access.
+
+    Loading the attribute catalog and creating an :class:`MDAttribute`
+    is deferred until a name that isn't a regular module member is
+    requested, so ``import metadata`` never shells out to `mdimport`.
+    The coroutines of :mod:`metadata.aio` are imported the same way.
 
     """
-    # get all OS X metadata attributes
-    attributes = utils.run_process(['mdimport', '-A'])
-    # prepare key names for the four columns
-    keys = ('id', 'name', 'description', 'aliases')
-    # create dicts, mapping ``keys`` to an item's columns
-    for attribute in attributes:
-        attribute_data = [item.replace("'", "")
-                          for item in attribute.split('\t\t')]
-        keyed_data = itertools.izip(keys, attribute_data)
-        yield dict(keyed_data)
-
-# dynamically create module attribute objects
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        if name in _ASYNC_NAMES and sys.version_info >= (3, 5):
+            from . import aio
+            value = getattr(aio, name)
+        elif name == 'attributes':
+            value = sorted(self._keyed_records())
+        else:
+            info = self._keyed_records().get(name)
+            if info is None:
+                msg = "module '{}' has no attribute '{}'".format(__name__,
+                                                                name)
+                raise AttributeError(msg)
+            value = MDAttribute(info)
+        # cache on the module so later lookups are plain attribute access
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        names = set(self.__dict__) | set(self._keyed_records())
+        if sys.version_info >= (3, 5):
+            names.update(_ASYNC_NAMES)
+        return sorted(names)
+
+    def _keyed_records(self):
+        """Map Pythonic keys to catalog records.
+
+        """
+        return catalog.index()['key']
+
+
+# swap this module for an `_AttributeModule` holding the same namespace;
+# keep a reference to the original so its globals are not cleared
 __module = sys.modules[__name__]
-for __info in attributes_generator():
-    __name = utils.clean_attribute(__info['id'])
-    setattr(__module, __name, MDAttribute(__info['id']))
-
-# set ``attributes`` var, filtering out non metadata
-attributes = [attr
-              for attr in __module.__dict__.keys()
-              if not attr.startswith('__')
-              if not attr.startswith('MD')
-              if not attr in ('find', 'list', 'write',
-                              'utils', 'sys', 'itertools',
-                              'unicode_literals')]
+__lazy = _AttributeModule(__name__, __doc__)
+__lazy.__dict__.update(__module.__dict__)
+__lazy.__dict__['_original_module'] = __module
+sys.modules[__name__] = __lazy
 
 
 if __name__ == '__main__':
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Coroutine versions of :func:`find`, :func:`list`, :func:`list_many` and
+:func:`write`, built on :mod:`asyncio` subprocesses (Python 3.5+).
+
+Every call runs under a semaphore, so no more than
+:data:`MAX_CONCURRENCY` metadata commands run at once per event loop
+unless a different semaphore is passed in. Pass ``timeout`` (in seconds)
+to give up on slow commands; on timeout the child process is killed and
+:class:`ProcessTimeout` raised, as by the synchronous functions.
+
+Commands are run by the executor of :func:`set_executor`. The default
+one's commands run as :mod:`asyncio` subprocesses, which are killed on
+cancellation too; any other executor's run in a thread, and aren't.
+
+"""
+from __future__ import unicode_literals
+
+import asyncio
+import weakref
+
+from . import utils
+from . import planner
+from . import optimizer
+from . import functions
+
+MAX_CONCURRENCY = 16
+
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def default_semaphore(loop=None):
+    """Default semaphore limiting concurrent commands on ``loop``.
+
+    :param loop: event loop, by default the current one
+    :type loop: :class:`asyncio.AbstractEventLoop`
+    :returns: semaphore with :data:`MAX_CONCURRENCY` slots
+    :rtype: :class:`asyncio.Semaphore`
+
+    """
+    loop = loop or asyncio.get_event_loop()
+    sem = _semaphores.get(loop)
+    if sem is None:
+        sem = _semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENCY)
+    return sem
+
+
+async def run_process(cmd, stdin=None, timeout=None, semaphore=None):
+    """Run ``cmd`` without a shell and return its raw output.
+
+    :param cmd: command to be run
+    :type cmd: ``list``
+    :param stdin: input data for command
+    :type stdin: ``bytes``
+    :param timeout: seconds to wait for the command to finish
+    :type timeout: ``float``
+    :param semaphore: limit on concurrent commands, by default
+        :func:`default_semaphore`
+    :type semaphore: :class:`asyncio.Semaphore`
+    :returns: standard output of command
+    :rtype: ``bytes``
+    :raises ProcessTimeout: if ``timeout`` passed first; the command has
+        been killed
+
+    """
+    if semaphore is None:
+        semaphore = default_semaphore()
+    executor = utils.get_executor()
+    async with semaphore:
+        if not _runs_subprocesses(executor):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, executor.run, cmd,
+                                              stdin, timeout)
+        proc = await asyncio.create_subprocess_exec(
+            *utils.argv(cmd),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            env=utils.process_env())
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(stdin),
+                                               timeout)
+        except BaseException as exc:
+            # timed out or cancelled: don't leave the child running
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            if isinstance(exc, asyncio.TimeoutError):
+                raise utils.ProcessTimeout(cmd, timeout)
+            raise
+    return stdout
+
+
+def _runs_subprocesses(executor):
+    """Whether ``executor`` runs commands as the default one does, so
+    they can be run as :mod:`asyncio` subprocesses instead.
+
+    """
+    cls = type(executor)
+    return (getattr(cls, 'run', None) is utils.Executor.run and
+            getattr(cls, 'popen', None) is utils.Executor.popen)
+
+
+async def async_find(query_expression, only_in=None, timeout=None,
+                     semaphore=None):
+    """Coroutine version of :func:`find`.
+
+    The chunks of a split query are run concurrently, within the limit of
+    ``semaphore``; ``timeout`` applies to each chunk.
+
+    :returns: full paths to files of any results
+    :rtype: ``list``
+
+    """
+    query_expression = optimizer.optimize(query_expression)
+    if query_expression is None:
+        return []
+    cmds = [cmd for cmd in (functions._find_cmd(query, only_in)
+                            for query in planner.split(query_expression))
+            if cmd is not None]
+    outputs = await asyncio.gather(*[
+        run_process(cmd, timeout=timeout, semaphore=semaphore)
+        for cmd in cmds])
+    paths, seen = [], set()
+    for stdout in outputs:
+        for path in utils.decode_records(stdout):
+            if path not in seen:
+                seen.add(path)
+                paths.append(path)
+    return paths
+
+
+async def async_list(file_path, timeout=None, semaphore=None, attrs=None):
+    """Coroutine version of :func:`list`.
+
+    :returns: dictionary of metadata attributes and values
+    :rtype: ``dict``
+
+    """
+    stdout = await run_process(functions._list_cmd(attrs) + [file_path],
+                               timeout=timeout, semaphore=semaphore)
+    for md_dict in functions._parse_plists(stdout):
+        return md_dict
+    return {}
+
+
+async def async_list_many(file_paths, chunk_size=500, timeout=None,
+                          semaphore=None, attrs=None):
+    """Coroutine version of :func:`list_many`.
+
+    Chunks are listed concurrently, within the limit of ``semaphore``;
+    ``timeout`` applies to each chunk.
+
+    :returns: ``(file_path, metadata)`` pairs, in the order of
+        ``file_paths``
+    :rtype: ``list`` of ``tuple``s
+
+    """
+    cmd = functions._list_cmd(attrs)
+
+    async def list_chunk(chunk):
+        stdout = await run_process(cmd + chunk,
+                                   timeout=timeout, semaphore=semaphore)
+        md_dicts = [md_dict for md_dict in functions._parse_plists(stdout)]
+        # as in `list_many`, fall back to one file at a time
+        if len(md_dicts) != len(chunk):
+            md_dicts = await asyncio.gather(*[
+                async_list(file_path, timeout, semaphore, attrs)
+                for file_path in chunk])
+        return zip(chunk, md_dicts)
+
+    chunks = utils.chunk_args(file_paths, chunk_size, cmd)
+    listed = await asyncio.gather(*[list_chunk(chunk) for chunk in chunks])
+    return [pair for pairs in listed for pair in pairs]
+
+
+async def async_write(file_path, tag_list, attr_name='kMDItemUserTags',
+                      timeout=None, semaphore=None):
+    """Coroutine version of :func:`write`.
+
+    :returns: output lines of `xattr`
+    :rtype: ``list``
+
+    """
+    cmd = functions._write_cmd(file_path, tag_list, attr_name)
+    stdout = await run_process(cmd, timeout=timeout, semaphore=semaphore)
+    return utils.output_lines(stdout)
+
+
+if __name__ == '__main__':
+    pass
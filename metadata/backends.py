@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Engines that answer :func:`find`, :func:`list` and :func:`write`.
+
+:class:`Backend` is the interface; the default engine is Spotlight's
+`mdfind`, `mdls` and `xattr` (see :class:`functions.SpotlightBackend`).
+:class:`LocalBackend` answers the same calls in-process, from a walk of
+the file system and ``os.stat``, so the same code also runs where there is
+no Spotlight, as on Linux.
+
+"""
+from __future__ import unicode_literals
+
+import os
+import stat as stat_module
+from datetime import datetime, timedelta
+
+from . import utils
+from . import tags
+
+# content types of common file extensions
+EXTENSION_TYPES = {
+    '.pdf': 'com.adobe.pdf',
+    '.txt': 'public.plain-text',
+    '.text': 'public.plain-text',
+    '.md': 'net.daringfireball.markdown',
+    '.markdown': 'net.daringfireball.markdown',
+    '.rtf': 'public.rtf',
+    '.html': 'public.html',
+    '.htm': 'public.html',
+    '.xml': 'public.xml',
+    '.json': 'public.json',
+    '.csv': 'public.comma-separated-values-text',
+    '.py': 'public.python-script',
+    '.sh': 'public.shell-script',
+    '.rb': 'public.ruby-script',
+    '.pl': 'public.perl-script',
+    '.js': 'com.netscape.javascript-source',
+    '.c': 'public.c-source',
+    '.h': 'public.c-header',
+    '.cc': 'public.c-plus-plus-source',
+    '.cpp': 'public.c-plus-plus-source',
+    '.swift': 'public.swift-source',
+    '.java': 'com.sun.java-source',
+    '.jpg': 'public.jpeg',
+    '.jpeg': 'public.jpeg',
+    '.png': 'public.png',
+    '.gif': 'com.compuserve.gif',
+    '.tif': 'public.tiff',
+    '.tiff': 'public.tiff',
+    '.heic': 'public.heic',
+    '.mp3': 'public.mp3',
+    '.m4a': 'com.apple.m4a-audio',
+    '.wav': 'com.microsoft.waveform-audio',
+    '.mp4': 'public.mpeg-4',
+    '.mov': 'com.apple.quicktime-movie',
+    '.zip': 'public.zip-archive',
+    '.gz': 'org.gnu.gnu-zip-archive',
+    '.tar': 'public.tar-archive',
+    '.doc': 'com.microsoft.word.doc',
+    '.docx': 'org.openxmlformats.wordprocessingml.document',
+    '.xls': 'com.microsoft.excel.xls',
+    '.xlsx': 'org.openxmlformats.spreadsheetml.sheet',
+    '.epub': 'org.idpf.epub-container',
+}
+# content types of files without a known extension, by their first bytes
+MAGIC_TYPES = [
+    (b'%PDF-', 'com.adobe.pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'public.png'),
+    (b'\xff\xd8\xff', 'public.jpeg'),
+    (b'GIF87a', 'com.compuserve.gif'),
+    (b'GIF89a', 'com.compuserve.gif'),
+    (b'II*\x00', 'public.tiff'),
+    (b'MM\x00*', 'public.tiff'),
+    (b'ID3', 'public.mp3'),
+    (b'PK\x03\x04', 'public.zip-archive'),
+    (b'\x1f\x8b', 'org.gnu.gnu-zip-archive'),
+    (b'{\\rtf', 'public.rtf'),
+    (b'#!', 'public.script'),
+]
+_MAGIC_SIZE = max(len(magic) for magic, _ in MAGIC_TYPES)
+FOLDER_TYPE = 'public.folder'
+DATA_TYPE = 'public.data'
+# attributes that need more than `os.stat` and the file name
+_TYPE_KEYS = frozenset(['content_type', 'content_type_tree', 'kind'])
+_TAG_KEY = 'user_tags'
+_EPOCH = datetime(1970, 1, 1)
+
+
+class Backend(object):
+    """Interface of an engine behind :func:`find`, :func:`iter_find`,
+    :func:`list`, :func:`list_many` and :func:`write`.
+
+    Queries reach a backend already optimized, and caching is done before
+    it is asked. Use :func:`set_backend` to choose the backend.
+
+    """
+
+    def find(self, query_expression, only_in=None, fetch=None,
+             max_workers=4, timeout=None):
+        """Full paths of the files that match ``query_expression`` or,
+        with ``fetch``, ``(path, metadata)`` pairs, as :func:`find`.
+
+        :rtype: ``list``
+
+        """
+        return [result for result in
+                self.iter_find(query_expression, only_in, fetch, timeout)]
+
+    def iter_find(self, query_expression, only_in=None, fetch=None,
+                  timeout=None):
+        """Generate the results of :meth:`find` as they are found.
+
+        :rtype: ``generator``
+
+        """
+        raise NotImplementedError
+
+    def list(self, file_path, attrs=None, timeout=None):
+        """Metadata of ``file_path``, as :func:`list`.
+
+        :rtype: ``dict``
+
+        """
+        for _, md_dict in self.list_many([file_path], attrs, timeout):
+            return md_dict
+
+    def list_many(self, file_paths, attrs=None, timeout=None):
+        """Metadata of each of ``file_paths``.
+
+        :param file_paths: full paths to files, one chunk of those passed
+            to :func:`list_many`
+        :type file_paths: ``list``
+        :returns: ``(file_path, metadata)`` pairs, in the order of
+            ``file_paths``
+        :rtype: ``list`` of ``tuple``s
+
+        """
+        raise NotImplementedError
+
+    def attr_keys(self, attrs):
+        """Keys of ``attrs`` in listed metadata, or ``None`` for all
+        attributes.
+
+        :rtype: ``list``
+
+        """
+        raise NotImplementedError
+
+    def write(self, file_path, tag_list, attr_name='kMDItemUserTags',
+              timeout=None):
+        """Store ``tag_list`` in ``attr_name`` of ``file_path``, as
+        :func:`write`.
+
+        """
+        raise NotImplementedError
+
+
+class LocalBackend(Backend):
+    """Answer queries in-process, by walking the file system.
+
+    Each file's metadata is derived from ``os.stat`` and its name: `name`,
+    `display_name`, `logical_size`, `physical_size`, `creation_date`,
+    `content_creation_date`, `content_modification_date`,
+    `content_change_date`, `owner_user_id`, `owner_group_id`, `invisible`,
+    and `content_type` from the file extension or, failing that, the
+    file's first bytes. Tags are read from extended attributes, as by
+    :func:`read_tags`. Queries are evaluated with
+    :meth:`MDComparison.compile`, and only the attributes a query uses are
+    worked out for each file.
+
+    Attributes are named by :class:`MDAttribute`, Spotlight id or Pythonic
+    key; aliases, which need the attribute catalog, are not supported.
+    Timeouts are ignored.
+
+    :param root: directory searched when no ``only_in`` is given;
+        by default the current directory
+    :type root: ``unicode``
+
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    def iter_find(self, query_expression, only_in=None, fetch=None,
+                  timeout=None):
+        if not hasattr(query_expression, 'compile'):
+            raise Exception('The local backend can only evaluate query '
+                            'expressions, not query strings')
+        matches = query_expression.compile()
+        fetch_keys = self.attr_keys(fetch) if fetch is not None else None
+        needed = set(_query_keys(query_expression))
+        needed.update(fetch_keys or ())
+        root = only_in or self.root or os.getcwd()
+        for file_path, stat in _walk(root):
+            md_dict = _attributes(file_path, stat, needed)
+            if not matches(md_dict):
+                continue
+            file_path = utils.decode_path(file_path)
+            if fetch_keys is None:
+                yield file_path
+            else:
+                yield file_path, dict((key, md_dict[key])
+                                      for key in fetch_keys
+                                      if key in md_dict)
+
+    def list_many(self, file_paths, attrs=None, timeout=None):
+        keys = self.attr_keys(attrs)
+        needed = set(keys) if keys is not None else None
+        pairs = []
+        for file_path in file_paths:
+            try:
+                stat = os.lstat(_fs_path(file_path))
+            except (IOError, OSError):
+                # like `mdls`, list a file that isn't there as empty
+                pairs.append((file_path, {}))
+                continue
+            md_dict = _attributes(_fs_path(file_path), stat, needed)
+            if keys is not None:
+                md_dict = dict((key, md_dict[key])
+                               for key in keys if key in md_dict)
+            pairs.append((file_path, md_dict))
+        return pairs
+
+    def attr_keys(self, attrs):
+        if attrs is None:
+            return None
+        keys = []
+        for attr in attrs:
+            key = getattr(attr, 'key', None)
+            if key is None:
+                key = utils.clean_attribute(attr) \
+                    if attr.startswith(('kMDItem', '_kMDItem')) else attr
+            keys.append(key)
+        return keys
+
+    def write(self, file_path, tag_list, attr_name='kMDItemUserTags',
+              timeout=None):
+        tags.write_tags([file_path], tag_list, attr_name)
+
+
+## Helper Functions  ----------------------------------------------------------
+
+def _walk(root):
+    """Generate ``(path, stat)`` for the files and directories under
+    ``root``, as `mdfind -onlyin` finds them.
+
+    """
+    root = os.path.abspath(_fs_path(root))
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in sorted(dirnames) + sorted(filenames):
+            file_path = os.path.join(dirpath, name)
+            try:
+                stat = os.lstat(file_path)
+            except (IOError, OSError):
+                # removed while walking
+                continue
+            yield file_path, stat
+
+
+def _fs_path(path):
+    """``path`` as file system calls take it: Python 2 on Linux can't
+    pass on non-ASCII text unless the locale is UTF-8.
+
+    """
+    if not utils.PY3 and isinstance(path, utils.text_type):
+        return path.encode('utf-8')
+    return path
+
+
+def _query_keys(query_expression):
+    """Keys of the attributes ``query_expression`` compares.
+
+    """
+    pending = [query_expression]
+    while pending:
+        node = pending.pop()
+        units = getattr(node, 'units', None)
+        if units is None:
+            yield node.attribute.key
+        else:
+            pending.extend(units)
+
+
+def _attributes(file_path, stat, keys=None):
+    """Metadata of ``file_path``, from its ``stat`` and name.
+
+    :param keys: attributes that are needed, ``None`` for all; the ones
+        that cost more than ``stat`` are left out unless needed
+    :type keys: ``set``
+    :rtype: ``dict``
+
+    """
+    name = utils.decode_path(os.path.basename(file_path))
+    is_dir = stat_module.S_ISDIR(stat.st_mode)
+    modified = _date(stat.st_mtime)
+    # without a birth time, the earliest time the file is known to exist
+    created = _date(getattr(stat, 'st_birthtime', None) or
+                    min(stat.st_ctime, stat.st_mtime))
+    md_dict = {
+        'name': name,
+        'display_name': name,
+        'creation_date': created,
+        'content_creation_date': created,
+        'content_modification_date': modified,
+        'content_change_date': modified,
+        'owner_user_id': stat.st_uid,
+        'owner_group_id': stat.st_gid,
+        'invisible': int(name.startswith('.')),
+    }
+    if not is_dir:
+        md_dict['logical_size'] = md_dict['size'] = stat.st_size
+        md_dict['physical_size'] = getattr(stat, 'st_blocks', 0) * 512
+    if keys is None or not _TYPE_KEYS.isdisjoint(keys):
+        content_type = _content_type(file_path, name, stat, is_dir)
+        md_dict['content_type'] = content_type
+        md_dict['content_type_tree'] = \
+            [content_type, 'public.directory', 'public.item'] if is_dir \
+            else [content_type, DATA_TYPE, 'public.item']
+        md_dict['kind'] = 'Folder' if is_dir else \
+            content_type.rpartition('.')[2].upper()
+    if (keys is None or _TAG_KEY in keys) and not is_dir:
+        try:
+            md_dict[_TAG_KEY] = tags.read_tags([file_path])[0][1]
+        except (IOError, OSError):
+            # no extended attributes on this file system
+            pass
+    return md_dict
+
+
+def _content_type(file_path, name, stat, is_dir):
+    """Content type of ``file_path``, by extension or first bytes.
+
+    """
+    if is_dir:
+        return FOLDER_TYPE
+    content_type = EXTENSION_TYPES.get(os.path.splitext(name)[1].lower())
+    if content_type is not None:
+        return content_type
+    if not stat_module.S_ISREG(stat.st_mode) or not stat.st_size:
+        return DATA_TYPE
+    try:
+        with open(file_path, 'rb') as fp:
+            head = fp.read(_MAGIC_SIZE)
+    except (IOError, OSError):
+        return DATA_TYPE
+    for magic, content_type in MAGIC_TYPES:
+        if head.startswith(magic):
+            return content_type
+    return DATA_TYPE
+
+
+def _date(timestamp):
+    """``timestamp`` as a :class:`datetime` in UTC, as `mdls` lists it.
+
+    """
+    return _EPOCH + timedelta(seconds=int(timestamp))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,416 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import os
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from . import utils
+from . import catalog
+from . import functions
+
+# bump whenever the layout of the cache database changes
+CACHE_VERSION = 1
+# SQLite allows at most 999 parameters per statement
+_MAX_PARAMS = 500
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    mtime REAL,
+    size INTEGER,
+    data BLOB,
+    last_used INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+'''
+
+
+class MetadataCache(object):
+    """Persistent cache of parsed file metadata, backed by SQLite.
+
+    Each entry is stored with the file's inode, modification time and
+    size. A cached entry is only returned if a fresh ``os.stat`` of the
+    file still matches all three, so a lookup costs one `stat` instead of
+    one `mdls` process. Once the cache holds more than ``max_entries``
+    entries, the least recently used ones are evicted.
+
+    Pass an instance as the ``cache`` argument of :func:`list`,
+    :func:`list_many` or :func:`scan` to use it.
+
+    :param path: full path to the database file, or ``':memory:'``;
+        defaults to ``metadata-v1.sqlite`` beside the attribute catalog
+        cache
+    :type path: ``unicode``
+    :param max_entries: maximum number of entries kept
+    :type max_entries: ``int``
+
+    """
+
+    def __init__(self, path=None, max_entries=100000):
+        if path is None:
+            cache_dir = os.path.dirname(catalog.cache_path())
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            filename = 'metadata-v{}.sqlite'.format(CACHE_VERSION)
+            path = os.path.join(cache_dir, filename)
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != \
+                CACHE_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS entries')
+            self._db.execute('PRAGMA user_version = {}'
+                             .format(CACHE_VERSION))
+        self._db.executescript(_SCHEMA)
+        self._clock = self._db.execute(
+            'SELECT COALESCE(MAX(last_used), 0) FROM entries').fetchone()[0]
+
+    # Lookup  -----------------------------------------------------------------
+
+    def get(self, path):
+        """Cached metadata of ``path``, if the file is unchanged.
+
+        :param path: full path to file
+        :type path: ``unicode``
+        :returns: dictionary of metadata attributes and values, or ``None``
+        :rtype: ``dict``
+
+        """
+        hits, _ = self.get_many([path])
+        return hits.get(path)
+
+    def get_many(self, paths):
+        """Cached metadata of each unchanged file in ``paths``.
+
+        :param paths: full paths to files
+        :type paths: ``list`` of ``unicode``
+        :returns: ``hits``, a ``dict`` of path to metadata, and
+            ``misses``, a ``list`` of ``(path, stat)`` pairs to pass
+            back to :meth:`put_many` once listed (``stat`` is ``None`` if
+            the file can't be found)
+        :rtype: ``tuple``
+
+        """
+        stats = [(path, file_stamp(path)) for path in paths]
+        rows = {}
+        with self._lock:
+            for start in range(0, len(stats), _MAX_PARAMS):
+                keys = [utils.decode_path(path)
+                        for path, _ in stats[start:start + _MAX_PARAMS]]
+                query = ('SELECT path, inode, mtime, size, data FROM entries '
+                         'WHERE path IN ({})'.format(', '.join('?' * len(keys))))
+                for row in self._db.execute(query, keys):
+                    rows[row[0]] = row
+            hits, misses, used = {}, [], []
+            for path, stat in stats:
+                row = rows.get(utils.decode_path(path))
+                if stat is not None and row is not None and \
+                        tuple(row[1:4]) == stat:
+                    hits[path] = pickle.loads(bytes(row[4]))
+                    used.append(row[0])
+                else:
+                    misses.append((path, stat))
+            self._touch(used)
+            self._db.commit()
+            self.hits += len(hits)
+            self.misses += len(misses)
+        return hits, misses
+
+    # Storage  ----------------------------------------------------------------
+
+    def put(self, path, md_dict, stat=None):
+        """Cache ``md_dict`` as the metadata of ``path``.
+
+        :param path: full path to file
+        :type path: ``unicode``
+        :param md_dict: dictionary of metadata attributes and values
+        :type md_dict: ``dict``
+        :param stat: ``(inode, mtime, size)`` of the file from before it
+            was listed; taken now if not given
+        :type stat: ``tuple``
+
+        """
+        self.put_many([(path, md_dict, stat)])
+
+    def put_many(self, entries):
+        """Cache the metadata of many files at once.
+
+        :param entries: ``(path, md_dict)`` pairs or
+            ``(path, md_dict, stat)`` triples, as for :meth:`put`
+        :type entries: iterable of ``tuple``s
+
+        """
+        rows = []
+        for entry in entries:
+            path, md_dict = entry[:2]
+            stat = entry[2] if len(entry) > 2 else None
+            if stat is None:
+                stat = file_stamp(path)
+                if stat is None:
+                    continue
+            data = sqlite3.Binary(pickle.dumps(md_dict, 2))
+            rows.append([utils.decode_path(path)] + list(stat) + [data])
+        if not rows:
+            return
+        with self._lock:
+            for row in rows:
+                self._clock += 1
+                row.append(self._clock)
+            self._db.executemany('INSERT OR REPLACE INTO entries '
+                                 'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict()
+            self._db.commit()
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters.
+
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM entries')
+            self._db.commit()
+            self.hits = self.misses = 0
+
+    def close(self):
+        """Close the database.
+
+        """
+        with self._lock:
+            self._db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM entries')\
+                           .fetchone()[0]
+
+    # Updates  ----------------------------------------------------------------
+
+    def stamps(self, root):
+        """``(inode, mtime, size)`` of the cached files under ``root``, as
+        they were when cached.
+
+        :param root: full path to a directory
+        :type root: ``unicode``
+        :rtype: ``dict``
+
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT path, inode, mtime, size FROM entries '
+                'WHERE path >= ? AND path < ?', _under(root)).fetchall()
+        return dict((row[0], tuple(row[1:])) for row in rows)
+
+    def refresh(self, changed=(), removed=()):
+        """List the cached files among ``changed`` again, and drop the
+        entries of ``removed`` and of the files under them, for
+        :class:`Updater`. Files that aren't cached are left alone.
+
+        :param changed: full paths to files that may have changed
+        :type changed: ``list``
+        :param removed: full paths to files and directories that are gone
+        :type removed: ``list``
+
+        """
+        changed = [utils.decode_path(path) for path in changed]
+        cached = []
+        with self._lock:
+            for start in range(0, len(changed), _MAX_PARAMS):
+                keys = changed[start:start + _MAX_PARAMS]
+                query = ('SELECT path FROM entries WHERE path IN ({})'
+                         .format(', '.join('?' * len(keys))))
+                cached.extend(row[0] for row in self._db.execute(query, keys))
+            for path in removed:
+                path = utils.decode_path(path)
+                self._db.execute('DELETE FROM entries WHERE path = ?',
+                                 (path,))
+                self._db.execute('DELETE FROM entries '
+                                 'WHERE path >= ? AND path < ?',
+                                 _under(path))
+            self._db.commit()
+        # stale entries are listed again as misses
+        for _ in functions.list_many(cached, cache=self):
+            pass
+
+    # Helper methods  ---------------------------------------------------------
+
+    def _touch(self, keys):
+        """Mark the entries at ``keys`` as just used.
+
+        """
+        updates = []
+        for key in keys:
+            self._clock += 1
+            updates.append((self._clock, key))
+        self._db.executemany('UPDATE entries SET last_used = ? '
+                             'WHERE path = ?', updates)
+
+    def _evict(self):
+        """Delete least recently used entries beyond ``max_entries``.
+
+        """
+        count = self._db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if count > self.max_entries:
+            self._db.execute('DELETE FROM entries WHERE path IN '
+                             '(SELECT path FROM entries '
+                             'ORDER BY last_used LIMIT ?)',
+                             (count - self.max_entries,))
+
+
+class FindCache(object):
+    """In-process cache of :func:`find` results with a time to live.
+
+    Results are keyed by the rendered query string and the ``only_in``
+    scope. An entry expires ``ttl`` seconds after it is stored, and the
+    least recently used entries are evicted beyond ``max_entries`` entries
+    or ``max_paths`` cached paths in total. Queries whose date predicates
+    are relative to now (such as ``'3 days ago'``) are never cached.
+
+    Pass an instance as the ``cache`` argument of :func:`find` to use it.
+
+    :param ttl: seconds a result stays valid
+    :type ttl: ``float``
+    :param max_entries: maximum number of cached queries
+    :type max_entries: ``int``
+    :param max_paths: maximum number of paths across all cached results
+    :type max_paths: ``int``
+
+    """
+
+    def __init__(self, ttl=60, max_entries=1000, max_paths=1000000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_paths = max_paths
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._total_paths = 0
+        self._lock = threading.Lock()
+
+    def get(self, query_expression, only_in=None):
+        """Cached result of ``query_expression``, if still valid.
+
+        :returns: full paths to files of any results, or ``None``
+        :rtype: ``list``
+
+        """
+        key = self._key(query_expression, only_in)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._total_paths -= len(entry[2])
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return [path for path in entry[2]]
+
+    def put(self, query_expression, only_in, paths):
+        """Cache ``paths`` as the result of ``query_expression``.
+
+        """
+        if _has_relative_date(query_expression):
+            return
+        key = self._key(query_expression, only_in)
+        paths = tuple(paths)
+        if len(paths) > self.max_paths:
+            return
+        scope = os.path.abspath(only_in) if only_in else None
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_paths -= len(old[2])
+            self._entries[key] = (time.time() + self.ttl, scope, paths)
+            self._total_paths += len(paths)
+            while (len(self._entries) > self.max_entries or
+                   self._total_paths > self.max_paths):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_paths -= len(evicted[2])
+
+    def invalidate(self, scope=None):
+        """Drop cached results that may include files under ``scope``.
+
+        That is every result whose ``only_in`` contains ``scope``, lies
+        within it, or is unscoped. Without ``scope``, drop everything.
+
+        :param scope: full path of a directory whose contents changed
+        :type scope: ``unicode``
+
+        """
+        with self._lock:
+            if scope is None:
+                self._entries.clear()
+                self._total_paths = 0
+                return
+            scope = os.path.abspath(scope)
+            for key, entry in [item for item in self._entries.items()]:
+                if entry[1] is None or _overlaps(entry[1], scope):
+                    del self._entries[key]
+                    self._total_paths -= len(entry[2])
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(query_expression, only_in):
+        if only_in:
+            only_in = os.path.abspath(only_in)
+        return (utils.text_type(query_expression), only_in)
+
+
+def _has_relative_date(query_expression):
+    """Whether any date predicate in ``query_expression`` depends on the
+    current time.
+
+    """
+    units = getattr(query_expression, 'units', None)
+    if units is not None:
+        return any(_has_relative_date(unit) for unit in units)
+    if 'date' not in query_expression.attribute.key:
+        return False
+    predicate = query_expression.predicate
+    if query_expression.operator == 'InRange':
+        return any(utils.is_relative_date(value) for value in predicate)
+    return utils.is_relative_date(predicate)
+
+
+def _overlaps(path, other):
+    """Whether one of the two directory paths contains the other.
+
+    """
+    return (path == other or
+            path.startswith(other.rstrip(os.sep) + os.sep) or
+            other.startswith(path.rstrip(os.sep) + os.sep))
+
+
+def _under(directory):
+    """Bounds of the paths under ``directory``, in sort order.
+
+    """
+    prefix = os.path.join(utils.decode_path(directory), '')
+    # the character after the separator ends the range
+    return prefix, prefix[:-1] + utils.unichr(ord(prefix[-1]) + 1)
+
+
+def file_stamp(path):
+    """``(inode, mtime, size)`` of ``path``, or ``None`` if it is missing.
+
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime, stat.st_size)
+
+
+if __name__ == '__main__':
+    pass
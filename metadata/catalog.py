@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import os
+import sys
+import json
+import errno
+
+from . import utils
+
+# bump whenever the layout of the cached records changes
+CACHE_VERSION = 1
+# columns of `mdimport -A` output, in order
+FIELDS = ('id', 'name', 'description', 'aliases')
+# directories holding Spotlight importers; installing or removing an
+# importer changes the attribute catalog, so their mtimes go into the
+# cache fingerprint
+IMPORTER_DIRS = ('/System/Library/Spotlight',
+                 '/Library/Spotlight',
+                 '~/Library/Spotlight')
+
+_records = None
+_index = None
+
+
+## Catalog data  --------------------------------------------------------------
+
+def attributes_generator():
+    """Generate dictionaries with data for all OS X metadata attributes
+
+    :returns: data on all OS X metadata attributes
+    :rtype: ``generator`` of ``dict``s
+
+    """
+    # get all OS X metadata attributes
+    attributes = utils.run_process(['mdimport', '-A'])
+    # create dicts, mapping ``FIELDS`` to an item's columns
+    for attribute in attributes:
+        attribute_data = [item.replace("'", "")
+                          for item in attribute.split('\t\t')]
+        info = dict(zip(FIELDS, attribute_data))
+        info['key'] = utils.clean_attribute(info['id'])
+        yield info
+
+
+def records():
+    """All parsed attribute records, loaded on first use.
+
+    The records are read from the on-disk cache when it is fresh, otherwise
+    they are rebuilt from `mdimport -A` and the cache is rewritten.
+
+    :returns: ``id``, ``name``, ``description``, ``aliases`` and ``key``
+        of every attribute
+    :rtype: ``list`` of ``dict``s
+
+    """
+    global _records
+    if _records is None:
+        _records = _read_cache()
+        if _records is None:
+            _records = [info for info in attributes_generator()]
+            _write_cache(_records)
+    return _records
+
+
+def reset():
+    """Forget the in-memory records, forcing a reload on next use.
+
+    """
+    global _records, _index
+    _records = None
+    _index = None
+
+
+## Indexed lookup  ------------------------------------------------------------
+
+def index():
+    """Lookup tables over :func:`records`, built once.
+
+    :returns: ``id``, ``key`` and ``alias`` maps to records, plus
+        ``search``, a list of ``(lowercase text, record)`` pairs
+    :rtype: ``dict``
+
+    """
+    global _index
+    if _index is None:
+        by_id, by_key, by_alias, searchable = {}, {}, {}, []
+        for info in records():
+            by_id[info['id']] = info
+            # later records win, as when attributes were set eagerly
+            by_key[info['key']] = info
+            for alias in aliases(info):
+                by_alias.setdefault(alias, info)
+            text = ' '.join((info['id'], info['key'], info.get('name', '')))
+            searchable.append((text.lower(), info))
+        _index = {'id': by_id, 'key': by_key, 'alias': by_alias,
+                  'search': searchable}
+    return _index
+
+
+def aliases(info):
+    """Aliases of attribute record ``info``.
+
+    :returns: aliases listed by `mdimport -A`, if any
+    :rtype: ``list``
+
+    """
+    value = info.get('aliases') or ''
+    if value == '(null)':
+        return []
+    return [alias for alias in value.replace(',', ' ').split() if alias]
+
+
+def get(name):
+    """Attribute record for ``name``, matched exactly.
+
+    :param name: Spotlight id (``kMDItemFSName``), Pythonic key
+        (``name``) or alias of the attribute
+    :type name: ``unicode``
+    :returns: attribute record, or ``None`` if there is no match
+    :rtype: ``dict``
+
+    """
+    tables = index()
+    for table in ('id', 'key', 'alias'):
+        info = tables[table].get(name)
+        if info is not None:
+            return info
+    return None
+
+
+def search(term):
+    """Attribute records whose id, key or name contains ``term``.
+
+    Matching ignores case. Exact matches come first, then prefix matches,
+    then other substring matches, each group sorted by key.
+
+    :param term: text to look for
+    :type term: ``unicode``
+    :returns: matching attribute records
+    :rtype: ``list`` of ``dict``s
+
+    """
+    term = term.lower()
+    exact, prefix, substring = [], [], []
+    for text, info in index()['search']:
+        if term not in text:
+            continue
+        words = text.split(' ')
+        if term in words:
+            exact.append(info)
+        elif any(word.startswith(term) for word in words):
+            prefix.append(info)
+        else:
+            substring.append(info)
+    return [info
+            for group in (exact, prefix, substring)
+            for info in sorted(group, key=lambda info: info['key'])]
+
+
+## On-disk cache  -------------------------------------------------------------
+
+def cache_path():
+    """Full path to the versioned attribute cache file.
+
+    Set ``METADATA_CACHE_DIR`` in the environment to override the default
+    per-user cache directory.
+
+    :returns: full path to cache file
+    :rtype: ``unicode``
+
+    """
+    cache_dir = os.environ.get('METADATA_CACHE_DIR')
+    if not cache_dir:
+        if sys.platform == 'darwin':
+            cache_dir = os.path.expanduser('~/Library/Caches/metadata')
+        else:
+            xdg_dir = (os.environ.get('XDG_CACHE_HOME') or
+                       os.path.expanduser('~/.cache'))
+            cache_dir = os.path.join(xdg_dir, 'metadata')
+    filename = 'attributes-v{}.json'.format(CACHE_VERSION)
+    return os.path.join(cache_dir, filename)
+
+
+def fingerprint():
+    """Summary of the system state the attribute catalog depends on.
+
+    :returns: kernel release and modification times of importer directories
+    :rtype: ``list``
+
+    """
+    stamp = [os.uname()[2]]
+    for importer_dir in IMPORTER_DIRS:
+        try:
+            stamp.append(os.stat(os.path.expanduser(importer_dir)).st_mtime)
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def _read_cache():
+    """Return cached records, or ``None`` if the cache is missing or stale.
+
+    """
+    try:
+        with open(cache_path(), 'rb') as cache_file:
+            data = json.loads(cache_file.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        return None
+    if data.get('version') != CACHE_VERSION:
+        return None
+    if data.get('fingerprint') != fingerprint():
+        return None
+    return data.get('records')
+
+
+def _write_cache(attribute_records):
+    """Atomically write ``attribute_records`` to the cache file.
+
+    Failing to write the cache is not an error; the catalog is simply
+    rebuilt next time.
+
+    """
+    import tempfile
+    path = cache_path()
+    data = {'version': CACHE_VERSION,
+            'fingerprint': fingerprint(),
+            'records': attribute_records}
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            return
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(json.dumps(data).encode('utf-8'))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+if __name__ == '__main__':
+    pass
@@ -2,18 +2,20 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
-import time
+import weakref
 from datetime import datetime
 
-import parsedatetime
-import utils
+from . import utils
+from . import catalog
+from . import predicates
 
 
+@utils.str_compatible
 class MDAttribute(object):
     """Represents an OS X Spotlight Metadata Attribute
 
-    :param name: Spotlight name for attribute.
-    :type name: ``unicode``
+    :param info: Spotlight name for attribute, or its catalog record.
+    :type info: ``unicode`` or ``dict`` with ``id`` (and optional ``key``)
     :param ignore_case: ignore case in :class:`MDComparison`.
     :type ignore_case: :class:`Boolean`
     :param ignore_diacritics: ignore diacritics in :class:`MDComparison`.
@@ -21,28 +23,26 @@ class MDAttribute(object):
 
     """
 
-    def __init__(self, name, ignore_case=True, ignore_diacritics=True):
-        self.name = name
+    def __init__(self, info, ignore_case=True, ignore_diacritics=True):
+        if not isinstance(info, dict):
+            info = {'id': info}
+        self.id = self.name = info['id']
         self._ignore_case = ignore_case
         self._ignore_diacritics = ignore_diacritics
-        self.key = utils.clean_attribute(self.name)
+        self.key = info.get('key') or utils.clean_attribute(self.name)
 
     def info(self):
         """Dictionary of metadata attribute information.
 
-        :returns: `description`, `aliases`, `id`, and `name` of instance.
+        :returns: `description`, `aliases`, `id`, `name` and `key` of
+            instance, or ``None`` if it isn't in the attribute catalog.
         :rtype: ``dict``
 
         """
-        keys = ('id', 'name', 'description', 'aliases')
-        item_cmd = "mdimport -A | grep '{}'".format(self.name)
-        item_data = utils.run_process(item_cmd)
-        if item_data:
-            item_data = [item.replace("'", "")
-                         for item in item_data[0].split('\t\t')]
-            return dict(zip(keys, item_data))
-        else:
-            return item_data
+        info = catalog.index()['id'].get(self.id)
+        if info is not None:
+            return dict(info)
+        return None
 
     # Representation Magic Methods  -------------------------------------------
 
@@ -189,47 +189,159 @@ class MDAttribute(object):
                 raise Exception('Invalid operator for non-date attribute')
 
 
-class MDComparison(object):
-    """Represents an OS X Spotlight file metadata query comparison.
+# Query nodes  ----------------------------------------------------------------
 
-    You probably shouldn't use this class directly, but by comparing a
-    :class:`MDAttribute` to a predicate.
+# live query nodes by structure, so that equal nodes are shared
+_interned = weakref.WeakValueDictionary()
 
-    :param attribute: the subject of the comparison
-    :type attribute: :class:`MDAttribute`
-    :param operator: the type of comparison
-    :type operator: ``unicode``
-    :param predicate: the predicate of the comparison
-    :type predicate: ``unicode`` or ``int`` or ``float``
+
+class _QueryNode(object):
+    """Immutable, hashable base of :class:`MDComparison` and
+    :class:`MDExpression`.
+
+    Nodes are interned: building a node equal to one that is still alive
+    returns that same object. Each node renders its query string and
+    compiles its predicate once and keeps them, unless a date in it is
+    relative to the current time.
 
     """
 
-    def __init__(self, attribute, operator, predicate):
-        self.attribute = attribute
-        self.operator = operator
-        self.predicate = utils.decode(predicate)
+    __slots__ = ('_key', '_hash', '_text', '_predicate', '_optimized',
+                 '__weakref__')
 
-    # Representation Magic Methods  -------------------------------------------
+    @classmethod
+    def _intern(cls, key, **fields):
+        """Interned node of class ``cls`` with structure ``key``.
+
+        """
+        key = (cls, key)
+        node = _interned.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for name, value in fields.items():
+                object.__setattr__(node, name, value)
+            object.__setattr__(node, '_key', key)
+            object.__setattr__(node, '_hash', hash(key))
+            object.__setattr__(node, '_text', None)
+            object.__setattr__(node, '_predicate', None)
+            object.__setattr__(node, '_optimized', None)
+            node = _interned.setdefault(key, node)
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError('{} objects are immutable'
+                             .format(type(self).__name__))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, _QueryNode):
+            return NotImplemented
+        return self._hash == other._hash and self._key == other._key
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __repr__(self):
+        return str('<{} {}>').format(type(self).__name__, str(self))
 
     def __str__(self):
-        """Return :class:`str` representation of the :class:`MDComparison`
-        object. The :class:`str` representation is a UTF8 encoded string.
+        """Return :class:`str` representation of the query object. The
+        :class:`str` representation is a UTF8 encoded string.
 
         """
         return str(self.__unicode__().encode('utf-8'))
 
     def __unicode__(self):
-        """Return :class:`unicode` representation of the :class:`MDComparison`
-        object.
+        """Return :class:`unicode` representation of the query object,
+        rendered once and cached.
 
         """
-        # check for `InRange` operator
-        if self.operator == 'InRange':
-            return self._format_inrange()
+        text = self._text
+        if text is None:
+            text = self._render()
+            if not self._relative():
+                object.__setattr__(self, '_text', text)
+        return text
+
+    # In-process Evaluation  --------------------------------------------------
+
+    def compile(self):
+        """Compile into a Python predicate over metadata dictionaries, as
+        returned by :func:`list`. The predicate is built once and cached,
+        unless a date in it is relative to the current time.
+
+        :returns: function taking a metadata ``dict`` and returning ``bool``
+        :rtype: ``callable``
+
+        """
+        predicate = self._predicate
+        if predicate is None:
+            predicate = predicates.compile_query(self)
+            if not self._relative():
+                object.__setattr__(self, '_predicate', predicate)
+        return predicate
+
+
+@utils.str_compatible
+class MDComparison(_QueryNode):
+    """Represents an OS X Spotlight file metadata query comparison.
+
+    You probably shouldn't use this class directly, but by comparing a
+    :class:`MDAttribute` to a predicate. The attribute's ``ignore_case``
+    and ``ignore_diacritics`` modifiers are captured when the comparison
+    is made.
+
+    :param attribute: the subject of the comparison
+    :type attribute: :class:`MDAttribute`
+    :param operator: the type of comparison
+    :type operator: ``unicode``
+    :param predicate: the predicate of the comparison
+    :type predicate: ``unicode`` or ``int`` or ``float``
+    :param ignore_case: modifier to use instead of the attribute's
+    :type ignore_case: ``bool``
+    :param ignore_diacritics: modifier to use instead of the attribute's
+    :type ignore_diacritics: ``bool``
+
+    """
+
+    __slots__ = ('attribute', 'operator', 'predicate', 'ignore_case',
+                 'ignore_diacritics')
+
+    def __new__(cls, attribute, operator, predicate, ignore_case=None,
+                ignore_diacritics=None):
+        if isinstance(predicate, (tuple, type([]))):
+            predicate = tuple(utils.decode(value) for value in predicate)
         else:
-            predicate = self._prepare_predicate(self.predicate)
-            query = [self.attribute.id, self.operator, predicate]
-            return ' '.join(query)
+            predicate = utils.decode(predicate)
+        if ignore_case is None:
+            ignore_case = attribute.ignore_case
+        if ignore_diacritics is None:
+            ignore_diacritics = attribute.ignore_diacritics
+        # `1 == 1.0`, but they render differently
+        key = (attribute.id, operator, _typed(predicate), ignore_case,
+               ignore_diacritics)
+        return cls._intern(key, attribute=attribute, operator=operator,
+                           predicate=predicate, ignore_case=ignore_case,
+                           ignore_diacritics=ignore_diacritics)
+
+    def __reduce__(self):
+        # the modifiers as captured, not as the attribute's are now
+        return (MDComparison, (self.attribute, self.operator, self.predicate,
+                               self.ignore_case, self.ignore_diacritics))
+
+    def _with(self, operator, predicate):
+        """Comparison of the same attribute, with the same modifiers.
+
+        """
+        return MDComparison(self.attribute, operator, predicate,
+                            self.ignore_case, self.ignore_diacritics)
 
     # Expression Magic Operators  ---------------------------------------------
 
@@ -261,7 +373,7 @@ class MDComparison(object):
         if isinstance(other, MDComparison):
             return MDExpression(' || ', self, other)
         elif isinstance(other, MDExpression):
-            return MDExpression(' && ', self, other)
+            return MDExpression(' || ', self, other)
         else:
             msg = ('Invalid query expression! {} must be `MDComparison`'
                    'or `MDExpression` object.'.format(repr(other)))
@@ -269,6 +381,31 @@ class MDComparison(object):
 
     # Helper methods  ---------------------------------------------------------
 
+    def _render(self):
+        """Build the query string.
+
+        :rtype: ``unicode``
+
+        """
+        # check for `InRange` operator
+        if self.operator == 'InRange':
+            return self._format_inrange()
+        else:
+            predicate = self._prepare_predicate(self.predicate)
+            query = [self.attribute.id, self.operator, predicate]
+            return ' '.join(query)
+
+    def _relative(self):
+        """Whether the query depends on the current time.
+
+        """
+        if 'date' not in self.attribute.key:
+            return False
+        values = self.predicate
+        if self.operator != 'InRange':
+            values = (values,)
+        return any(utils.is_relative_date(value) for value in values)
+
     def _prepare_predicate(self, predicate):
         """Properly handle data, number, and string predicates
         for query comparisons.
@@ -283,10 +420,10 @@ class MDComparison(object):
             predicate = self._parse_date_value(predicate)
         # if predicate is number
         elif isinstance(predicate, int):
-            predicate = unicode(predicate)
+            predicate = utils.text_type(predicate)
         # if predicate is float number
         elif isinstance(predicate, float):
-            predicate = unicode(predicate)
+            predicate = utils.text_type(predicate)
         # else is string
         else:
             quoted_pred = self._quote_predicate(predicate)
@@ -309,8 +446,7 @@ class MDComparison(object):
 
     def _modify_comparison(self, predicate):
         """Ignore case and diacritics in query comparison,
-        if :attr:`MDAttribute.ignore_case` or
-        :attr:`MDAttribute.ignore_diacritics` is ``True``.
+        if :attr:`ignore_case` or :attr:`ignore_diacritics` is ``True``.
 
         :param predicate: string predicate of query comparison.
         :type predicate: ``unicode``
@@ -319,9 +455,9 @@ class MDComparison(object):
 
         """
         mod = []
-        if self.attribute.ignore_case:
+        if self.ignore_case:
             mod.append('c')
-        if self.attribute.ignore_diacritics:
+        if self.ignore_diacritics:
             mod.append('d')
         # return properly formatted comparison expression
         if mod:
@@ -340,7 +476,7 @@ class MDComparison(object):
             min_v = self._parse_date_value(self.predicate[0])
             max_v = self._parse_date_value(self.predicate[1])
         else:
-            min_v, max_v = self.value
+            min_v, max_v = self.predicate
         return 'InRange({0}, {1}, {2})'.format(self.attribute.id,
                                                min_v,
                                                max_v)
@@ -355,17 +491,16 @@ class MDComparison(object):
         :rtype: ``unicode``
 
         """
-        cal = parsedatetime.Calendar()
-        struct_time = cal.parse(predicate)
-        if struct_time[1] == 0:
-            msg = 'Datetime string not parsed : `{}` '.format(predicate)
-            raise Exception(msg)
-        timestamp = time.mktime(struct_time[0])
-        iso_date = datetime.fromtimestamp(timestamp).isoformat()
+        if isinstance(predicate, datetime):
+            iso_date = predicate.isoformat()
+        else:
+            timestamp = utils.parse_date(predicate)
+            iso_date = datetime.fromtimestamp(timestamp).isoformat()
         return '$time.iso({})'.format(iso_date)
 
 
-class MDExpression(object):
+@utils.str_compatible
+class MDExpression(_QueryNode):
     """Represents an OS X Spotlight file metadata query expression.
 
     You probably shouldn't use this class directly, but by comparing a
@@ -379,23 +514,13 @@ class MDExpression(object):
 
     """
 
-    def __init__(self, operator, *units):
-        self.operator = operator
-        self.units = units
+    __slots__ = ('operator', 'units')
 
-    def __str__(self):
-        """Return :class:`str` representation of the :class:`MDExpression`
-        object. The :class:`str` representation is a UTF8 encoded string.
-
-        """
-        return str(self.__unicode__().encode('utf-8'))
-
-    def __unicode__(self):
-        """Return :class:`unicode` representation of the :class:`MDExpression`
-        object.
+    def __new__(cls, operator, *units):
+        return cls._intern((operator, units), operator=operator, units=units)
 
-        """
-        return self.operator.join(self._format(self.units))
+    def __reduce__(self):
+        return (MDExpression, (self.operator,) + self.units)
 
     # Expression Operators  ---------------------------------------------------
 
@@ -435,6 +560,20 @@ class MDExpression(object):
 
     # Helper method  ----------------------------------------------------------
 
+    def _render(self):
+        """Build the query string.
+
+        :rtype: ``unicode``
+
+        """
+        return self.operator.join(self._format(self.units))
+
+    def _relative(self):
+        """Whether the query depends on the current time.
+
+        """
+        return any(unit._relative() for unit in self.units)
+
     @staticmethod
     def _format(units):
         """Format query ``units`` as unicode strings.
@@ -449,8 +588,17 @@ class MDExpression(object):
         for comparison in units:
             # nested expressions are wrapped in parens
             if isinstance(comparison, MDExpression):
-                clean = '(' + unicode(comparison) + ')'
+                clean = '(' + utils.text_type(comparison) + ')'
                 clean_units.append(clean)
             elif isinstance(comparison, MDComparison):
-                clean_units.append(unicode(comparison))
+                clean_units.append(utils.text_type(comparison))
         return clean_units
+
+
+def _typed(value):
+    """``value`` with the type of each scalar, for structural keys.
+
+    """
+    if isinstance(value, tuple):
+        return tuple(_typed(item) for item in value)
+    return (type(value), value)
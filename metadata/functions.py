@@ -2,90 +2,694 @@
 # encoding: utf-8
 from __future__ import unicode_literals
 
-import utils
+import os
+import re
+import heapq
+import base64
+import itertools
+import unicodedata
+from datetime import datetime, timedelta
 
+from . import utils
+from . import planner
+from . import optimizer
+from . import catalog
+from . import backends
+from .items import iter_items, Page
 
-def find(query_expression, only_in=None):
+# `mdls` option to print each file's attributes as an XML property list
+MDLS_PLIST = ['mdls', '-plist', '-']
+
+
+def find(query_expression, only_in=None, cache=None, fetch=None,
+         max_workers=4, timeout=None, items=False, order_by=None,
+         descending=False, limit=None, offset=0, after=None):
     """Wrapper for OS X `mdfind` command.
 
+    A query that is too long for one `mdfind` process, such as "the name
+    is any of these 20,000 names", is split into chunks of its ``||``
+    units (see :func:`planner.split`). The chunks are run concurrently
+    and their results merged, without duplicates.
+
+    The query is answered by the current backend (see :func:`set_backend`).
+
     :param query_expression: file metadata query expression
     :type query_expression: :class:`MDExpression` object or
         :class:`MDComparison` object.
     :param only_in: limit search scope to directory tree path
     :type only_in: ``unicode``
-    :returns: full paths to files of any results
+    :param cache: reuse recent results of the same query from this cache;
+        not used with ``fetch``, nor with the arguments after ``items``
+    :type cache: :class:`FindCache`
+    :param fetch: also get these attributes of each result, from the same
+        `mdfind` process, with `-attr`
+    :type fetch: ``list`` of :class:`MDAttribute` objects or Pythonic keys
+    :param max_workers: maximum number of `mdfind` processes to run at
+        once for a split query
+    :type max_workers: ``int``
+    :param timeout: seconds to wait for each `mdfind` process
+    :type timeout: ``float``
+    :param items: return :class:`MDItem` objects, whose other attributes
+        are listed on first use, a window of results at a time
+    :type items: ``bool``
+    :param order_by: sort the results by this attribute, then by path;
+        files without it come last
+    :type order_by: :class:`MDAttribute` object or Pythonic key
+    :param descending: sort the largest values first
+    :type descending: ``bool``
+    :param limit: maximum number of results; with ``order_by``, the
+        first ones in order, found while keeping no more than
+        ``offset + limit`` results in memory
+    :type limit: ``int``
+    :param offset: number of results to skip
+    :type offset: ``int``
+    :param after: ``cursor`` of the previous :class:`Page` of results of
+        the same query and order, to get the ones after it
+    :type after: ``tuple``
+    :returns: full paths to files of any results or, with ``fetch``,
+        ``(path, metadata)`` pairs; with ``order_by``, ``limit`` or
+        ``offset``, a :class:`Page` of them
     :rtype: ``list``
+    :raises ProcessTimeout: if ``timeout`` passed first
 
     """
-    cmd = ['mdfind']
-    # add option to limit search scoe
+    if order_by is not None or limit is not None or offset or \
+            after is not None:
+        return _find_page(query_expression, only_in, fetch, items, order_by,
+                          descending, limit, offset, after, max_workers,
+                          timeout)
+    if cache is not None and fetch is None:
+        results = cache.get(query_expression, only_in)
+        if results is None:
+            results = find(query_expression, only_in, max_workers=max_workers,
+                           timeout=timeout)
+            cache.put(query_expression, only_in, results)
+    else:
+        query_expression = optimizer.optimize(query_expression)
+        if query_expression is None:
+            # no file can match, so don't bother Spotlight
+            return []
+        results = _backend.find(query_expression, only_in, fetch,
+                                max_workers, timeout)
+    if items:
+        results = [item for item in _iter_items(results, fetch)]
+    return results
+
+
+def _find_page(query_expression, only_in, fetch, items, order_by, descending,
+               limit, offset, after, max_workers, timeout):
+    """A :class:`Page` of results, for :func:`find`.
+
+    The results are streamed with their ``order_by`` attribute, from the
+    same `mdfind` process, and only the first ``offset + limit`` in order
+    are kept, in a heap.
+
+    """
+    if order_by is None:
+        if after is not None:
+            raise Exception('Paging with `after` needs `order_by`')
+        stop = None if limit is None else offset + limit
+        results = itertools.islice(
+            _page_results(query_expression, only_in, stop, fetch,
+                          max_workers, timeout), offset, None)
+        if items:
+            results = _iter_items(results, fetch)
+        return Page(results)
+    key = _backend.attr_keys([order_by])[0]
+    fetch_keys = _backend.attr_keys(fetch) if fetch is not None else None
+    sort_key = _sort_key(key, descending)
+    # files that match, and of those the ones after the cursor
+    counts = [0, 0]
+
+    def candidates():
+        for pair in _page_results(query_expression, only_in, None,
+                                  [order_by] + [attr for attr in fetch or ()],
+                                  max_workers, timeout):
+            counts[0] += 1
+            if after is not None:
+                position = sort_key(pair)
+                if (position >= after) if descending else \
+                        (position <= after):
+                    continue
+            counts[1] += 1
+            yield pair
+
+    if limit is None:
+        top = sorted(candidates(), key=sort_key, reverse=descending)
+    else:
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        top = pick(offset + limit, candidates(), key=sort_key)
+    top = top[offset:]
+    cursor = None
+    if top and counts[1] > offset + len(top):
+        cursor = sort_key(top[-1])
+    if items:
+        results = iter_items(top, list_many, _backend.attr_keys,
+                             [key] + (fetch_keys or []))
+    elif fetch_keys is None:
+        results = (path for path, _ in top)
+    else:
+        results = ((path, dict((fetch_key, md_dict[fetch_key])
+                               for fetch_key in fetch_keys
+                               if fetch_key in md_dict))
+                   for path, md_dict in top)
+    return Page(results, cursor, counts[0])
+
+
+def _page_results(query_expression, only_in, limit, fetch, max_workers,
+                  timeout):
+    """Generate results for :func:`_find_page`.
+
+    They are streamed from one process; a split query's chunks are run
+    concurrently instead, as by :func:`find`, as its results have to be
+    held to drop duplicates either way.
+
+    """
+    optimized = optimizer.optimize(query_expression)
+    if optimized is not None and len(planner.split(optimized)) > 1:
+        results = _backend.find(optimized, only_in, fetch, max_workers,
+                                timeout)
+        return itertools.islice(results, limit)
+    return iter_find(query_expression, only_in, limit, fetch,
+                     timeout=timeout)
+
+
+def _sort_key(key, descending):
+    """Key function that sorts ``(path, metadata)`` pairs by ``key``,
+    then by path, both in the same direction, with the files that have no
+    value of ``key`` last.
+
+    """
+    # the flag is compared first, so values of files that have one are
+    # never compared with `None`
+    has_value = 1 if descending else 0
+
+    def sort_key(pair):
+        path, md_dict = pair
+        value = md_dict.get(key)
+        if value is None:
+            return (1 - has_value, path)
+        return (has_value, value, path)
+    return sort_key
+
+
+def iter_find(query_expression, only_in=None, limit=None, fetch=None,
+              items=False, timeout=None):
+    """Wrapper for OS X `mdfind` command, generating paths as they are found.
+
+    Unlike :func:`find`, results are read incrementally, so memory use
+    stays flat however many files match. `mdfind` is killed once
+    ``limit`` results have been generated, or as soon as the generator is
+    closed. The chunks of a split query are run one after another.
+
+    :param query_expression: file metadata query expression
+    :type query_expression: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :param only_in: limit search scope to directory tree path
+    :type only_in: ``unicode``
+    :param limit: maximum number of results
+    :type limit: ``int``
+    :param fetch: also get these attributes of each result, as for
+        :func:`find`
+    :type fetch: ``list`` of :class:`MDAttribute` objects or Pythonic keys
+    :param items: generate :class:`MDItem` objects, as for :func:`find`;
+        they are generated a window at a time
+    :type items: ``bool``
+    :param timeout: seconds each `mdfind` process may run
+    :type timeout: ``float``
+    :returns: full paths to files of any results or, with ``fetch``,
+        ``(path, metadata)`` pairs
+    :rtype: ``generator`` of ``unicode`` or of ``tuple``s
+    :raises ProcessTimeout: if ``timeout`` passed first
+
+    """
+    if limit is not None and limit <= 0:
+        return
+    query_expression = optimizer.optimize(query_expression)
+    if query_expression is None:
+        return
+    results = _backend.iter_find(query_expression, only_in, fetch, timeout)
+    try:
+        # stop reading once there are enough results
+        found = itertools.islice(results, limit)
+        if items:
+            found = _iter_items(found, fetch)
+        for result in found:
+            yield result
+    finally:
+        results.close()
+
+
+def _iter_items(results, fetch):
+    """Wrap ``results`` in :class:`MDItem` objects that list their
+    attributes with the current backend.
+
+    """
+    fetch_keys = _backend.attr_keys(fetch) if fetch is not None else None
+    return iter_items(results, list_many, _backend.attr_keys, fetch_keys)
+
+
+def _find_many(queries, only_in, fetch, max_workers, timeout=None):
+    """Run an `mdfind` process for each of ``queries``, up to
+    ``max_workers`` at once, and merge their results.
+
+    :returns: results of each query in turn, without duplicates
+    :rtype: ``list``
+
+    """
+    attr_ids = _attr_ids(fetch) if fetch is not None else None
+    cmds = [cmd for cmd in (_find_cmd(query, only_in, attr_ids)
+                            for query in queries)
+            if cmd is not None]
+    outputs = utils.map_threads(
+        lambda cmd: utils.read_process(cmd, timeout=timeout),
+        cmds, max_workers)
+    results, seen = [], set()
+    for stdout in outputs:
+        for result in utils.decode_records(stdout):
+            if attr_ids is not None:
+                result = _parse_attr_record(result, attr_ids)
+                path = result[0]
+            else:
+                path = result
+            if path not in seen:
+                seen.add(path)
+                results.append(result)
+    return results
+
+
+def _find_cmd(query_expression, only_in=None, attr_ids=None):
+    """Argument list for `mdfind -0`, to be run without a shell.
+
+    :returns: `mdfind` command, or ``None`` if no file can match
+        ``query_expression``
+    :rtype: ``list``
+
+    """
+    query_expression = optimizer.optimize(query_expression)
+    if query_expression is None:
+        return None
+    cmd = ['mdfind', '-0']
+    # add option to limit search scope
     if only_in:
         cmd.append('-onlyin')
         cmd.append(only_in)
-    # convert `query_expression` into file metadata query expression syntax
-    query = "'" + unicode(query_expression) + "'"
-    cmd.append(query)
-    # run `mdfind` command as shell string, since otherwise it breaks
-    #print(' '.join(cmd))
-    return utils.run_process(' '.join(cmd))
+    for attr_id in attr_ids or ():
+        cmd.extend(['-attr', attr_id])
+    cmd.append(utils.text_type(query_expression))
+    return cmd
+
+
+def _parse_attr_record(record, attr_ids):
+    """Split an `mdfind -attr` result into its path and attribute values.
+
+    `mdfind` prints each requested attribute after the path, in order, as
+    ``   kMDItemName = value``. Attributes without a value are left out.
+
+    :param record: one result of `mdfind -0 -attr ...`
+    :type record: ``unicode``
+    :param attr_ids: ids of the requested attributes, in order
+    :type attr_ids: ``list``
+    :returns: ``(path, metadata)`` pair
+    :rtype: ``tuple``
+
+    """
+    md_dict = {}
+    for attr_id in reversed(attr_ids):
+        head, sep, text = record.rpartition('   {} = '.format(attr_id))
+        if not sep:
+            continue
+        record = head
+        # unlike the path, values are printed Cocoa-escaped
+        value = _attr_value(utils.decode(text), attr_id in _NUMERIC_IDS)
+        if value is not None:
+            md_dict[utils.clean_attribute(attr_id)] = value
+    return record, md_dict
+
+
+_NUMBER_RE = re.compile(r'-?\d+(\.\d+)?([eE][-+]?\d+)?\Z')
+# attributes whose values are numbers; `mdfind -attr` prints text
+# unquoted, so a title like `007` is only a number for these
+_NUMERIC_IDS = frozenset([
+    '_kMDItemOwnerUserID', 'kMDItemAltitude', 'kMDItemAperture',
+    'kMDItemAudioBitRate', 'kMDItemAudioChannelCount',
+    'kMDItemAudioSampleRate', 'kMDItemAudioTrackNumber',
+    'kMDItemBitsPerSample', 'kMDItemDiscNumber', 'kMDItemDurationSeconds',
+    'kMDItemExposureTimeSeconds', 'kMDItemFNumber', 'kMDItemFocalLength',
+    'kMDItemFocalLength35mm', 'kMDItemFSFinderFlags',
+    'kMDItemFSHasCustomIcon', 'kMDItemFSInvisible',
+    'kMDItemFSIsExtensionHidden', 'kMDItemFSIsStationery', 'kMDItemFSLabel',
+    'kMDItemFSNodeCount', 'kMDItemFSOwnerGroupID', 'kMDItemFSOwnerUserID',
+    'kMDItemFSSize', 'kMDItemGPSTrack', 'kMDItemHasAlphaChannel',
+    'kMDItemImageDirection', 'kMDItemISOSpeed', 'kMDItemLatitude',
+    'kMDItemLogicalSize', 'kMDItemLongitude', 'kMDItemMaxAperture',
+    'kMDItemNumberOfPages', 'kMDItemOrientation', 'kMDItemPageHeight',
+    'kMDItemPageWidth', 'kMDItemPhysicalSize', 'kMDItemPixelCount',
+    'kMDItemPixelHeight', 'kMDItemPixelWidth', 'kMDItemRecordingYear',
+    'kMDItemResolutionHeightDPI', 'kMDItemResolutionWidthDPI',
+    'kMDItemSpeed', 'kMDItemStarRating', 'kMDItemTempo',
+    'kMDItemTotalBitRate', 'kMDItemUseCount', 'kMDItemVideoBitRate',
+])
+_DATE_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d) '
+                      r'([-+])(\d\d)(\d\d)\Z')
+
+
+def _attr_value(text, numeric=False):
+    """Parse a value as `mdfind -attr` prints it.
+
+    :param numeric: whether the attribute's values are numbers, rather
+        than text that may look like one
+    :type numeric: ``bool``
+
+    :returns: ``int``, ``float``, :class:`datetime` (in UTC), text,
+        ``list`` of those, or ``None`` for `(null)`
+    :rtype: ``object``
 
+    """
+    text = text.strip()
+    if text == '(null)':
+        return None
+    if text.startswith('(') and text.endswith(')') and '\n' in text:
+        items = (line.strip().rstrip(',') for line in text[1:-1].split('\n'))
+        return [_attr_scalar(item, numeric) for item in items if item]
+    return _attr_scalar(text, numeric)
+
+
+def _attr_scalar(text, numeric=False):
+    """Parse a single, possibly quoted, `mdfind -attr` value.
+
+    """
+    if len(text) > 1 and text[0] == text[-1] == '"':
+        return text[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+    number = _NUMBER_RE.match(text) if numeric else None
+    if number is not None:
+        if number.group(1) or number.group(2):
+            return float(text)
+        return int(text)
+    date = _DATE_RE.match(text)
+    if date is not None:
+        parts = date.groups()
+        offset = timedelta(hours=int(parts[7]), minutes=int(parts[8]))
+        value = datetime(*[int(part) for part in parts[:6]])
+        return value - offset if parts[6] == '+' else value + offset
+    return text
 
-def list(file_path):
+
+def list(file_path, cache=None, attrs=None, timeout=None):
     """Wrapper for OS X `mdls` command.
 
     :param file_path: full path to file
     :type file_path: ``unicode``
+    :param cache: reuse metadata of unchanged files from this cache
+    :type cache: :class:`MetadataCache`
+    :param attrs: only fetch these attributes, with `mdls -name`
+    :type attrs: ``list`` of :class:`MDAttribute` objects or Pythonic keys
+    :param timeout: seconds to wait for `mdls`
+    :type timeout: ``float``
     :returns: dictionary of metadata attributes and values
     :rtype: ``dict``
+    :raises ProcessTimeout: if ``timeout`` passed first
 
     """
-    output = utils.run_process(['mdls', file_path])
-    # get metadata into list, allowing for nested attributes
-    md = [[y.strip()
-           for y in line.split('=')]
-          for line in output]
-    # iterate over list to deal with nested attributes
-    # then build dictionary
-    listed_item, md_dict = [], {}
-    for item in md:
-        # item is pair
-        if len(item) == 2:
-            k, v = item
-            # if second item is parens, then first is key
-            if v == '(':
-                listed_key = utils.clean_attribute(k)
-            # else, it's a simple `key: value` pair
-            else:
-                # attempt to convert to `int`
-                try:
-                    val = int(v)
-                except (ValueError, TypeError):
-                    val = v.replace('"', '')
-                # convert shell nulls to Python `None`
-                if val in ('""', '(null)'):
-                    val = None
-                key = utils.clean_attribute(k)
-                md_dict[key] = val
-        # single item is part of a nested attribute
-        elif len(item) == 1 and item[0] != ')':
-            value = item[0].replace('"', '')
-            listed_item.append(value)
-        # single item marks end of a nested attribute
-        elif len(item) == 1 and item[0] == ')':
-            md_dict[listed_key] = listed_item
-            listed_item = []
-    return md_dict
-
-
-def write(file_path, tag_list, attr_name='kMDItemUserTags'):
+    if cache is not None:
+        for _, md_dict in list_many([file_path], cache=cache, attrs=attrs,
+                                    timeout=timeout):
+            return md_dict
+    return _backend.list(file_path, attrs, timeout)
+
+
+def list_many(file_paths, chunk_size=500, cache=None, attrs=None,
+              timeout=None):
+    """Wrapper for OS X `mdls` command, listing many files per process.
+
+    ``file_paths`` are passed to `mdls` in chunks of at most ``chunk_size``
+    paths, further limited so that no command line exceeds the system's
+    ``ARG_MAX``. Results are generated chunk by chunk, so callers can
+    stream over arbitrarily many files.
+
+    :param file_paths: full paths to files
+    :type file_paths: iterable of ``unicode``
+    :param chunk_size: maximum number of paths per `mdls` process
+    :type chunk_size: ``int``
+    :param cache: reuse metadata of unchanged files from this cache, and
+        store what is listed in it
+    :type cache: :class:`MetadataCache`
+    :param attrs: only fetch these attributes, with `mdls -name`; files
+        missing from ``cache`` are still listed in full, so that their
+        cached metadata can serve any later projection
+    :type attrs: ``list`` of :class:`MDAttribute` objects or Pythonic keys
+    :param timeout: seconds to wait for each `mdls` process
+    :type timeout: ``float``
+    :returns: ``(file_path, metadata)`` pairs, in the order of
+        ``file_paths``, where ``metadata`` is as returned by :func:`list`
+    :rtype: ``generator`` of ``tuple``s
+    :raises ProcessTimeout: if ``timeout`` passed first
+
+    """
+    keys = _backend.attr_keys(attrs) if cache is not None else None
+    for chunk in utils.chunk_args(file_paths, chunk_size, MDLS_PLIST):
+        if cache is None:
+            for pair in _backend.list_many(chunk, attrs, timeout):
+                yield pair
+            continue
+        hits, misses = cache.get_many(chunk)
+        if misses:
+            listed = dict(_backend.list_many(
+                [file_path for file_path, _ in misses], None, timeout))
+            cache.put_many((file_path, listed[file_path], stat)
+                           for file_path, stat in misses
+                           if stat is not None)
+            hits.update(listed)
+        for file_path in chunk:
+            md_dict = hits[file_path]
+            if keys is not None:
+                md_dict = dict((key, md_dict[key])
+                               for key in keys if key in md_dict)
+            yield file_path, md_dict
+
+
+def _list_cmd(attrs=None):
+    """Argument list for `mdls -plist -`, fetching only ``attrs``.
+
+    :returns: `mdls` command, to be followed by file paths
+    :rtype: ``list``
+
+    """
+    if attrs is None:
+        return MDLS_PLIST
+    cmd = ['mdls']
+    for attr_id in _attr_ids(attrs):
+        cmd.extend(['-name', attr_id])
+    return cmd + MDLS_PLIST[1:]
+
+
+def _list_chunk(cmd, chunk, timeout=None):
+    """List the files in ``chunk`` with a single `mdls` process.
+
+    :returns: ``(file_path, metadata)`` pairs, in the order of ``chunk``
+    :rtype: ``list`` of ``tuple``s
+
+    """
+    output = utils.read_process(cmd + chunk, timeout=timeout)
+    md_dicts = [md_dict for md_dict in _parse_plists(output)]
+    # a path `mdls` can't list leaves no output, so the listings no
+    # longer line up with the paths; list that chunk one by one
+    if len(md_dicts) != len(chunk):
+        md_dicts = [_list_one(cmd, file_path, timeout)
+                    for file_path in chunk]
+    return zip(chunk, md_dicts)
+
+
+def _list_one(cmd, file_path, timeout=None):
+    """List ``file_path`` alone, with `mdls` command ``cmd``.
+
+    :returns: dictionary of metadata attributes and values, empty if the
+        file can't be listed
+    :rtype: ``dict``
+
+    """
+    output = utils.read_process(cmd + [file_path], timeout=timeout)
+    for md_dict in _parse_plists(output):
+        return md_dict
+    return {}
+
+
+def _attr_ids(attrs):
+    """Spotlight ids of ``attrs``.
+
+    :param attrs: attributes, by Spotlight id, Pythonic key or alias
+    :type attrs: ``list`` of :class:`MDAttribute` objects or ``unicode``
+    :returns: attribute ids, like ``kMDItemFSName``
+    :rtype: ``list``
+
+    """
+    ids = []
+    for attr in attrs:
+        attr_id = getattr(attr, 'id', None)
+        if attr_id is None:
+            info = catalog.get(attr)
+            if info is None:
+                raise Exception('Unknown attribute: `{}`'.format(attr))
+            attr_id = info['id']
+        ids.append(attr_id)
+    return ids
+
+
+def _attr_keys(attrs):
+    """Pythonic keys of ``attrs``, or ``None`` for all attributes.
+
+    :param attrs: attributes, by Spotlight id, Pythonic key or alias
+    :type attrs: ``list`` of :class:`MDAttribute` objects or ``unicode``
+    :returns: keys of the attributes in listed metadata
+    :rtype: ``list``
+
+    """
+    if attrs is None:
+        return None
+    return [utils.clean_attribute(attr_id) for attr_id in _attr_ids(attrs)]
+
+
+def _parse_plists(output):
+    """Parse `mdls -plist -` output into one dictionary per listed file.
+
+    `mdls` prints one XML property list per file, back to back. They are
+    read in a single pass of :data:`PLIST_TOKEN_RE` over the raw bytes,
+    and values come back as ``int``, ``float``, ``bool``,
+    :class:`datetime` (in UTC), text, ``bytes`` or ``list``. Attributes
+    without a value are left out.
+
+    :param output: raw `mdls -plist -` output
+    :type output: ``bytes``
+    :returns: dictionaries of metadata attributes and values
+    :rtype: ``generator`` of ``dict``s
+
+    """
+    # enclosing containers, each with the key it will be stored under
+    stack = []
+    container, in_dict, key = None, False, None
+    for match in PLIST_TOKEN_RE.finditer(output):
+        tag, text, empty, opening, closing = match.groups()
+        if tag == b'key':
+            key = _plist_keys.get(text)
+            if key is None:
+                key = _plist_keys[text] = _plist_text(text)
+            continue
+        elif tag is not None:
+            value = _PLIST_VALUES[tag](text)
+        elif opening is not None:
+            stack.append((container, in_dict, key))
+            in_dict = opening == b'dict'
+            container = {} if in_dict else []
+            continue
+        elif closing is not None:
+            value = container
+            container, in_dict, key = stack.pop()
+            if container is None:
+                # end of one file's property list
+                yield dict((utils.clean_attribute(name), item)
+                           for name, item in value.items())
+                continue
+        elif empty == b'key':
+            key = ''
+            continue
+        else:
+            value = _PLIST_EMPTY[empty]()
+        if in_dict:
+            container[key] = value
+        elif container is not None:
+            container.append(value)
+
+
+# one element of an XML property list; other markup is skipped over
+PLIST_TOKEN_RE = re.compile(
+    br'<(key|string|integer|real|date|data)>([^<]*)</\1>'
+    br'|<(key|string|array|dict|true|false|data)/>'
+    br'|<(array|dict)>'
+    br'|</(array|dict)>')
+_ENTITY_RE = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+# decoded attribute ids, which recur in every listing
+_plist_keys = {}
+
+
+def _plist_text(text):
+    """Decode the character data of a property list element.
+
+    Property lists hold plain UTF-8, without the Cocoa escapes of the text
+    listing, so only non-ASCII text needs more than a decode.
+
+    """
+    try:
+        text = text.decode('ascii')
+    except UnicodeDecodeError:
+        text = unicodedata.normalize('NFC', text.decode('utf-8'))
+    if '&' in text:
+        text = _ENTITY_RE.sub(_unescape, text)
+    return text
+
+
+def _unescape(match):
+    """Replacement text of an XML entity or character reference.
+
+    """
+    name = match.group(1)
+    if name.startswith('#x'):
+        return utils.unichr(int(name[2:], 16))
+    if name.startswith('#'):
+        return utils.unichr(int(name[1:]))
+    return _ENTITIES[name]
+
+
+def _plist_date(text):
+    """Parse a property list date, ``YYYY-MM-DDTHH:MM:SSZ``, in UTC.
+
+    """
+    return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                    int(text[11:13]), int(text[14:16]), int(text[17:19]))
+
+
+_PLIST_VALUES = {
+    b'string': _plist_text,
+    b'integer': int,
+    b'real': float,
+    b'date': _plist_date,
+    b'data': lambda text: base64.b64decode(b''.join(text.split())),
+}
+_PLIST_EMPTY = {
+    b'string': lambda: '',
+    b'array': lambda: [],
+    b'dict': lambda: {},
+    b'true': lambda: True,
+    b'false': lambda: False,
+    b'data': lambda: b'',
+}
+
+
+def write(file_path, tag_list, attr_name='kMDItemUserTags', timeout=None):
     """Writes the list of tags to xattr field of ``file_path``
 
+    To tag many files without starting an `xattr` process for each, use
+    :func:`write_tags`.
+
     :param file_path: full path to file
     :type file_path: ``unicode``
     :param tag_list: values to write to attributes
     :type tag_list: ``list``
     :param attr_name: full name of OS X file metadata attribute
     :type attr_name: ``unicode``
+    :param timeout: seconds to wait for `xattr`
+    :type timeout: ``float``
+    :raises ProcessTimeout: if ``timeout`` passed first
+
+    """
+    return _backend.write(file_path, tag_list, attr_name, timeout)
+
+
+def _write_cmd(file_path, tag_list, attr_name):
+    """Argument list for the `xattr` command :func:`write` runs.
+
+    :returns: `xattr` command
+    :rtype: ``list``
 
     """
     tag_data = ['<string>{}</string>'.format(tag) for tag in tag_list]
@@ -105,7 +709,101 @@ def write(file_path, tag_list, attr_name='kMDItemUserTags'):
            xattr,
            tag_text.encode("utf8"),
            file_path]
-    return utils.run_process(cmd)
+    return cmd
+
+
+## Backends  ------------------------------------------------------------------
+
+class SpotlightBackend(backends.Backend):
+    """Answer queries with Spotlight's `mdfind`, `mdls` and `xattr`
+    commands. This is the default backend.
+
+    """
+
+    def find(self, query_expression, only_in=None, fetch=None,
+             max_workers=4, timeout=None):
+        queries = planner.split(query_expression)
+        return _find_many(queries, only_in, fetch, max_workers, timeout)
+
+    def iter_find(self, query_expression, only_in=None, fetch=None,
+                  timeout=None):
+        attr_ids = _attr_ids(fetch) if fetch is not None else None
+        queries = planner.split(query_expression)
+        # the results of a split query may overlap
+        seen = set() if len(queries) > 1 else None
+        for query in queries:
+            cmd = _find_cmd(query, only_in, attr_ids)
+            if cmd is None:
+                continue
+            results = utils.iter_process(cmd, timeout=timeout)
+            try:
+                for result in results:
+                    if attr_ids is not None:
+                        result = _parse_attr_record(result, attr_ids)
+                    if seen is not None:
+                        path = result[0] if attr_ids is not None else result
+                        if path in seen:
+                            continue
+                        seen.add(path)
+                    yield result
+            finally:
+                results.close()
+
+    def list(self, file_path, attrs=None, timeout=None):
+        return _list_one(_list_cmd(attrs), file_path, timeout)
+
+    def list_many(self, file_paths, attrs=None, timeout=None):
+        cmd = _list_cmd(attrs)
+        pairs = []
+        for chunk in utils.chunk_args(file_paths, len(file_paths), cmd):
+            pairs.extend(_list_chunk(cmd, chunk, timeout))
+        return pairs
+
+    def attr_keys(self, attrs):
+        return _attr_keys(attrs)
+
+    def write(self, file_path, tag_list, attr_name='kMDItemUserTags',
+              timeout=None):
+        return utils.run_process(_write_cmd(file_path, tag_list, attr_name),
+                                 timeout=timeout)
+
+
+def get_backend():
+    """The backend that answers :func:`find`, :func:`list` and
+    :func:`write`.
+
+    :rtype: :class:`Backend`
+
+    """
+    return _backend
+
+
+def set_backend(backend):
+    """Answer :func:`find`, :func:`iter_find`, :func:`list`,
+    :func:`list_many` and :func:`write` with ``backend`` from now on.
+
+    :param backend: the new backend, or ``None`` for the default
+    :type backend: :class:`Backend`
+    :returns: the previous backend
+    :rtype: :class:`Backend`
+
+    """
+    global _backend
+    previous = _backend
+    _backend = backend if backend is not None else _default_backend()
+    return previous
+
+
+def _default_backend():
+    """Spotlight, unless ``METADATA_BACKEND`` is ``local``.
+
+    """
+    if os.environ.get('METADATA_BACKEND') == 'local':
+        return backends.LocalBackend()
+    return SpotlightBackend()
+
+
+_backend = _default_backend()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,792 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Persistent inverted index of some attributes of the files in one
+directory tree, to answer queries about it without starting `mdfind`.
+
+Each indexed attribute has a column of entries, one per value of each
+file, sorted by value:
+
+* numbers and dates are kept as sorted arrays, so a comparison or
+  ``InRange`` is two binary searches,
+* text is kept case and diacritic folded, with a hash of each distinct
+  value for equality, and a trigram index of the distinct values for
+  ``*wildcard*`` matches.
+
+A query is answered by set intersection and union over the files each
+comparison matches. The comparisons of an ``&&`` are taken most selective
+first; once few files are left, the rest are checked against those files
+alone rather than looked up.
+
+Changes are applied with :meth:`Index.update`: changed files are added
+as new entries, which are checked one by one until there are enough of
+them to merge into the columns, and removed files are left out of the
+results.
+
+"""
+from __future__ import unicode_literals
+
+import os
+import re
+import errno
+import pickle
+import bisect
+import hashlib
+import tempfile
+import threading
+from array import array
+
+from . import utils
+from . import catalog
+from . import backends
+from . import functions
+from . import predicates
+from .cache import file_stamp
+from .classes import MDAttribute
+
+# bump whenever the layout of the index file changes
+INDEX_VERSION = 2
+# attributes indexed unless others are asked for
+DEFAULT_ATTRS = ['kMDItemFSName', 'kMDItemLogicalSize', 'kMDItemContentType',
+                 'kMDItemContentCreationDate',
+                 'kMDItemContentModificationDate']
+# a comparison that would match this many times more files than are left
+# is checked against those files instead of looked up
+VERIFY_RATIO = 8
+# entries added or removed since the columns were built, as a fraction of
+# all entries, that trigger a merge
+MERGE_FRACTION = 0.02
+MERGE_MIN = 1000
+
+_WILDCARD_RE = re.compile(r'[*?]')
+
+
+class Index(backends.Backend):
+    """Inverted index of ``attrs`` of the files under ``root``.
+
+    The index is built on first use, from ``backend``, and saved to
+    ``path``; later instances with the same ``root`` and ``attrs`` load
+    it from there. Keep it up to date with an :class:`Updater`, or with
+    :meth:`update`; :meth:`build` starts over.
+
+    An index is a backend: pass it to :func:`set_backend`, and
+    :func:`find` and :func:`iter_find` answer queries about ``root`` from
+    it. Queries about other directories or attributes, and the other
+    functions, are passed on to ``backend``.
+
+    :param root: full path to the indexed directory
+    :type root: ``unicode``
+    :param attrs: attributes to index, by :class:`MDAttribute`, Spotlight
+        id or Pythonic key; by default :data:`DEFAULT_ATTRS`
+    :type attrs: ``list``
+    :param path: full path to the index file; defaults to a file beside
+        the attribute catalog cache
+    :type path: ``unicode``
+    :param backend: backend to build the index from and to pass other
+        calls to; by default the current backend
+    :type backend: :class:`Backend`
+
+    """
+
+    def __init__(self, root, attrs=None, path=None, backend=None):
+        self.root = os.path.abspath(root)
+        self.backend = backend if backend is not None \
+            else functions.get_backend()
+        if attrs is None:
+            attrs = [MDAttribute(attr_id) for attr_id in DEFAULT_ATTRS]
+        self.attrs = attrs
+        self.keys = self.backend.attr_keys(attrs)
+        if path is None:
+            digest = hashlib.sha1('\0'.join([self.root] + self.keys)
+                                  .encode('utf-8')).hexdigest()[:16]
+            path = os.path.join(os.path.dirname(catalog.cache_path()),
+                                'index-v{}-{}.pickle'.format(INDEX_VERSION,
+                                                             digest))
+        self.path = os.path.abspath(path)
+        # full paths of the indexed files, by document number; the
+        # documents of removed files are kept, as `None`, until a merge
+        self._paths = None
+        # values of each attribute, by document number
+        self._data = {}
+        # `(inode, mtime, size)` of each file when it was indexed
+        self._stamps = []
+        self._columns = {}
+        # documents below this number are in the columns
+        self._indexed = 0
+        self._deleted = set()
+        # caches of document numbers, by path and by attribute
+        self._ids = None
+        self._dirs = None
+        self._present = {}
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._paths or ()) - len(self._deleted)
+
+    # Building  ---------------------------------------------------------------
+
+    def build(self, records=None):
+        """Index ``records`` from scratch, and save the index.
+
+        :param records: ``(path, metadata)`` pairs; by default every file
+            under ``root``, found by ``backend``
+        :type records: iterable of ``tuple``s
+
+        """
+        if records is None:
+            everything = MDAttribute('kMDItemFSName') == '*'
+            records = self.backend.iter_find(everything, self.root,
+                                             self.attrs)
+        paths = []
+        data = dict((key, []) for key in self.keys)
+        for path, md_dict in records:
+            paths.append(path)
+            for key in self.keys:
+                data[key].append(md_dict.get(key))
+        stamps = [file_stamp(backends._fs_path(path)) for path in paths]
+        columns = dict((key, _column(key, values))
+                       for key, values in data.items())
+        with self._lock:
+            self._paths, self._data, self._stamps = paths, data, stamps
+            self._columns = columns
+            self._indexed = len(paths)
+            self._deleted = set()
+            self._ids = self._dirs = None
+            self._present = {}
+        self.save()
+
+    def update(self, records=(), removed=()):
+        """Apply changes to the indexed files.
+
+        The columns are merged again, by :meth:`merge`, once enough has
+        changed.
+
+        :param records: ``(path, metadata)`` pairs of changed or new
+            files, or ``(path, metadata, stamp)`` triples, where
+            ``stamp`` is the file's ``(inode, mtime, size)`` from before
+            it was listed; a file with empty metadata is removed
+        :type records: iterable of ``tuple``s
+        :param removed: full paths to files and directories that are gone
+        :type removed: iterable of ``unicode``
+
+        """
+        with self._lock:
+            if self._paths is None:
+                self.build()
+            ids = self._doc_ids()
+            for path in removed:
+                self._remove(path)
+            for record in records:
+                path, md_dict = record[:2]
+                if not md_dict:
+                    self._remove(path)
+                    continue
+                stamp = record[2] if len(record) > 2 else \
+                    file_stamp(backends._fs_path(path))
+                if path in ids:
+                    # a changed directory keeps the files under it
+                    self._delete(ids.pop(path))
+                doc = ids[path] = len(self._paths)
+                self._paths.append(path)
+                self._stamps.append(stamp)
+                for key in self.keys:
+                    value = md_dict.get(key)
+                    self._data[key].append(value)
+                    if value is not None and key in self._present:
+                        self._present[key].add(doc)
+                self._add_dirs(path)
+            changes = len(self._paths) - self._indexed + len(self._deleted)
+        if changes > max(MERGE_MIN, MERGE_FRACTION * len(self._paths)):
+            self.merge()
+
+    def refresh(self, changed=(), removed=()):
+        """List ``changed`` files with ``backend``, and apply the changes,
+        for :class:`Updater`.
+
+        :param changed: full paths to files that may have changed
+        :type changed: ``list``
+        :param removed: full paths to files and directories that are gone
+        :type removed: ``list``
+
+        """
+        changed = [path for path in changed]
+        records = []
+        for start in range(0, len(changed), 500):
+            chunk = changed[start:start + 500]
+            stamps = [file_stamp(backends._fs_path(path)) for path in chunk]
+            records.extend((path, md_dict, stamp) for (path, md_dict), stamp
+                           in zip(self.backend.list_many(chunk, self.attrs),
+                                  stamps))
+        self.update(records, removed)
+
+    def stamps(self, root):
+        """``(inode, mtime, size)`` of the indexed files under ``root``,
+        as they were when indexed.
+
+        :param root: full path to a directory
+        :type root: ``unicode``
+        :rtype: ``dict``
+
+        """
+        scope = os.path.join(os.path.abspath(root), '')
+        with self._lock:
+            return dict((path, stamp) for path, stamp
+                        in zip(self._paths or (), self._stamps)
+                        if path is not None and path.startswith(scope))
+
+    def merge(self):
+        """Build the columns again, with the entries added since and
+        without those of removed files.
+
+        The columns are built while queries go on; only taking stock and
+        swapping in the result hold up other threads.
+
+        """
+        if not self._merge_lock.acquire(False):
+            # another thread is merging
+            return
+        try:
+            with self._lock:
+                count = len(self._paths)
+                live = [doc for doc in range(count)
+                        if doc not in self._deleted]
+                paths = [self._paths[doc] for doc in live]
+                stamps = [self._stamps[doc] for doc in live]
+                data = dict((key, [values[doc] for doc in live])
+                            for key, values in self._data.items())
+            columns = dict((key, _column(key, values))
+                           for key, values in data.items())
+            with self._lock:
+                renumbered = dict((doc, new) for new, doc in enumerate(live))
+                # entries added and removed while the columns were built
+                deleted = set(renumbered[doc] for doc in self._deleted
+                              if doc in renumbered)
+                for doc in range(count, len(self._paths)):
+                    if doc in self._deleted:
+                        deleted.add(len(paths))
+                    paths.append(self._paths[doc])
+                    stamps.append(self._stamps[doc])
+                    for key, values in data.items():
+                        values.append(self._data[key][doc])
+                self._paths, self._data, self._stamps = paths, data, stamps
+                self._columns = columns
+                self._indexed = len(live)
+                self._deleted = deleted
+                self._ids = self._dirs = None
+                self._present = {}
+        finally:
+            self._merge_lock.release()
+
+    def save(self):
+        """Write the index to ``path``.
+
+        """
+        with self._lock:
+            # copies, so that the index can change while it's written
+            state = {'version': INDEX_VERSION, 'root': self.root,
+                     'keys': self.keys, 'paths': list(self._paths or ()),
+                     'data': dict((key, list(values)) for key, values
+                                  in self._data.items()),
+                     'stamps': list(self._stamps),
+                     'columns': self._columns, 'indexed': self._indexed,
+                     'deleted': set(self._deleted)}
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'wb') as tmp_file:
+            pickle.dump(state, tmp_file, 2)
+        os.rename(tmp_path, self.path)
+
+    def _load(self):
+        """Read the index from ``path``, if it holds one of ``root`` and
+        ``attrs``.
+
+        """
+        try:
+            with open(self.path, 'rb') as fp:
+                state = pickle.load(fp)
+        except (IOError, OSError, EOFError, ValueError, pickle.PickleError):
+            return
+        if state.get('version') != INDEX_VERSION or \
+                state.get('root') != self.root or \
+                state.get('keys') != self.keys:
+            return
+        self._paths = state['paths']
+        self._data = state['data']
+        self._stamps = state['stamps']
+        self._columns = state['columns']
+        self._indexed = state['indexed']
+        self._deleted = state['deleted']
+
+    def _doc_ids(self):
+        """Map the paths of the indexed files to their documents.
+
+        """
+        if self._ids is None:
+            self._ids = dict((path, doc) for doc, path
+                             in enumerate(self._paths)
+                             if path is not None)
+        return self._ids
+
+    def _doc_dirs(self):
+        """Directories that hold indexed files, at any depth.
+
+        """
+        if self._dirs is None:
+            self._dirs = set()
+            for path in self._doc_ids():
+                self._add_dirs(path)
+        return self._dirs
+
+    def _add_dirs(self, path):
+        dirs = self._doc_dirs()
+        path = os.path.dirname(path)
+        while path not in dirs and len(path) > len(self.root):
+            dirs.add(path)
+            path = os.path.dirname(path)
+
+    def _remove(self, path):
+        """Leave ``path``, and the files under it, out of the index.
+
+        """
+        ids = self._doc_ids()
+        docs = [ids.pop(path)] if path in ids else []
+        if path in self._doc_dirs():
+            self._dirs.discard(path)
+            scope = os.path.join(path, '')
+            children = [child for child in ids if child.startswith(scope)]
+            docs.extend(ids.pop(child) for child in children)
+        for doc in docs:
+            self._delete(doc)
+
+    def _delete(self, doc):
+        """Leave document ``doc`` out of the index.
+
+        """
+        self._deleted.add(doc)
+        # free what the document held
+        self._paths[doc] = self._stamps[doc] = None
+        for values in self._data.values():
+            values[doc] = None
+
+    # Backend  ----------------------------------------------------------------
+
+    def find(self, query_expression, only_in=None, fetch=None,
+             max_workers=4, timeout=None):
+        fetch_keys = self.attr_keys(fetch) if fetch is not None else None
+        if not self._answers(query_expression, only_in, fetch_keys):
+            return self.backend.find(query_expression, only_in, fetch,
+                                     max_workers, timeout)
+        return self._search(query_expression, only_in, fetch_keys)
+
+    def iter_find(self, query_expression, only_in=None, fetch=None,
+                  timeout=None):
+        fetch_keys = self.attr_keys(fetch) if fetch is not None else None
+        if not self._answers(query_expression, only_in, fetch_keys):
+            results = self.backend.iter_find(query_expression, only_in,
+                                             fetch, timeout)
+        else:
+            results = iter(self._search(query_expression, only_in,
+                                        fetch_keys))
+        try:
+            for result in results:
+                yield result
+        finally:
+            if hasattr(results, 'close'):
+                results.close()
+
+    def list(self, file_path, attrs=None, timeout=None):
+        return self.backend.list(file_path, attrs, timeout)
+
+    def list_many(self, file_paths, attrs=None, timeout=None):
+        return self.backend.list_many(file_paths, attrs, timeout)
+
+    def attr_keys(self, attrs):
+        return self.backend.attr_keys(attrs)
+
+    def write(self, file_path, tag_list, attr_name='kMDItemUserTags',
+              timeout=None):
+        return self.backend.write(file_path, tag_list, attr_name, timeout)
+
+    def _answers(self, query_expression, only_in, fetch_keys):
+        """Whether the index can answer a query.
+
+        """
+        if not hasattr(query_expression, 'compile'):
+            return False
+        if only_in:
+            scope = os.path.abspath(only_in)
+            if scope != self.root and \
+                    not scope.startswith(os.path.join(self.root, '')):
+                return False
+        keys = set(backends._query_keys(query_expression))
+        keys.update(fetch_keys or ())
+        return keys.issubset(self.keys)
+
+    def _result(self, doc, fetch_keys):
+        path = self._paths[doc]
+        if fetch_keys is None:
+            return path
+        md_dict = {}
+        for key in fetch_keys:
+            value = self._data[key][doc]
+            if value is not None:
+                md_dict[key] = value
+        return path, md_dict
+
+    # Queries  ----------------------------------------------------------------
+
+    def _search(self, query_expression, only_in=None, fetch_keys=None):
+        """Results for the files that match, in the order they were
+        indexed.
+
+        """
+        if self._paths is None:
+            self.build()
+        with self._lock:
+            docs = self._evaluate(query_expression, None)
+            if self._deleted:
+                docs -= self._deleted
+            docs = sorted(docs)
+            if only_in and os.path.abspath(only_in) != self.root:
+                scope = os.path.join(os.path.abspath(only_in), '')
+                docs = [doc for doc in docs
+                        if self._paths[doc].startswith(scope)]
+            return [self._result(doc, fetch_keys) for doc in docs]
+
+    def _evaluate(self, node, within):
+        """Documents among ``within`` (or all, if ``None``) that match
+        ``node``.
+
+        :rtype: ``set``
+
+        """
+        units = getattr(node, 'units', None)
+        if units is None:
+            if within is not None and \
+                    len(within) * VERIFY_RATIO < self._estimate(node):
+                return self._verify(node, within)
+            docs = self._lookup(node)
+            return docs if within is None else docs & within
+        if node.operator.strip() == '&&':
+            # the most selective first, so later sets are small
+            for unit in sorted(units, key=self._estimate):
+                within = self._evaluate(unit, within)
+                if not within:
+                    break
+            return within
+        docs = set()
+        for unit in units:
+            docs |= self._evaluate(unit, within)
+        return docs
+
+    def _estimate(self, node):
+        """About how many files ``node`` matches.
+
+        """
+        units = getattr(node, 'units', None)
+        if units is not None:
+            estimates = [self._estimate(unit) for unit in units]
+            if node.operator.strip() == '&&':
+                return min(estimates)
+            return sum(estimates)
+        column, value = self._column(node)
+        if column is None:
+            return len(self._paths)
+        if node.operator == '!=':
+            return len(self._paths) - column.estimate('==', value)
+        return column.estimate(node.operator, value)
+
+    def _lookup(self, comparison):
+        """Documents that match ``comparison``, from its column and the
+        documents added since it was built.
+
+        :rtype: ``set``
+
+        """
+        column, value = self._column(comparison)
+        if column is None:
+            return self._verify(comparison,
+                                self._present_docs(comparison.attribute.key))
+        if comparison.operator == '!=':
+            # "no value matches", which for several values is not
+            # "some value doesn't match" of numbers
+            if isinstance(column, _NumberColumn) and column.multi:
+                return self._verify(
+                    comparison, self._present_docs(comparison.attribute.key))
+            equal = comparison._with('==', comparison.predicate)
+            return self._present_docs(comparison.attribute.key) - \
+                self._lookup(equal)
+        docs = column.lookup(comparison.operator, value)
+        if isinstance(column, _TextColumn) and \
+                not (comparison.ignore_case and comparison.ignore_diacritics):
+            # folded values match case and diacritic insensitively
+            docs = self._verify(comparison, docs)
+        if self._indexed < len(self._paths):
+            docs |= self._verify(comparison,
+                                 range(self._indexed, len(self._paths)))
+        return docs
+
+    def _column(self, comparison):
+        """Column that answers ``comparison``, and the value to look up,
+        or ``(None, None)`` if every file has to be checked.
+
+        """
+        key = comparison.attribute.key
+        column = self._columns.get(key)
+        predicate = comparison.predicate
+        if isinstance(column, _NumberColumn):
+            in_range = comparison.operator == 'InRange'
+            values = predicate if in_range else (predicate,)
+            if 'date' in key:
+                values = tuple(utils.parse_date(value) for value in values)
+            elif not all(isinstance(value, (int, float)) and
+                         not isinstance(value, bool) for value in values):
+                return None, None
+            return column, values if in_range else values[0]
+        if isinstance(column, _TextColumn) and \
+                comparison.operator in ('==', '!=') and \
+                isinstance(predicate, utils.text_type):
+            return column, _fold(predicate)
+        return None, None
+
+    def _verify(self, comparison, docs):
+        """Documents among ``docs`` that match ``comparison``, checked one
+        by one.
+
+        :rtype: ``set``
+
+        """
+        key = comparison.attribute.key
+        values = self._data[key]
+        column, pattern = self._column(comparison)
+        if isinstance(column, _TextColumn) and comparison.ignore_case and \
+                comparison.ignore_diacritics:
+            # the same test, minus the cost of the general predicate
+            matches = _folded_matcher(comparison.operator, pattern)
+            return set(doc for doc in docs if matches(values[doc]))
+        matches = comparison.compile()
+        return set(doc for doc in docs if matches({key: values[doc]}))
+
+    def _present_docs(self, key):
+        """Documents with a value of ``key``.
+
+        :rtype: ``set``
+
+        """
+        docs = self._present.get(key)
+        if docs is None:
+            docs = self._present[key] = set(
+                doc for doc, value in enumerate(self._data[key])
+                if value is not None)
+        return docs
+
+
+## Columns  -------------------------------------------------------------------
+
+class _NumberColumn(object):
+    """Numbers (or dates, as timestamps) of one attribute, sorted, with the
+    document each came from.
+
+    """
+
+    def __init__(self, values, docs):
+        order = sorted(range(len(values)), key=values.__getitem__)
+        self.values = array('d', [values[i] for i in order])
+        self.docs = array('l', [docs[i] for i in order])
+        # whether some document has several values
+        self.multi = len(set(docs)) < len(docs)
+
+    def lookup(self, op, value):
+        low, high = self._bounds(op, value)
+        return set(self.docs[low:high])
+
+    def estimate(self, op, value):
+        low, high = self._bounds(op, value)
+        return high - low
+
+    def _bounds(self, op, value):
+        values = self.values
+        if op == 'InRange':
+            return (bisect.bisect_left(values, value[0]),
+                    bisect.bisect_right(values, value[1]))
+        if op == '==':
+            return (bisect.bisect_left(values, value),
+                    bisect.bisect_right(values, value))
+        if op == '<':
+            return 0, bisect.bisect_left(values, value)
+        if op == '<=':
+            return 0, bisect.bisect_right(values, value)
+        if op == '>':
+            return bisect.bisect_right(values, value), len(values)
+        return bisect.bisect_left(values, value), len(values)
+
+
+class _TextColumn(object):
+    """Folded text of one attribute: its distinct values, sorted, each
+    with the documents that hold it, and a trigram index of the values.
+
+    """
+
+    def __init__(self, values, docs):
+        folded = [_fold(value) for value in values]
+        order = sorted(range(len(folded)), key=folded.__getitem__)
+        self.docs = array('l', [docs[i] for i in order])
+        self.values = []
+        # documents of value `i` are `docs[offsets[i]:offsets[i + 1]]`
+        self.offsets = array('l')
+        for position, i in enumerate(order):
+            if not self.values or folded[i] != self.values[-1]:
+                self.values.append(folded[i])
+                self.offsets.append(position)
+        self.offsets.append(len(order))
+        self.ordinals = dict((value, ordinal)
+                             for ordinal, value in enumerate(self.values))
+        trigrams = {}
+        for ordinal, value in enumerate(self.values):
+            for trigram in set(_trigrams(value)):
+                trigrams.setdefault(trigram, []).append(ordinal)
+        self.trigrams = dict((trigram, array('l', ordinals))
+                             for trigram, ordinals in trigrams.items())
+
+    def lookup(self, op, pattern):
+        docs = set()
+        for ordinal in self._matches(pattern):
+            docs.update(self.docs[self.offsets[ordinal]:
+                                  self.offsets[ordinal + 1]])
+        return docs
+
+    def estimate(self, op, pattern):
+        if not _WILDCARD_RE.search(pattern):
+            ordinal = self.ordinals.get(pattern)
+            if ordinal is None:
+                return 0
+            return self.offsets[ordinal + 1] - self.offsets[ordinal]
+        low, high = self._prefix_range(pattern)
+        estimate = self.offsets[high] - self.offsets[low]
+        for trigram in _pattern_trigrams(pattern):
+            estimate = min(estimate, len(self.trigrams.get(trigram, ())))
+        return estimate
+
+    def _matches(self, pattern):
+        """Ordinals of the values that match ``pattern``.
+
+        """
+        if not _WILDCARD_RE.search(pattern):
+            ordinal = self.ordinals.get(pattern)
+            return [] if ordinal is None else [ordinal]
+        low, high = self._prefix_range(pattern)
+        candidates = range(low, high)
+        postings = sorted((self.trigrams.get(trigram, ())
+                           for trigram in _pattern_trigrams(pattern)),
+                          key=len)
+        if postings and len(postings[0]) < high - low:
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+        match = _pattern_regex(pattern).match
+        values = self.values
+        return [ordinal for ordinal in candidates
+                if match(values[ordinal]) is not None]
+
+    def _prefix_range(self, pattern):
+        """Ordinals of the values that start with the text before the
+        first wildcard in ``pattern``.
+
+        """
+        prefix = _WILDCARD_RE.split(pattern, 1)[0]
+        if not prefix:
+            return 0, len(self.values)
+        after = prefix[:-1] + utils.unichr(ord(prefix[-1]) + 1)
+        return (bisect.bisect_left(self.values, prefix),
+                bisect.bisect_left(self.values, after))
+
+
+def _column(key, values):
+    """Column of the values of ``key``, or ``None`` if they are neither
+    all numbers nor all text.
+
+    """
+    items, docs = [], []
+    for doc, value in enumerate(values):
+        if value is None:
+            continue
+        for item in (value if isinstance(value, type([])) else (value,)):
+            if item is not None:
+                items.append(item)
+                docs.append(doc)
+    if 'date' in key:
+        stamps = [utils.value_timestamp(item) for item in items]
+        docs = [doc for doc, stamp in zip(docs, stamps) if stamp is not None]
+        return _NumberColumn([stamp for stamp in stamps
+                              if stamp is not None], docs)
+    if all(isinstance(item, (int, float)) and not isinstance(item, bool)
+           for item in items):
+        return _NumberColumn(items, docs)
+    if all(isinstance(item, utils.text_type) for item in items):
+        return _TextColumn(items, docs)
+    return None
+
+
+## Helper Functions  ----------------------------------------------------------
+
+def _fold(text):
+    """``text`` in lower case, without diacritics.
+
+    """
+    text = text.lower()
+    if utils._is_ascii(text):
+        return text
+    return predicates._strip_diacritics(text)
+
+
+def _trigrams(text):
+    return [text[i:i + 3] for i in range(len(text) - 2)]
+
+
+def _pattern_trigrams(pattern):
+    """Trigrams every value that matches ``pattern`` contains.
+
+    """
+    trigrams = []
+    for literal in _WILDCARD_RE.split(pattern):
+        trigrams.extend(_trigrams(literal))
+    return trigrams
+
+
+def _folded_matcher(op, pattern):
+    """Test of text values against a folded wildcard ``pattern``, for a
+    comparison that ignores case and diacritics.
+
+    """
+    match = _pattern_regex(pattern).match
+
+    def matches(value):
+        if value is None:
+            return False
+        if isinstance(value, type([])):
+            found = any(match(_fold(item)) is not None
+                        for item in value if item is not None)
+        else:
+            found = match(_fold(value)) is not None
+        return found if op == '==' else not found
+    return matches
+
+
+def _pattern_regex(pattern):
+    """Regular expression of a folded wildcard ``pattern``, as
+    :mod:`predicates` builds it.
+
+    """
+    regex = ''.join('.*' if char == '*' else '.' if char == '?'
+                    else re.escape(char) for char in pattern)
+    return re.compile('(?:' + regex + r')\Z', re.UNICODE | re.DOTALL)
+
+
+if __name__ == '__main__':
+    pass
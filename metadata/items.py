@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Results of :func:`find`: items whose metadata is listed on first use,
+and pages of sorted results.
+
+Items come in windows of neighbouring results. The first time any item
+of a window is asked for an attribute, that attribute is listed for the
+whole window at once, so reading one attribute of every result takes a
+process per window instead of one per result.
+
+"""
+from __future__ import unicode_literals
+
+# results whose attributes are listed together
+PREFETCH_WINDOW = 500
+# marks an attribute that was listed, but that the file doesn't have
+_MISSING = object()
+
+
+class MDItem(object):
+    """A file found by :func:`find`, with its metadata listed lazily.
+
+    Get attributes by Pythonic key, Spotlight id or :class:`MDAttribute`,
+    as ``item['authors']`` or ``item.get('kMDItemAuthors')``, or as
+    properties, like ``item.logical_size``. An attribute the file doesn't
+    have raises :class:`KeyError` as an item, and is ``None`` as a
+    property.
+
+    :param path: full path to the file
+    :type path: ``unicode``
+    :param metadata: attributes already listed, by key
+    :type metadata: ``dict``
+    :param window: the window the item is listed with; by default the
+        item is listed on its own
+    :type window: :class:`_Window`
+
+    """
+
+    __slots__ = ('path', '_metadata', '_window')
+
+    def __init__(self, path, metadata=None, window=None):
+        self.path = path
+        self._metadata = metadata if metadata is not None else {}
+        if window is None:
+            window = _single_window()
+        window.items.append(self)
+        self._window = window
+
+    def __getitem__(self, attr):
+        key = getattr(attr, 'key', attr)
+        value = self._metadata.get(key)
+        if value is None:
+            key = self._window.key(attr)
+            if key not in self._metadata:
+                self._window.load(key, attr)
+            value = self._metadata.get(key)
+        if value is None or value is _MISSING:
+            raise KeyError(attr)
+        return value
+
+    def get(self, attr, default=None):
+        """Value of ``attr``, or ``default`` if the file doesn't have it.
+
+        """
+        try:
+            return self[attr]
+        except KeyError:
+            return default
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.get(name)
+
+    def __contains__(self, attr):
+        return self.get(attr, _MISSING) is not _MISSING
+
+    def __eq__(self, other):
+        return isinstance(other, MDItem) and other.path == self.path
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return 'MDItem({!r})'.format(self.path)
+
+
+class _Window(object):
+    """Neighbouring items, whose attributes are listed together.
+
+    :param list_many: lists attributes of many files, as :func:`list_many`
+    :type list_many: ``callable``
+    :param attr_keys: keys of attributes in listings, as
+        :meth:`Backend.attr_keys`
+    :type attr_keys: ``callable``
+
+    """
+
+    __slots__ = ('items', '_list_many', '_attr_keys')
+
+    def __init__(self, list_many, attr_keys):
+        self.items = []
+        self._list_many = list_many
+        self._attr_keys = attr_keys
+
+    def key(self, attr):
+        """Key of ``attr`` in listings.
+
+        """
+        return self._attr_keys([attr])[0]
+
+    def load(self, key, attr):
+        """List ``attr`` of the items that don't have it yet.
+
+        """
+        items = [item for item in self.items if key not in item._metadata]
+        listed = self._list_many([item.path for item in items],
+                                 attrs=[attr])
+        for item, (_, md_dict) in zip(items, listed):
+            item._metadata[key] = md_dict.get(key, _MISSING)
+
+
+class Page(list):
+    """Results of :func:`find` with ``order_by``, ``limit`` or ``offset``.
+
+    :param results: the results on this page
+    :type results: iterable
+    :param cursor: pass as ``after`` to :func:`find` for the next page;
+        ``None`` on the last page, or if the results aren't ordered
+    :type cursor: ``tuple``
+    :param total: number of files that match the query, if known
+    :type total: ``int``
+
+    """
+
+    def __init__(self, results=(), cursor=None, total=None):
+        list.__init__(self, results)
+        self.cursor = cursor
+        self.total = total
+
+
+## Helper Functions  ----------------------------------------------------------
+
+def _single_window():
+    """Window of an item made outside of :func:`iter_items`.
+
+    """
+    # imported here, as :mod:`functions` imports this module
+    from . import functions
+    return _Window(functions.list_many, functions._backend.attr_keys)
+
+
+def iter_items(results, list_many, attr_keys, fetch_keys=None,
+               window=None):
+    """Generate an :class:`MDItem` for each of ``results``, a window at a
+    time.
+
+    :param results: full paths to files or, with ``fetch_keys``,
+        ``(path, metadata)`` pairs
+    :type results: iterable
+    :param list_many: lists attributes of many files, as :func:`list_many`
+    :type list_many: ``callable``
+    :param attr_keys: keys of attributes in listings, as
+        :meth:`Backend.attr_keys`
+    :type attr_keys: ``callable``
+    :param fetch_keys: keys of attributes already fetched with each result
+    :type fetch_keys: ``list``
+    :param window: number of results whose attributes are listed
+        together; by default :data:`PREFETCH_WINDOW`
+    :type window: ``int``
+    :rtype: ``generator`` of :class:`MDItem` objects
+
+    """
+    window = window or PREFETCH_WINDOW
+    batch = _Window(list_many, attr_keys)
+    for result in results:
+        if fetch_keys is None:
+            item = MDItem(result, window=batch)
+        else:
+            path, md_dict = result
+            metadata = dict((key, md_dict.get(key, _MISSING))
+                            for key in fetch_keys)
+            item = MDItem(path, metadata, batch)
+        if len(batch.items) == window:
+            for item in batch.items:
+                yield item
+            batch = _Window(list_many, attr_keys)
+    for item in batch.items:
+        yield item
+
+
+if __name__ == '__main__':
+    pass
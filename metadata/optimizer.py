@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Rewrite query expressions into shorter, equivalent ones before they are
+rendered for `mdfind`.
+
+"""
+from __future__ import unicode_literals
+
+from . import utils
+from .classes import MDComparison, MDExpression
+
+# marks an expression that no file can match
+_NOTHING = object()
+# marks a node that hasn't been optimized yet
+_UNSET = None
+
+
+def optimize(query):
+    """Simplify ``query``.
+
+    * nested ``&&`` and ``||`` chains are flattened into one expression,
+    * repeated units are dropped (``A && A`` is ``A``), and so are units
+      absorbed by a sibling (``A || (A && B)`` is ``A``),
+    * ``x >= a && x <= b`` is folded into ``InRange(x, a, b)`` for numbers
+      and absolute dates,
+    * contradictions (``x == a && x != a``, an empty ``InRange``) make
+      their ``&&`` match nothing, and are dropped from a ``||``.
+
+    The result is cached on the (immutable) ``query``.
+
+    :param query: file metadata query expression
+    :type query: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :returns: equivalent query, or ``None`` if no file can match
+    :rtype: :class:`MDExpression` object or :class:`MDComparison` object
+
+    """
+    if not isinstance(query, (MDComparison, MDExpression)):
+        # a query string is passed on as it is
+        return query
+    result = _simplify(query)
+    return None if result is _NOTHING else result
+
+
+def _simplify(query):
+    """:func:`optimize`, with :data:`_NOTHING` for an impossible query.
+
+    """
+    result = query._optimized
+    if result is _UNSET:
+        if isinstance(query, MDExpression):
+            result = _simplify_expression(query)
+        else:
+            result = _simplify_comparison(query)
+        object.__setattr__(query, '_optimized', result)
+    return result
+
+
+def _simplify_comparison(comparison):
+    if comparison.operator == 'InRange':
+        low, high = _bounds(comparison.attribute, comparison.predicate)
+        if low is not None and low > high:
+            return _NOTHING
+    return comparison
+
+
+def _simplify_expression(expression):
+    conjunction = expression.operator.strip() == '&&'
+    units = []
+    for unit in _chain(expression):
+        unit = _simplify(unit)
+        if unit is _NOTHING:
+            if conjunction:
+                return _NOTHING
+            continue
+        # flatten `a && (b && c)` into `a && b && c`
+        if isinstance(unit, MDExpression) and \
+                unit.operator == expression.operator:
+            units.extend(unit.units)
+        else:
+            units.append(unit)
+    units = _unique(units)
+    if conjunction:
+        if _contradicts(units):
+            return _NOTHING
+        units = _fold_ranges(units)
+        if any(_simplify(unit) is _NOTHING for unit in units):
+            return _NOTHING
+    units = _absorb(units, ' || ' if conjunction else ' && ')
+    if not units:
+        return _NOTHING
+    if len(units) == 1:
+        return units[0]
+    return MDExpression(expression.operator, *units)
+
+
+def _chain(expression):
+    """Units of ``expression``, with nested expressions of the same
+    operator spliced in.
+
+    Queries built up one ``|`` at a time nest as deep as they are long,
+    so this works without recursion.
+
+    """
+    units = []
+    pending = list(reversed(expression.units))
+    while pending:
+        unit = pending.pop()
+        if isinstance(unit, MDExpression) and \
+                unit.operator == expression.operator:
+            pending.extend(reversed(unit.units))
+        else:
+            units.append(unit)
+    return units
+
+
+def _unique(units):
+    """``units`` without repeats, in order.
+
+    """
+    seen = set()
+    unique = []
+    for unit in units:
+        if unit not in seen:
+            seen.add(unit)
+            unique.append(unit)
+    return unique
+
+
+def _contradicts(units):
+    """Whether ``units`` hold both ``x == a`` and ``x != a``, with the
+    same modifiers.
+
+    """
+    # structure of a comparison is (id, operator, predicate, modifiers...)
+    structures = [unit._key[1] for unit in units
+                  if isinstance(unit, MDComparison)]
+    equal = set(structure for structure in structures
+                if structure[1] == '==')
+    return any(structure[:1] + ('==',) + structure[2:] in equal
+               for structure in structures if structure[1] == '!=')
+
+
+def _fold_ranges(units):
+    """Replace ``x >= a`` and ``x <= b`` in ``units`` with
+    ``InRange(x, a, b)``, where each bound appears once.
+
+    """
+    bounds = {}
+    for unit in units:
+        if isinstance(unit, MDComparison) and unit.operator in ('>=', '<='):
+            bounds.setdefault(unit.attribute.id, []).append(unit)
+    folded = {}
+    for pair in bounds.values():
+        if len(pair) != 2 or pair[0].operator == pair[1].operator:
+            continue
+        low, high = sorted(pair, key=lambda unit: unit.operator != '>=')
+        if _bounds(low.attribute, (low.predicate, high.predicate))[0] is None:
+            continue
+        in_range = low._with('InRange', (low.predicate, high.predicate))
+        folded[pair[0]] = in_range
+        folded[pair[1]] = None
+    return [folded.get(unit, unit) for unit in units
+            if folded.get(unit, unit) is not None]
+
+
+def _absorb(units, inner):
+    """Drop the expressions in ``units`` joined by ``inner`` that contain
+    one of the other units, as in ``A && (A || B)``.
+
+    """
+    plain = set(units)
+    return [unit for unit in units
+            if not (isinstance(unit, MDExpression) and
+                    unit.operator == inner and
+                    any(part in plain for part in unit.units))]
+
+
+def _bounds(attribute, values):
+    """``values`` as comparable numbers, or ``(None, None)`` if they
+    aren't numbers or absolute dates.
+
+    """
+    if 'date' in attribute.key:
+        if any(utils.is_relative_date(value) for value in values):
+            return None, None
+        try:
+            return tuple(utils.parse_date(value) for value in values)
+        except Exception:
+            return None, None
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+           for value in values):
+        return tuple(values)
+    return None, None
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Split queries with large ``||`` fan-outs into several smaller queries.
+
+A query such as "the name is any of these 20,000 names" is too long for
+one command line, and one `mdfind` process works through it slowly.
+:func:`split` cuts the fan-out into chunks whose query strings fit in a
+byte budget; the union of their results is the result of the query, so
+they can be run side by side.
+
+"""
+from __future__ import unicode_literals
+
+from . import utils
+from .classes import MDExpression
+
+# default maximum size of a query string, in bytes
+QUERY_BUDGET = 32768
+
+_OR = ' || '
+_AND = ' && '
+
+
+def split(query, budget=None):
+    """Split ``query`` into queries under ``budget`` bytes each, whose
+    results together are those of ``query``.
+
+    An ``||`` expression is split into chunks of its units. An ``&&``
+    expression is split along its largest ``||`` unit, with the other
+    units added to each chunk (``A && (B || C)`` is
+    ``(A && B) || (A && C)``). Any other query, or one that already fits,
+    is returned as it is; so is a unit that doesn't fit on its own.
+
+    :param query: optimized file metadata query expression
+    :type query: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :param budget: maximum size of each query string, in bytes; by
+        default :data:`QUERY_BUDGET` or what fits on a command line,
+        whichever is smaller
+    :type budget: ``int``
+    :returns: queries, in the order of the units of ``query``
+    :rtype: ``list``
+
+    """
+    if budget is None:
+        budget = min(QUERY_BUDGET, utils.arg_max())
+    if not isinstance(query, MDExpression) or _size(query) <= budget:
+        return [query]
+    if query.operator == _OR:
+        return _chunk(query.units, budget)
+    if query.operator == _AND:
+        fan_outs = [unit for unit in query.units
+                    if isinstance(unit, MDExpression) and
+                    unit.operator == _OR]
+        if fan_outs:
+            fan_out = max(fan_outs, key=_size)
+            rest = [unit for unit in query.units if unit is not fan_out]
+            # each chunk is wrapped in parentheses
+            used = sum(_size(unit) + 2 + len(_AND) for unit in rest) + 2
+            return [MDExpression(_AND, *(rest + [chunk]))
+                    for chunk in _chunk(fan_out.units, budget - used)]
+    return [query]
+
+
+def _chunk(units, budget):
+    """``units`` joined by ``||`` into queries of up to ``budget`` bytes.
+
+    """
+    chunks, chunk, used = [], [], 0
+    for unit in units:
+        # nested expressions are wrapped in parentheses
+        size = _size(unit) + len(_OR) + \
+            (2 if isinstance(unit, MDExpression) else 0)
+        if chunk and used + size > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(unit)
+        used += size
+    if chunk:
+        chunks.append(chunk)
+    return [chunk[0] if len(chunk) == 1 else MDExpression(_OR, *chunk)
+            for chunk in chunks]
+
+
+def _size(query):
+    """Bytes the query string of ``query`` takes up.
+
+    """
+    return len(utils.text_type(query).encode('utf-8'))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Evaluate query expressions in-process, against dictionaries returned by
+:func:`list`, instead of sending them to `mdfind`.
+
+"""
+from __future__ import unicode_literals
+
+import re
+import operator
+import unicodedata
+
+from . import utils
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+
+def compile_query(query):
+    """Compile ``query`` into a predicate over metadata dictionaries.
+
+    The semantics follow Spotlight's: string comparisons support the ``*``
+    and ``?`` wildcards and the comparison's ``ignore_case`` and
+    ``ignore_diacritics`` modifiers, comparisons against list values match
+    if any item matches, and a missing attribute never matches.
+
+    :param query: file metadata query expression
+    :type query: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :returns: function taking a metadata ``dict`` and returning ``bool``
+    :rtype: ``callable``
+
+    """
+    units = getattr(query, 'units', None)
+    if units is None:
+        return _compile_comparison(query)
+    predicates = [unit.compile() for unit in units]
+    if query.operator.strip() == '&&':
+        return lambda md_dict: all(p(md_dict) for p in predicates)
+    return lambda md_dict: any(p(md_dict) for p in predicates)
+
+
+def _compile_comparison(comparison):
+    """Compile a single :class:`MDComparison`.
+
+    """
+    key = comparison.attribute.key
+    predicate = comparison.predicate
+    if comparison.operator == 'InRange':
+        low, high = predicate
+        if 'date' in key:
+            low, high = utils.parse_date(low), utils.parse_date(high)
+            convert = utils.value_timestamp
+        else:
+            convert = _number
+
+        def in_range(md_dict):
+            value = _convert(md_dict.get(key), convert)
+            if isinstance(value, list):
+                return any(low <= item <= high
+                           for item in value if item is not None)
+            return value is not None and low <= value <= high
+        return in_range
+    compare = OPERATORS[comparison.operator]
+    if 'date' in key:
+        expected = utils.parse_date(predicate)
+        convert = utils.value_timestamp
+    elif isinstance(predicate, (int, float)):
+        expected = predicate
+        convert = _number
+    else:
+        return _compile_string(key, comparison.operator, predicate,
+                               comparison.ignore_case,
+                               comparison.ignore_diacritics)
+
+    def compare_values(md_dict):
+        value = _convert(md_dict.get(key), convert)
+        if isinstance(value, list):
+            return any(compare(item, expected)
+                       for item in value if item is not None)
+        return value is not None and compare(value, expected)
+    return compare_values
+
+
+def _compile_string(key, op, pattern, ignore_case, ignore_diacritics):
+    """Compile a string comparison, with wildcards and modifiers.
+
+    """
+    if op not in ('==', '!='):
+        msg = 'Invalid operator for string comparison: `{}`'.format(op)
+        raise Exception(msg)
+    if ignore_diacritics:
+        pattern = _strip_diacritics(pattern)
+    regex = ''.join('.*' if char == '*' else '.' if char == '?'
+                    else re.escape(char)
+                    for char in pattern)
+    flags = re.UNICODE | re.DOTALL
+    if ignore_case:
+        flags |= re.IGNORECASE
+    match = re.compile('(?:' + regex + r')\Z', flags).match
+
+    def matches(value):
+        if not isinstance(value, utils.text_type):
+            value = utils.text_type(value)
+        if ignore_diacritics:
+            value = _strip_diacritics(value)
+        return match(value) is not None
+
+    def compare_strings(md_dict):
+        value = md_dict.get(key)
+        if value is None:
+            return False
+        if isinstance(value, list):
+            found = any(matches(item) for item in value if item is not None)
+        else:
+            found = matches(value)
+        return found if op == '==' else not found
+    return compare_strings
+
+
+# Helper functions  -----------------------------------------------------------
+
+def _convert(value, convert):
+    """Apply ``convert`` to ``value``, or to each item of a list ``value``.
+
+    """
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [convert(item) for item in value]
+    return convert(value)
+
+
+def _number(value):
+    """``value`` as a number, or ``None`` if it isn't numeric.
+
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _strip_diacritics(text):
+    """Remove combining marks from ``text``.
+
+    """
+    return ''.join(char for char in unicodedata.normalize('NFD', text)
+                   if not unicodedata.combining(char))
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import os
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from . import functions
+
+# marks the end of the work or result stream
+_DONE = object()
+
+
+def scan(root, workers=4, attrs=None, batch_size=200, progress=None,
+         on_error=None, cache=None):
+    """Generate metadata for every file under ``root``.
+
+    One thread walks the tree and queues batches of paths; ``workers``
+    threads each list a batch with a single `mdls` process. Both queues
+    are bounded, so the walk never runs far ahead of the listing, nor the
+    listing ahead of the caller. A file that can't be listed doesn't stop
+    the scan: it is passed to ``on_error`` and left out of the results.
+
+    If the caller stops iterating early, the remaining work is abandoned
+    once the batches in flight are done.
+
+    :param root: full path of directory tree to scan
+    :type root: ``unicode``
+    :param workers: number of concurrent `mdls` processes
+    :type workers: ``int``
+    :param attrs: only fetch these attributes, with `mdls -name`
+    :type attrs: ``list`` of :class:`MDAttribute` objects or Pythonic keys
+    :param batch_size: number of paths per `mdls` process
+    :type batch_size: ``int``
+    :param progress: called as ``progress(listed, found)`` after each
+        batch, with the numbers of files listed and found so far
+    :type progress: ``callable``
+    :param on_error: called as ``on_error(path, exception)`` for each
+        file that couldn't be listed
+    :type on_error: ``callable``
+    :param cache: reuse metadata of unchanged files from this cache
+    :type cache: :class:`MetadataCache`
+    :returns: ``(path, metadata)`` pairs, in order of completion
+    :rtype: ``generator`` of ``tuple``s
+
+    """
+    batches = queue.Queue(maxsize=workers * 2)
+    results = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    found = [0]
+
+    def put(target, item):
+        """Put ``item`` on ``target``, giving up if the scan is stopped.
+
+        """
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(source):
+        """Get an item from ``source``, or `_DONE` if the scan is stopped.
+
+        """
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _DONE
+
+    def walk():
+        try:
+            batch = []
+            for dirpath, dirnames, filenames in os.walk(root):
+                for filename in filenames:
+                    batch.append(os.path.join(dirpath, filename))
+                    if len(batch) >= batch_size:
+                        found[0] += len(batch)
+                        if not put(batches, batch):
+                            return
+                        batch = []
+            if batch:
+                found[0] += len(batch)
+                put(batches, batch)
+        finally:
+            for _ in range(workers):
+                put(batches, _DONE)
+
+    def work():
+        try:
+            while True:
+                batch = get(batches)
+                if batch is _DONE:
+                    break
+                if not put(results, _list_batch(batch, attrs, on_error, cache)):
+                    break
+        finally:
+            put(results, _DONE)
+
+    threads = [threading.Thread(target=walk)]
+    threads.extend(threading.Thread(target=work) for _ in range(workers))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        listed, running = 0, workers
+        while running:
+            batch_results = results.get()
+            if batch_results is _DONE:
+                running -= 1
+                continue
+            for pair in batch_results:
+                yield pair
+            listed += len(batch_results)
+            if progress is not None:
+                progress(listed, found[0])
+    finally:
+        stop.set()
+
+
+def _list_batch(batch, attrs, on_error, cache):
+    """List ``batch`` with one `mdls`, isolating failures to single files.
+
+    """
+    try:
+        return [pair for pair in functions.list_many(batch, len(batch),
+                                                     cache=cache,
+                                                     attrs=attrs)]
+    except Exception:
+        # retry one by one to find the files at fault
+        pairs = []
+        for path in batch:
+            try:
+                pairs.append((path, functions.list(path, cache=cache,
+                                                   attrs=attrs)))
+            except Exception as err:
+                if on_error is not None:
+                    on_error(path, err)
+        return pairs
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Read and write tags as extended attributes, with system calls instead
+of the `xattr` command.
+
+Tags are stored as a property list in the ``com.apple.metadata:`` extended
+attribute that :func:`write` also uses. On Linux, where unprivileged
+processes may only use the ``user.`` namespace, that prefix is added.
+
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+import errno
+import plistlib
+
+from . import utils
+
+XATTR_PREFIX = 'com.apple.metadata:'
+# "attribute not found" is `ENOATTR` on OS X and `ENODATA` on Linux
+_NO_ATTR = set(getattr(errno, name) for name in ('ENOATTR', 'ENODATA')
+               if hasattr(errno, name))
+
+
+def read_tags(file_paths, attr_name='kMDItemUserTags'):
+    """Read the tags of many files, one `getxattr` call per file.
+
+    :param file_paths: full paths to files
+    :type file_paths: iterable of ``unicode``
+    :param attr_name: full name of OS X file metadata attribute
+    :type attr_name: ``unicode``
+    :returns: ``(file_path, tags)`` pairs, in the order of
+        ``file_paths``; ``tags`` is an empty ``list`` if a file has none
+    :rtype: ``list`` of ``tuple``s
+    :raises OSError: if a file doesn't exist or can't be read
+
+    """
+    name = xattr_name(attr_name)
+    return [(file_path, _read(file_path, name)) for file_path in file_paths]
+
+
+def write_tags(file_paths, tag_list, attr_name='kMDItemUserTags'):
+    """Set the tags of many files to ``tag_list``.
+
+    Each file's tags are read first, and files that already have exactly
+    these tags aren't written. That saves a write per file, and leaves
+    their status change times (``ctime``) alone, so Spotlight and other
+    indexers see no change to re-import.
+
+    :param file_paths: full paths to files
+    :type file_paths: iterable of ``unicode``
+    :param tag_list: values to write to attributes
+    :type tag_list: ``list``
+    :param attr_name: full name of OS X file metadata attribute
+    :type attr_name: ``unicode``
+    :returns: paths of the files that were written
+    :rtype: ``list``
+    :raises OSError: if a file doesn't exist or can't be written
+
+    """
+    name = xattr_name(attr_name)
+    tag_list = [utils.decode(tag) for tag in tag_list]
+    data = _dump_plist(tag_list)
+    written = []
+    for file_path in file_paths:
+        current = _read_raw(file_path, name)
+        # most unchanged files hold the very bytes we'd write
+        if current == data or _parse(current) == tag_list:
+            continue
+        _setxattr(file_path, name, data)
+        written.append(file_path)
+    return written
+
+
+def xattr_name(attr_name):
+    """Extended attribute that holds ``attr_name`` on this platform.
+
+    :param attr_name: full name of OS X file metadata attribute
+    :type attr_name: ``unicode``
+    :returns: extended attribute name
+    :rtype: ``unicode``
+
+    """
+    name = XATTR_PREFIX + attr_name
+    if sys.platform.startswith('linux'):
+        name = 'user.' + name
+    return name
+
+
+def _read(file_path, name):
+    """Tags stored in extended attribute ``name`` of ``file_path``.
+
+    """
+    return _parse(_read_raw(file_path, name))
+
+
+def _read_raw(file_path, name):
+    """Extended attribute ``name`` of ``file_path``, or ``None``.
+
+    """
+    try:
+        return _getxattr(file_path, name)
+    except (IOError, OSError) as err:
+        if err.errno in _NO_ATTR:
+            return None
+        raise
+
+
+def _parse(data):
+    """Tags in property list ``data``, if any.
+
+    """
+    if data is None:
+        return []
+    return [utils.decode(tag) for tag in _load_plist(data)]
+
+
+## Property lists  ------------------------------------------------------------
+
+if hasattr(plistlib, 'dumps'):
+    def _dump_plist(value):
+        return plistlib.dumps(value, fmt=plistlib.FMT_BINARY)
+
+    _load_plist = plistlib.loads
+else:
+    # Python 2's `plistlib` only knows XML property lists, which OS X
+    # reads just as well
+    _dump_plist = plistlib.writePlistToString
+    _load_plist = plistlib.readPlistFromString
+
+
+## System calls  --------------------------------------------------------------
+
+def _fs_encode(path):
+    if isinstance(path, utils.text_type):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+if hasattr(os, 'getxattr'):
+    # Linux, Python 3.3+
+    def _getxattr(file_path, name):
+        return os.getxattr(file_path, name)
+
+    def _setxattr(file_path, name, data):
+        os.setxattr(file_path, name, data)
+else:
+    import ctypes
+    import ctypes.util
+
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.getxattr.restype = ctypes.c_ssize_t
+    # OS X adds `position` and `options` arguments to both calls, and
+    # Linux a `flags` argument to `setxattr`
+    if sys.platform == 'darwin':
+        _GET_ARGS = _SET_ARGS = (0, 0)
+    else:
+        _GET_ARGS, _SET_ARGS = (), (0,)
+
+    def _check(result, file_path):
+        if result < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), file_path)
+        return result
+
+    def _getxattr(file_path, name):
+        path, name = _fs_encode(file_path), name.encode('utf-8')
+        while True:
+            size = _check(_libc.getxattr(path, name, None, 0,
+                                         *_GET_ARGS), file_path)
+            buf = ctypes.create_string_buffer(size)
+            try:
+                size = _check(_libc.getxattr(path, name, buf, size,
+                                             *_GET_ARGS), file_path)
+            except OSError as err:
+                # value grew between the two calls
+                if err.errno == errno.ERANGE:
+                    continue
+                raise
+            return buf.raw[:size]
+
+    def _setxattr(file_path, name, data):
+        _check(_libc.setxattr(_fs_encode(file_path), name.encode('utf-8'),
+                              data, len(data), *_SET_ARGS), file_path)
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,509 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""Keep indexes and caches up to date as files change.
+
+An :class:`Updater` watches directory trees, with inotify on Linux and by
+comparing snapshots of ``(inode, mtime, size)`` elsewhere, and passes the
+paths that changed, in batches, to the indexes and caches registered for
+each tree. Bursts of events for the same files are coalesced, so a file
+written in many small pieces is listed once.
+
+"""
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+import stat as stat_module
+from collections import OrderedDict
+
+from . import utils
+from . import backends
+from .cache import file_stamp
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_ONLYDIR | IN_DONT_FOLLOW)
+_EVENT = struct.Struct(str('iIII'))
+_READ_SIZE = 64 * 1024
+
+
+class Updater(object):
+    """Apply changes to the files under registered roots to the indexes
+    and caches of those roots.
+
+    A target is anything with ``stamps(root)``, which gives the
+    ``(inode, mtime, size)`` of the files it knows under ``root``, and
+    ``refresh(changed, removed)``, which brings those files up to date,
+    as :class:`Index` and :class:`MetadataCache`; targets with a
+    ``save()`` method are saved every ``save_interval`` seconds and on
+    :meth:`close`.
+
+    Changes are applied once no event has arrived for ``delay`` seconds,
+    ``max_delay`` seconds after the first pending event, or when
+    ``batch_size`` paths are pending. Call :meth:`start` to apply them
+    from a background thread, or :meth:`poll` to do it in the calling
+    thread. A batch that a target fails to apply is counted in ``errors``
+    and passed to ``on_error``, and the updater carries on with the next.
+
+    :param delay: seconds of quiet before pending changes are applied
+    :type delay: ``float``
+    :param max_delay: most seconds a change waits to be applied
+    :type max_delay: ``float``
+    :param batch_size: most paths listed in one call to a target
+    :type batch_size: ``int``
+    :param poll_interval: seconds between snapshots of the roots that
+        inotify doesn't watch
+    :type poll_interval: ``float``
+    :param save_interval: seconds between saves of the targets
+    :type save_interval: ``float``
+    :param inotify: whether to use inotify; by default, wherever it works
+    :type inotify: ``bool``
+    :param on_error: called with each exception raised while applying
+        changes
+    :type on_error: ``callable``
+
+    """
+
+    def __init__(self, delay=0.2, max_delay=2.0, batch_size=500,
+                 poll_interval=5.0, save_interval=300.0, inotify=None,
+                 on_error=None):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.save_interval = save_interval
+        self.on_error = on_error
+        # counters
+        self.events = 0
+        self.batches = 0
+        self.errors = 0
+        self.last_error = None
+        self.paths_updated = 0
+        self.paths_removed = 0
+        self.seconds = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._targets = []
+        # snapshots of the roots that are polled
+        self._snapshots = {}
+        self._polled = 0.0
+        self._saved = time.time()
+        # paths to check, and whether each is a new directory tree
+        self._pending = OrderedDict()
+        self._first = self._last = None
+        self._inotify = None
+        if inotify or (inotify is None and _Inotify.available()):
+            self._inotify = _Inotify()
+        self._thread = None
+        self._stop = threading.Event()
+        self._closed = False
+        # guards the roots and pending changes, shared with the thread
+        self._lock = threading.RLock()
+
+    def add(self, root, target):
+        """Keep ``target`` up to date with the files under ``root``.
+
+        Changes made while nothing was watching, as since ``target`` was
+        last saved, are found by comparing ``target.stamps(root)`` with
+        the files there now.
+
+        :param root: full path to a directory
+        :type root: ``unicode``
+        :param target: index or cache of the files under ``root``
+        :type target: :class:`Index` or :class:`MetadataCache` object
+
+        """
+        root = os.path.abspath(utils.decode_path(root))
+        with self._lock:
+            if self._inotify is None or not self._inotify.watch_tree(root):
+                self._snapshots[root] = None
+            current = _snapshot(root)
+            if root in self._snapshots:
+                self._snapshots[root] = current
+            self._targets.append((root, target))
+            self._queue(_diff(target.stamps(root), current))
+
+    @property
+    def roots(self):
+        """Directories being watched.
+
+        """
+        return sorted(set(root for root, _ in self._targets))
+
+    @property
+    def throughput(self):
+        """Paths applied per second spent applying them.
+
+        """
+        if not self.seconds:
+            return 0.0
+        return (self.paths_updated + self.paths_removed) / self.seconds
+
+    def start(self):
+        """Apply changes from a background thread until :meth:`close`.
+
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def poll(self, timeout=0.0):
+        """Wait up to ``timeout`` seconds for changes, and apply those
+        that are due.
+
+        :param timeout: most seconds to wait
+        :type timeout: ``float``
+
+        """
+        now = time.time()
+        with self._lock:
+            wait = min(timeout, max(0.0, self._due() - now))
+            if self._snapshots:
+                wait = min(wait, max(0.0, self._polled +
+                                     self.poll_interval - now))
+        # waits without the lock, so as not to hold up `add`
+        if self._inotify is not None:
+            self._inotify.wait(wait)
+        elif wait:
+            time.sleep(wait)
+        with self._lock:
+            if self._inotify is not None:
+                paths, overflowed = self._inotify.read(0)
+                if overflowed:
+                    # events were lost: compare everything
+                    paths = self._resync()
+                self._queue(paths)
+            if self._snapshots and \
+                    time.time() >= self._polled + self.poll_interval:
+                self._queue(self._poll_snapshots())
+            if time.time() >= self._due():
+                self.flush()
+
+    def flush(self):
+        """Apply all pending changes now.
+
+        """
+        with self._lock:
+            if not self._pending:
+                return
+            pending, first = self._pending, self._first
+            self._pending = OrderedDict()
+            self._first = self._last = None
+            start = time.time()
+            changed, removed = [], []
+            for path, tree in pending.items():
+                if file_stamp(backends._fs_path(path)) is None:
+                    removed.append(path)
+                    continue
+                changed.append(path)
+                if tree:
+                    # a directory moved or copied in: everything in it
+                    # is new
+                    changed.extend(_snapshot(path))
+            for root, target in self._targets:
+                scope = os.path.join(root, '')
+                mine = [path for path in changed if path.startswith(scope)]
+                gone = [path for path in removed if path.startswith(scope)]
+                for begin in range(0, len(mine), self.batch_size):
+                    self._refresh(target,
+                                  mine[begin:begin + self.batch_size], ())
+                if gone:
+                    self._refresh(target, (), gone)
+            done = time.time()
+            self.paths_updated += len(changed)
+            self.paths_removed += len(removed)
+            self.seconds += done - start
+            self.lag = done - first
+            self.max_lag = max(self.max_lag, self.lag)
+            if done - self._saved >= self.save_interval:
+                self.save()
+
+    def save(self):
+        """Save the targets that can be saved.
+
+        """
+        with self._lock:
+            self._saved = time.time()
+            for _, target in self._targets:
+                if hasattr(target, 'save'):
+                    target.save()
+
+    def close(self):
+        """Stop watching, apply pending changes and save the targets.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._inotify is not None:
+                self._queue(self._inotify.read(0)[0])
+                self._inotify.close()
+        self.flush()
+        self.save()
+
+    @property
+    def closed(self):
+        """Whether the updater has been closed.
+
+        """
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Helper methods  ---------------------------------------------------------
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll(0.5)
+            except Exception as error:
+                # a failed poll or save must not stop the updates
+                self._failed(error)
+                self._stop.wait(0.5)
+
+    def _refresh(self, target, changed, removed):
+        """Apply one batch of changes to ``target``.
+
+        """
+        try:
+            target.refresh(changed, removed)
+        except Exception as error:
+            # as of a file listed or removed mid-batch, or a command
+            # that failed
+            self._failed(error)
+        else:
+            self.batches += 1
+
+    def _failed(self, error):
+        self.errors += 1
+        self.last_error = error
+        if self.on_error is not None:
+            self.on_error(error)
+
+    def _queue(self, paths):
+        """Add ``(path, tree)`` pairs to the pending changes.
+
+        """
+        now = time.time()
+        for path, tree in paths:
+            self.events += 1
+            self._pending[path] = self._pending.get(path) or tree
+            if self._first is None:
+                self._first = now
+            self._last = now
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def _due(self):
+        """When the pending changes are to be applied.
+
+        """
+        if self._first is None:
+            return float('inf')
+        return min(self._last + self.delay, self._first + self.max_delay)
+
+    def _poll_snapshots(self):
+        self._polled = time.time()
+        paths = []
+        for root, previous in sorted(self._snapshots.items()):
+            current = _snapshot(root)
+            paths.extend(_diff(previous, current))
+            self._snapshots[root] = current
+        return paths
+
+    def _resync(self):
+        paths = []
+        for root, target in self._targets:
+            if self._inotify is not None and root not in self._snapshots:
+                self._inotify.watch_tree(root)
+            paths.extend(_diff(target.stamps(root), _snapshot(root)))
+        return paths
+
+
+class _Inotify(object):
+    """Watches on every directory of some trees, read from one inotify
+    file descriptor.
+
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self._get_errno = ctypes.get_errno
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            self._raise()
+        # directory of each watch descriptor
+        self._dirs = {}
+
+    @staticmethod
+    def available():
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            _Inotify().close()
+        except (AttributeError, OSError):
+            return False
+        return True
+
+    def watch_tree(self, root):
+        """Watch ``root`` and every directory under it.
+
+        :returns: whether all of them are watched; there is a limit to
+            the number of watches per user
+        :rtype: ``bool``
+
+        """
+        directories = [root]
+        directories.extend(utils.decode_path(path)
+                           for path, stat in backends._walk(root)
+                           if stat_module.S_ISDIR(stat.st_mode))
+        for path in directories:
+            try:
+                self._watch(path)
+            except OSError as error:
+                if error.errno in (errno.ENOSPC, errno.ENOMEM):
+                    return False
+                # removed since the walk
+                if error.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+        return True
+
+    def wait(self, timeout):
+        """Wait up to ``timeout`` seconds for events to read.
+
+        :returns: whether there are events
+        :rtype: ``bool``
+
+        """
+        return bool(select.select([self._fd], [], [], timeout)[0])
+
+    def read(self, timeout):
+        """Wait up to ``timeout`` seconds for events.
+
+        :returns: ``(path, tree)`` pairs of changed files, where ``tree``
+            marks a new directory, and whether events were lost
+        :rtype: ``tuple``
+
+        """
+        paths, overflowed = [], False
+        if not self.wait(timeout):
+            return paths, overflowed
+        while True:
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflowed = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None or not name:
+                    # the directory's own events also reach its parent
+                    continue
+                path = os.path.join(directory, utils.decode_path(name))
+                tree = bool(mask & IN_ISDIR and
+                            mask & (IN_CREATE | IN_MOVED_TO))
+                if tree and not self.watch_tree(path):
+                    overflowed = True
+                paths.append((path, tree))
+        return paths, overflowed
+
+    def close(self):
+        os.close(self._fd)
+
+    def _watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, _bytes_path(path),
+                                          WATCH_MASK)
+        if wd < 0:
+            self._raise()
+        # a directory moved within a watched tree keeps its descriptor
+        self._dirs[wd] = path
+
+    def _raise(self):
+        number = self._get_errno()
+        raise OSError(number, os.strerror(number))
+
+
+## Helper Functions  ----------------------------------------------------------
+
+def _snapshot(root):
+    """``(inode, mtime, size)`` of the files and directories under
+    ``root``, by path.
+
+    :rtype: ``dict``
+
+    """
+    stamps = {}
+    for path, _ in backends._walk(root):
+        stamp = file_stamp(path)
+        if stamp is not None:
+            stamps[utils.decode_path(path)] = stamp
+    return stamps
+
+
+def _diff(old, new):
+    """``(path, tree)`` pairs of the paths that differ between two
+    snapshots.
+
+    """
+    paths = [(path, False) for path, stamp in new.items()
+             if old.get(path) != stamp]
+    paths.extend((path, False) for path in old if path not in new)
+    return paths
+
+
+def _bytes_path(path):
+    """``path`` as C functions take it.
+
+    """
+    if utils.PY3:
+        return os.fsencode(path)
+    return backends._fs_path(path)
+
+
+if __name__ == '__main__':
+    pass
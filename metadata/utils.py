@@ -4,44 +4,381 @@ from __future__ import unicode_literals
 
 import unicodedata
 import subprocess
+import calendar
+import time
 import os
 import re
+import sys
+import threading
+from datetime import datetime
+
+PY3 = sys.version_info[0] >= 3
+if PY3:
+    text_type = str
+    unichr = chr
+else:
+    text_type = unicode
+    unichr = unichr
+
+CAMEL_RE = re.compile(r'((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))')
+# Cocoa's `\UXXXX` escape of a UTF-16 code unit, once all backslashes
+# have been doubled
+COCOA_ESCAPE_RE = re.compile(r'\\\\U([0-9a-fA-F]{4})')
+_clean_keys = {}
 
 
 ## Subprocess wrapper  --------------------------------------------------------
 
-def run_process(cmd, stdin=None):
-    """Run ``cmd`` in shell
+class ProcessTimeout(Exception):
+    """A command ran longer than its timeout, and was killed.
+
+    :param cmd: command that was run
+    :type cmd: ``list``
+    :param timeout: seconds the command was allowed
+    :type timeout: ``float``
+
+    """
+
+    def __init__(self, cmd, timeout):
+        self.cmd = cmd
+        self.timeout = timeout
+        msg = 'Command {!r} timed out after {} seconds'.format(
+            ' '.join(decode(arg) for arg in cmd), timeout)
+        super(ProcessTimeout, self).__init__(msg)
+
+
+class Executor(object):
+    """Runs commands as child processes, without a shell.
+
+    Every command gets its own copy of the environment with ``LANG`` set
+    to UTF-8, so ``os.environ`` is never changed and commands may be run
+    from many threads at once. To run commands some other way (remotely,
+    say, or recording them), subclass this and pass an instance to
+    :func:`set_executor`.
+
+    """
+
+    def popen(self, cmd, stdin=False):
+        """Start ``cmd``, with its standard output on a pipe.
+
+        :param cmd: command to be run
+        :type cmd: ``list``
+        :param stdin: whether to open a pipe to its standard input too
+        :type stdin: ``bool``
+        :returns: the running process; standard error is discarded
+        :rtype: :class:`subprocess.Popen`
+
+        """
+        with open(os.devnull, 'wb') as devnull:
+            return subprocess.Popen(argv(cmd),
+                                    stdin=subprocess.PIPE if stdin else None,
+                                    stdout=subprocess.PIPE,
+                                    stderr=devnull,
+                                    env=process_env())
+
+    def run(self, cmd, stdin=None, timeout=None):
+        """Run ``cmd`` to completion and return its raw output.
+
+        :param cmd: command to be run
+        :type cmd: ``list``
+        :param stdin: input data for command
+        :type stdin: ``bytes``
+        :param timeout: seconds to wait for the command to finish
+        :type timeout: ``float``
+        :returns: standard output of command
+        :rtype: ``bytes``
+        :raises ProcessTimeout: if ``timeout`` passed first; the command
+            has been killed
+
+        """
+        proc = self.popen(cmd, stdin=stdin is not None)
+        expired = []
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, _expire, (proc, expired))
+            timer.start()
+        try:
+            stdout, _ = proc.communicate(stdin)
+        except BaseException:
+            # interrupted: don't leave the child running
+            _expire(proc, [])
+            proc.wait()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if expired:
+            raise ProcessTimeout(cmd, timeout)
+        return stdout
+
+
+def _expire(proc, expired):
+    """Kill ``proc`` if it's still running, and note that in ``expired``.
+
+    """
+    if proc.poll() is None:
+        expired.append(True)
+        try:
+            proc.kill()
+        except OSError:
+            # finished just now
+            pass
+
+
+_executor = Executor()
+
+
+def get_executor():
+    """Executor that runs the metadata commands.
+
+    :rtype: :class:`Executor`
+
+    """
+    return _executor
+
+
+def set_executor(executor):
+    """Run the metadata commands with ``executor`` from now on.
+
+    :param executor: object with the methods of :class:`Executor`, or
+        ``None`` for the default one
+    :type executor: :class:`Executor`
+    :returns: the executor used until now
+    :rtype: :class:`Executor`
+
+    """
+    global _executor
+    previous = _executor
+    _executor = executor if executor is not None else Executor()
+    return previous
 
-    :param cmd: shell command to be run
-    :type cmd: ``unicode`` or ``list``
-    :param stdin: input data for shell command
+
+def process_env():
+    """Environment for a child process: this one, with UTF-8 output.
+
+    :rtype: ``dict``
+
+    """
+    env = dict(os.environ)
+    env[str('LANG')] = str('en_US.UTF-8')
+    return env
+
+
+def argv(cmd):
+    """``cmd`` as the byte strings `exec` takes.
+
+    :param cmd: command
+    :type cmd: ``list``
+    :rtype: ``list``
+
+    """
+    return [arg.encode('utf-8') if isinstance(arg, text_type) else arg
+            for arg in cmd]
+
+
+def run_process(cmd, stdin=None, timeout=None):
+    """Run ``cmd`` and return its output as lines of text.
+
+    :param cmd: command to be run
+    :type cmd: ``list``
+    :param stdin: input data for command
     :type stdin: ``unicode``
+    :param timeout: seconds to wait for the command to finish
+    :type timeout: ``float``
     :returns: normalized list of output
     :rtype: ``list``
+    :raises ProcessTimeout: if ``timeout`` passed first
 
     """
-    # is command shell string or list of args?
-    shell = True
-    if isinstance(cmd, list):
-        shell = False
-    # set shell lang to UTF8
-    os.environ['LANG'] = 'en_US.UTF-8'
-    # open pipes
-    proc = subprocess.Popen(cmd,
-                            shell=shell,
-                            stdin=subprocess.PIPE,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    # Run command, with optional input
     if stdin:
-        stdout, stderr = proc.communicate(input=decode(stdin).encode('utf-8'))
-    else:
-        stdout, stderr = proc.communicate()
-    # Convert newline delimited str into clean list
-    output = filter(None, [s.strip()
-                           for s in decode(stdout).split('\n')])
-    return output
+        stdin = decode(stdin).encode('utf-8')
+    return output_lines(read_process(cmd, stdin or None, timeout))
+
+
+def read_process(cmd, stdin=None, timeout=None):
+    """Run ``cmd`` and return its raw output.
+
+    :param cmd: command to be run
+    :type cmd: ``list``
+    :param stdin: input data for command
+    :type stdin: ``bytes``
+    :param timeout: seconds to wait for the command to finish
+    :type timeout: ``float``
+    :returns: standard output of command
+    :rtype: ``bytes``
+    :raises ProcessTimeout: if ``timeout`` passed first
+
+    """
+    return _executor.run(cmd, stdin, timeout)
+
+
+def output_lines(stdout):
+    """Convert newline delimited ``stdout`` into clean list
+
+    :param stdout: output of a command
+    :type stdout: ``bytes``
+    :returns: normalized, non-empty lines of output
+    :rtype: ``list``
+
+    """
+    return [line for line in (s.strip() for s in decode(stdout).split('\n'))
+            if line]
+
+
+def iter_process(cmd, delimiter=b'\0', buffer_size=65536, timeout=None):
+    """Run ``cmd`` and generate its output records as they arrive.
+
+    Output is read incrementally, so memory use doesn't grow with the size
+    of the output. The process is killed if the generator is closed (or
+    garbage collected) before the output is exhausted, or once
+    ``timeout`` has passed.
+
+    :param cmd: command to be run
+    :type cmd: ``list``
+    :param delimiter: separator of records in the output
+    :type delimiter: ``bytes``
+    :param buffer_size: maximum number of bytes per read
+    :type buffer_size: ``int``
+    :param timeout: seconds the command may run
+    :type timeout: ``float``
+    :returns: non-empty, normalized output records
+    :rtype: ``generator`` of ``unicode``
+    :raises ProcessTimeout: if ``timeout`` passed first
+
+    """
+    proc = _executor.popen(cmd)
+    expired = []
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _expire, (proc, expired))
+        timer.start()
+    try:
+        fd = proc.stdout.fileno()
+        pending = b''
+        while True:
+            data = os.read(fd, buffer_size)
+            if not data:
+                break
+            data = pending + data
+            # the last record may continue in the next read
+            end = data.rfind(delimiter) + 1
+            pending = data[end:]
+            for record in decode_records(data[:end], delimiter):
+                yield record
+        if expired:
+            # the output was cut short
+            raise ProcessTimeout(cmd, timeout)
+        if pending:
+            yield decode_path(pending)
+    finally:
+        if timer is not None:
+            timer.cancel()
+        if proc.poll() is None:
+            proc.kill()
+        proc.stdout.close()
+        proc.wait()
+
+
+def arg_max():
+    """Number of bytes available for a command line's arguments.
+
+    :returns: ``ARG_MAX`` less the size of the environment and a margin
+    :rtype: ``int``
+
+    """
+    try:
+        limit = os.sysconf(str('SC_ARG_MAX'))
+    except (ValueError, OSError, AttributeError):
+        limit = 262144
+    env_size = sum(len(k) + len(v) + 2 for k, v in os.environ.items())
+    # leave room for pointers and whatever the system adds itself
+    return limit - env_size - 4096
+
+
+def chunk_args(args, chunk_size, cmd=()):
+    """Split ``args`` into lists that fit on one command line with ``cmd``.
+
+    :param args: arguments to split
+    :type args: iterable of ``unicode``
+    :param chunk_size: maximum number of arguments per chunk
+    :type chunk_size: ``int``
+    :param cmd: arguments preceding each chunk on the command line
+    :type cmd: ``list``
+    :returns: chunks of ``args``, in order
+    :rtype: ``generator`` of ``list``s
+
+    """
+    budget = arg_max() - sum(_arg_size(arg) for arg in cmd)
+    chunk, used = [], 0
+    for arg in args:
+        size = _arg_size(arg)
+        if chunk and (len(chunk) >= chunk_size or used + size > budget):
+            yield chunk
+            chunk, used = [], 0
+        chunk.append(arg)
+        used += size
+    if chunk:
+        yield chunk
+
+
+def _arg_size(arg):
+    """Bytes ``arg`` takes up on a command line, pointer included.
+
+    """
+    if isinstance(arg, text_type):
+        arg = arg.encode('utf-8')
+    return len(arg) + 1 + 8
+
+
+def map_threads(func, items, max_workers=4):
+    """Call ``func`` on each of ``items``, in up to ``max_workers``
+    threads at once.
+
+    :param func: function of one argument
+    :type func: ``callable``
+    :param items: arguments for ``func``
+    :type items: iterable
+    :param max_workers: maximum number of threads
+    :type max_workers: ``int``
+    :returns: results of ``func``, in the order of ``items``
+    :rtype: ``list``
+    :raises: the first exception raised by ``func``, once the calls in
+        progress have finished; no further calls are started
+
+    """
+    items = [item for item in items]
+    if len(items) < 2 or max_workers < 2:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    lock = threading.Lock()
+    pending = enumerate(items)
+
+    def work():
+        while True:
+            with lock:
+                if errors:
+                    return
+                try:
+                    i, item = next(pending)
+                except StopIteration:
+                    return
+            try:
+                results[i] = func(item)
+            except Exception as err:
+                with lock:
+                    errors.append(err)
+                return
+
+    threads = [threading.Thread(target=work)
+               for _ in range(min(max_workers, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
 
 
 ## Text Encoding  ---------------------------------------------------------
@@ -49,6 +386,11 @@ def run_process(cmd, stdin=None):
 def decode(text, encoding='utf-8', normalization='NFC'):
     """Return ``text`` as normalised unicode.
 
+    Cocoa's ``\\UXXXX`` escapes are decoded. Pure ASCII text needs no
+    normalisation, and other text is only normalised if it isn't already
+    in ``normalization`` form, so decoding a whole buffer at once is
+    cheap.
+
     :param text: string
     :type text: encoded or Unicode string. If ``text`` is already a
         Unicode string, it will only be normalised.
@@ -61,15 +403,198 @@ def decode(text, encoding='utf-8', normalization='NFC'):
 
     """
     # convert string to Unicode
-    if isinstance(text, basestring):
-        if not isinstance(text, unicode):
-            text = unicode(text, encoding)
+    if isinstance(text, bytes):
+        text = text.decode(encoding)
+    # leave numbers and other non-strings alone
+    if not isinstance(text, text_type):
+        return text
     # decode Cocoa/CoreFoundation Unicode to Python Unicode
-    if re.search(r'\\U\d{3,}', text):
-        text = text.replace('\\U', '\\u').decode('unicode-escape')
+    if '\\U' in text:
+        text = _decode_cocoa(text)
+    if normalization is None or _is_ascii(text):
+        return text
+    # returns `text` itself, after a quick check, if it's normalised
     return unicodedata.normalize(normalization, text)
 
 
+def decode_path(path, encoding='utf-8'):
+    """Return a file system path as NFC-normalised unicode.
+
+    Unlike :func:`decode`, ``\\UXXXX`` is left alone: tools print paths
+    as they are, not Cocoa-escaped.
+
+    :param path: path to a file
+    :type path: encoded or Unicode string
+    :param encoding: The text encoding to use to decode ``path``.
+    :type encoding: ``unicode``
+    :returns: decoded and normalised ``unicode``
+
+    """
+    if isinstance(path, bytes):
+        path = path.decode(encoding)
+    if _is_ascii(path):
+        return path
+    return unicodedata.normalize('NFC', path)
+
+
+def decode_records(data, delimiter=b'\0', encoding='utf-8'):
+    """Split ``data`` into records and decode them as paths, all in
+    one pass.
+
+    :param data: output of a command
+    :type data: ``bytes``
+    :param delimiter: separator of records in ``data``
+    :type delimiter: ``bytes``
+    :param encoding: encoding of ``data``
+    :type encoding: ``unicode``
+    :returns: non-empty, normalized records
+    :rtype: ``list`` of ``unicode``
+
+    """
+    # normalisation can't join characters across a control character
+    text = decode_path(data, encoding)
+    return [record for record in text.split(delimiter.decode('ascii'))
+            if record]
+
+
+def _decode_cocoa(text):
+    """Decode the ``\\UXXXX`` escapes in ``text``, leaving any other
+    backslashes alone.
+
+    """
+    # once the other backslashes are escaped, Python's own codec can do it
+    escaped = text.replace('\\', '\\\\')
+    try:
+        decoded = escaped.replace('\\\\U', '\\u')\
+                         .encode('ascii', 'backslashreplace')\
+                         .decode('unicode-escape')
+    except UnicodeDecodeError:
+        # a `\U` that isn't an escape, like in `C:\Users`
+        decoded = COCOA_ESCAPE_RE.sub(r'\\u\1', escaped)\
+                                 .encode('ascii', 'backslashreplace')\
+                                 .decode('unicode-escape')
+    # characters outside the BMP are escaped as surrogate pairs
+    if ('\\Ud' in text or '\\UD' in text) and sys.maxunicode > 0xFFFF:
+        decoded = decoded.encode('utf-16-le', _SURROGATES)\
+                         .decode('utf-16-le', _SURROGATES)
+    return decoded
+
+
+# Python 3 won't encode surrogates without being told to
+_SURROGATES = str('surrogatepass') if PY3 else str('strict')
+
+
+if hasattr(text_type, 'isascii'):
+    # Python 3.7+
+    _is_ascii = text_type.isascii
+else:
+    def _is_ascii(text):
+        try:
+            text.encode('ascii')
+        except UnicodeError:
+            return False
+        return True
+
+
+## Dates  ---------------------------------------------------------------------
+
+def parse_date(value):
+    """Parse a human-readable date string (or a :class:`datetime`) into a
+    POSIX timestamp.
+
+    Strings are read in local time; a naive :class:`datetime` is read as
+    UTC, like the dates :func:`list` returns (see :func:`value_timestamp`).
+
+    :param value: date such as ``'3 days ago'`` or ``'2014-12-10'``
+    :type value: ``unicode`` or :class:`datetime`
+    :returns: seconds since the epoch
+    :rtype: ``float``
+
+    """
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    # `parsedatetime` is slow to import; only load it for date queries
+    import parsedatetime
+    cal = parsedatetime.Calendar()
+    struct_time = cal.parse(value)
+    if struct_time[1] == 0:
+        msg = 'Datetime string not parsed : `{}` '.format(value)
+        raise Exception(msg)
+    return time.mktime(struct_time[0])
+
+
+_relative_dates = {}
+
+
+def is_relative_date(value):
+    """Whether date string ``value`` means different dates at different
+    times (like ``'today'`` or ``'3 days ago'``).
+
+    :param value: date predicate
+    :type value: ``unicode`` or :class:`datetime`
+    :returns: ``True`` if ``value`` is relative to the current time
+    :rtype: ``bool``
+
+    """
+    if not isinstance(value, text_type):
+        return False
+    try:
+        return _relative_dates[value]
+    except KeyError:
+        pass
+    import parsedatetime
+    cal = parsedatetime.Calendar()
+    now = time.time()
+    # parse as of now and as of a little over a year ago
+    source_times = (time.localtime(now), time.localtime(now - 34387200))
+    parsed = [cal.parse(value, source_time)[0][:6]
+              for source_time in source_times]
+    relative = _relative_dates[value] = parsed[0] != parsed[1]
+    return relative
+
+
+def value_timestamp(value):
+    """POSIX timestamp of a date value listed by `mdls`.
+
+    :param value: ``'2014-12-10 17:05:10 +0000'``, or a naive UTC
+        :class:`datetime`
+    :type value: ``unicode`` or :class:`datetime`
+    :returns: seconds since the epoch, or ``None`` if ``value`` isn't a date
+    :rtype: ``float``
+
+    """
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    # slicing is much faster than `time.strptime` over many records
+    try:
+        if value[4] != '-' or value[13] != ':':
+            return None
+        timestamp = calendar.timegm((int(value[0:4]), int(value[5:7]),
+                                     int(value[8:10]), int(value[11:13]),
+                                     int(value[14:16]), int(value[17:19]),
+                                     0, 0, 0))
+    except (TypeError, ValueError, IndexError):
+        return None
+    # apply the `+hhmm` offset, if any
+    offset = value[19:].strip()
+    if len(offset) == 5 and offset[0] in '+-' and offset[1:].isdigit():
+        seconds = int(offset[1:3]) * 3600 + int(offset[3:]) * 60
+        timestamp -= seconds if offset[0] == '+' else -seconds
+    return timestamp
+
+
+## Python 2/3  ----------------------------------------------------------------
+
+def str_compatible(cls):
+    """Class decorator making ``str()`` return ``__unicode__()`` text on
+    Python 3, where :class:`str` is already Unicode.
+
+    """
+    if PY3:
+        cls.__str__ = cls.__unicode__
+    return cls
+
+
 ## Text Formatting  -------------------------------------------------------
 
 def convert_camel(camel_case):
@@ -80,8 +605,7 @@ def convert_camel(camel_case):
     :returns: string in under_score format
 
     """
-    camel_re = re.compile(r'((?<=[a-z0-9])[A-Z]|(?!^)[A-Z](?=[a-z]))')
-    under = camel_re.sub(r'_\1', decode(camel_case)).lower()
+    under = CAMEL_RE.sub(r'_\1', decode(camel_case)).lower()
     return under.replace('__', '_')
 
 
@@ -93,12 +617,17 @@ def clean_attribute(key):
     :returns: Pythonic attribute name
 
     """
+    try:
+        return _clean_keys[key]
+    except KeyError:
+        pass
     uid = key.replace('kMDItemFS', '')\
              .replace('kMDItem', '')\
              .replace('kMD', '')\
              .replace('com_', '')\
              .replace(' ', '')
-    return convert_camel(uid)
+    clean = _clean_keys[key] = convert_camel(uid)
+    return clean
 
 
 if __name__ == '__main__':
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# encoding: utf-8
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from . import utils
+from . import functions
+from . import optimizer
+
+ADDED = 'added'
+REMOVED = 'removed'
+
+
+def watch(query_expression, only_in=None, callback=None):
+    """Watch the results of a query with a single `mdfind -live` process.
+
+    Without ``callback``, iterate over the returned :class:`Watcher` to
+    get events. With ``callback``, events are delivered as
+    ``callback(kind, path)`` from a background thread. Either way, call
+    :meth:`Watcher.close` (or use the watcher as a context manager) to stop
+    watching.
+
+    :param query_expression: file metadata query expression
+    :type query_expression: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :param only_in: limit search scope to directory tree path
+    :type only_in: ``unicode``
+    :param callback: called with each event's kind and path
+    :type callback: ``callable``
+    :returns: running watcher
+    :rtype: :class:`Watcher`
+
+    """
+    watcher = Watcher(query_expression, only_in)
+    if callback is not None:
+        thread = threading.Thread(target=watcher.run, args=(callback,))
+        thread.daemon = True
+        # joined by `close`, so no callback runs after it returns
+        watcher._thread = thread
+        thread.start()
+    return watcher
+
+
+class Watcher(object):
+    """Stream of changes to the results of a live Spotlight query.
+
+    Iterating generates ``(kind, path)`` events, where ``kind`` is
+    :data:`ADDED` or :data:`REMOVED`. The initial results arrive as
+    :data:`ADDED` events. Later, `mdfind -live` only reports how many
+    results there are, so each such update is reconciled against a fresh
+    one-off query to find which paths came and went.
+
+    :param query_expression: file metadata query expression
+    :type query_expression: :class:`MDExpression` object or
+        :class:`MDComparison` object.
+    :param only_in: limit search scope to directory tree path
+    :type only_in: ``unicode``
+
+    """
+
+    def __init__(self, query_expression, only_in=None):
+        self.query_expression = query_expression
+        self.only_in = only_in
+        self.paths = set()
+        self._closed = False
+        self._thread = None
+        # paths end with a NUL, as they may hold newlines
+        cmd = ['mdfind', '-0', '-live']
+        if only_in:
+            cmd.extend(['-onlyin', only_in])
+        # a query nothing can match is left to `mdfind` as it is
+        cmd.append(utils.text_type(optimizer.optimize(query_expression) or
+                                   query_expression))
+        self._proc = utils.get_executor().popen(cmd)
+
+    def __iter__(self):
+        for record in self._records():
+            record = utils.decode_path(record)
+            if record.startswith('Query update:'):
+                for event in self._reconcile():
+                    yield event
+            elif record.startswith('/') and record not in self.paths:
+                self.paths.add(record)
+                yield ADDED, record
+        self.close()
+
+    def run(self, callback):
+        """Deliver every event to ``callback`` until closed.
+
+        :param callback: called with each event's kind and path
+        :type callback: ``callable``
+
+        """
+        for kind, path in self:
+            callback(kind, path)
+
+    def close(self):
+        """Stop the `mdfind` process and end iteration. With a callback,
+        wait for the events being delivered, so none is delivered after
+        this returns.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        # the reader gets to the end of the output of the killed process
+        if (self._thread is not None and
+                self._thread is not threading.current_thread()):
+            self._thread.join()
+        self._proc.stdout.close()
+
+    @property
+    def closed(self):
+        """Whether the watcher has been closed.
+
+        """
+        return self._closed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Helper methods  ---------------------------------------------------------
+
+    def _records(self):
+        """Generate raw output records of `mdfind` until it ends or is
+        closed: paths, which end with a NUL, and status lines, which end
+        with a newline.
+
+        """
+        fd = self._proc.stdout.fileno()
+        data, start = b'', 0
+        while not self._closed:
+            end = data.find(b'\0' if data.startswith(b'/', start) else b'\n',
+                            start)
+            if end == -1:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                data, start = data[start:] + chunk, 0
+                continue
+            yield data[start:end]
+            start = end + 1
+
+    def _reconcile(self):
+        """Diff the current results against the known paths.
+
+        :returns: events turning the known paths into the current results
+        :rtype: ``list`` of ``tuple``s
+
+        """
+        current = set(functions.iter_find(self.query_expression,
+                                          self.only_in))
+        events = [(REMOVED, path) for path in sorted(self.paths - current)]
+        events.extend((ADDED, path) for path in sorted(current - self.paths))
+        self.paths = current
+        return events
+
+
+if __name__ == '__main__':
+    pass
@@ -11,7 +11,16 @@ from __future__ import unicode_literals
 
 import os
 import sys
+import copy
+import errno
+import pickle
+import shutil
+import signal
+import tempfile
+import threading
+import time
 import unittest
+import datetime
 
 if __name__ == '__main__':
     # add path to module root to `$PATH`
@@ -19,8 +28,18 @@ if __name__ == '__main__':
     sys.path.insert(0, root)
 import metadata
 from metadata import functions as md
+from metadata import catalog, optimizer, planner, predicates, utils
 from metadata import MDAttribute, MDComparison, MDExpression
 
+try:
+    unicode
+except NameError:
+    unicode = str
+
+# stand-in Spotlight command line tools
+FAKE_BIN = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks', 'bin')
+
 
 def setUp():
     pass
@@ -30,6 +49,21 @@ def tearDown():
     pass
 
 
+class FakeToolsTestCase(unittest.TestCase):
+    """Runs each test with the stand-in tools first on the `PATH`, and
+    restores the environment afterwards.
+
+    """
+
+    def setUp(self):
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = FAKE_BIN + os.pathsep + os.environ['PATH']
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+
 class MDTests(unittest.TestCase):
 
     def setUp(self):
@@ -154,7 +188,1620 @@ class MDTests(unittest.TestCase):
     def test_list_blank(self):
         meta = md.list(self.blank_pdf)
         creation = meta['content_creation_date']
-        self.assertEqual(creation, '2014-12-10 17:05:10 +0000')
+        self.assertEqual(creation, datetime.datetime(2014, 12, 10, 17, 5, 10))
+
+
+class CatalogTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(CatalogTests, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        os.environ['METADATA_CACHE_DIR'] = self.cache_dir
+        catalog.reset()
+
+    def tearDown(self):
+        super(CatalogTests, self).tearDown()
+        shutil.rmtree(self.cache_dir)
+        catalog.reset()
+
+    def test_records(self):
+        records = catalog.records()
+        ids = [info['id'] for info in records]
+        self.assertIn('kMDItemFSName', ids)
+        authors = records[ids.index('kMDItemAuthors')]
+        self.assertEqual(authors['key'], 'authors')
+        self.assertEqual(authors['name'], 'Authors')
+        self.assertEqual(authors['aliases'], 'author')
+
+    def test_cache_written_and_reused(self):
+        records = catalog.records()
+        self.assertTrue(os.path.exists(catalog.cache_path()))
+        # without `mdimport` on `$PATH` only the cache can be used
+        catalog.reset()
+        os.environ['PATH'] = os.defpath
+        self.assertEqual(catalog.records(), records)
+
+    def test_stale_cache_rebuilt(self):
+        catalog.records()
+        with open(catalog.cache_path(), 'wb') as cache_file:
+            cache_file.write(b'{"version": 0, "records": []}')
+        catalog.reset()
+        self.assertTrue(catalog.records())
+
+    def test_get(self):
+        by_id = catalog.get('kMDItemFSName')
+        self.assertEqual(by_id['key'], 'name')
+        self.assertIs(catalog.get('name'), by_id)
+        self.assertIs(catalog.get('size'), catalog.get('kMDItemFSSize'))
+        self.assertIsNone(catalog.get('kMDItemNoSuchAttribute'))
+
+    def test_search(self):
+        keys = [info['key'] for info in catalog.search('date')]
+        self.assertIn('content_creation_date', keys)
+        self.assertIn('last_used_date', keys)
+        self.assertNotIn('authors', keys)
+        # exact word matches sort before prefix matches
+        keys = [info['key'] for info in catalog.search('pixel')]
+        self.assertEqual(keys[0], 'pixel_count')
+        keys = [info['key'] for info in catalog.search('PAGE')]
+        self.assertEqual(keys, ['page_height', 'page_width',
+                                'number_of_pages'])
+
+    def test_info_starts_no_process(self):
+        catalog.records()
+        os.environ['PATH'] = os.defpath
+        info = MDAttribute('kMDItemAuthors').info()
+        self.assertEqual(info['id'], 'kMDItemAuthors')
+        self.assertEqual(info['description'], 'Authors of this item')
+        self.assertIsNone(MDAttribute('kMDItemNoSuchAttribute').info())
+
+    def test_lazy_module_attributes(self):
+        attribute = metadata.content_type
+        self.assertIsInstance(attribute, MDAttribute)
+        self.assertIs(attribute, metadata.content_type)
+        self.assertEqual(unicode(attribute), 'kMDItemContentType')
+        self.assertIn('content_type', metadata.attributes)
+        with self.assertRaises(AttributeError):
+            metadata.no_such_attribute
+
+
+class QueryNodeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.size = MDAttribute('kMDItemLogicalSize')
+        self.name = MDAttribute('kMDItemFSName')
+
+    def test_interned(self):
+        self.assertIs(self.size > 10, self.size > 10)
+        exp = (self.name == 'a') & (self.size > 10)
+        self.assertIs(exp, (self.name == 'a') & (self.size > 10))
+        self.assertIsNot(self.size > 1, self.size > 1.0)
+        self.assertNotEqual(self.size > 1, self.size > 1.0)
+        self.assertNotEqual(exp, (self.size > 10) & (self.name == 'a'))
+
+    def test_hashable(self):
+        results = {(self.name == 'a') | (self.name == 'b'): ['/a']}
+        self.assertEqual(results[(self.name == 'a') | (self.name == 'b')],
+                         ['/a'])
+
+    def test_immutable(self):
+        comp = self.name == 'a'
+        self.assertRaises(AttributeError, setattr, comp, 'predicate', 'b')
+        self.assertRaises(AttributeError, setattr, comp, 'extra', 1)
+
+    def test_modifiers_captured(self):
+        comp = self.name == 'a'
+        self.name.ignore_case = False
+        self.assertEqual(unicode(comp), 'kMDItemFSName == "a"cd')
+        self.assertEqual(unicode(self.name == 'a'), 'kMDItemFSName == "a"d')
+        self.assertNotEqual(comp, self.name == 'a')
+
+    def test_copies_keep_modifiers(self):
+        comp = self.name == 'a'
+        self.name.ignore_case = False
+        for copied in (copy.copy(comp), copy.deepcopy(comp),
+                       pickle.loads(pickle.dumps(comp, 2))):
+            self.assertEqual(copied, comp)
+            self.assertEqual(unicode(copied), 'kMDItemFSName == "a"cd')
+
+    def test_rendering_memoized(self):
+        exp = (self.name == 'a') & (self.size > 10)
+        self.assertIs(unicode(exp), unicode(exp))
+        # relative dates are rendered afresh every time
+        created = MDAttribute('kMDItemContentCreationDate')
+        self.assertIsNot(unicode(created > 'today'),
+                         unicode(created > 'today'))
+
+
+class OptimizerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.size = MDAttribute('kMDItemLogicalSize')
+        self.name = MDAttribute('kMDItemFSName')
+        self.a = self.name == 'a'
+        self.b = self.name == 'b'
+        self.environ = dict(os.environ)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def assertOptimized(self, query, before, after):
+        self.assertEqual(unicode(query), before)
+        self.assertEqual(unicode(metadata.optimize(query)), after)
+
+    def test_flatten(self):
+        self.assertOptimized(
+            self.a & (self.b & (self.size > 10)),
+            'kMDItemFSName == "a"cd && '
+            '(kMDItemFSName == "b"cd && kMDItemLogicalSize > 10)',
+            'kMDItemFSName == "a"cd && kMDItemFSName == "b"cd && '
+            'kMDItemLogicalSize > 10')
+
+    def test_duplicates(self):
+        self.assertOptimized(
+            (self.a | self.b) | self.a,
+            '(kMDItemFSName == "a"cd || kMDItemFSName == "b"cd) || '
+            'kMDItemFSName == "a"cd',
+            'kMDItemFSName == "a"cd || kMDItemFSName == "b"cd')
+
+    def test_absorb(self):
+        self.assertOptimized(
+            self.a | (self.a & self.b),
+            'kMDItemFSName == "a"cd || '
+            '(kMDItemFSName == "a"cd && kMDItemFSName == "b"cd)',
+            'kMDItemFSName == "a"cd')
+
+    def test_in_range(self):
+        self.assertOptimized(
+            (self.size >= 10) & (self.size <= 20) & self.a,
+            '(kMDItemLogicalSize >= 10 && kMDItemLogicalSize <= 20) && '
+            'kMDItemFSName == "a"cd',
+            'InRange(kMDItemLogicalSize, 10, 20) && kMDItemFSName == "a"cd')
+        # relative dates are left alone
+        created = MDAttribute('kMDItemContentCreationDate')
+        query = (created >= 'today') & (created <= 'tomorrow')
+        self.assertIs(metadata.optimize(query), query)
+
+    def test_contradiction(self):
+        self.assertIsNone(metadata.optimize(self.a & (self.name != 'a')))
+        self.assertIsNone(metadata.optimize((self.size >= 30) &
+                                            (self.size <= 20)))
+        self.assertOptimized(
+            (self.a & (self.name != 'a')) | self.b,
+            '(kMDItemFSName == "a"cd && kMDItemFSName != "a"cd) || '
+            'kMDItemFSName == "b"cd',
+            'kMDItemFSName == "b"cd')
+
+    def test_find_nothing(self):
+        # `mdfind` mustn't even be run
+        os.environ['PATH'] = ''
+        self.assertEqual(metadata.find(self.a & (self.name != 'a')), [])
+        self.assertEqual(list(metadata.iter_find(self.a &
+                                                 (self.name != 'a'))), [])
+
+    def test_or_expression(self):
+        self.assertEqual(unicode((self.size > 10) | (self.a & self.b)),
+                         'kMDItemLogicalSize > 10 || '
+                         '(kMDItemFSName == "a"cd && kMDItemFSName == "b"cd)')
+
+
+class ListManyTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(ListManyTests, self).setUp()
+        pdf_dir = os.path.dirname(os.path.abspath(__file__))
+        self.pdfs = [os.path.join(pdf_dir, name)
+                     for name in ('blank.pdf', 'lorem_essay.pdf',
+                                  'lorem_visual.pdf')]
+
+    def test_list_many(self):
+        results = [pair for pair in md.list_many(self.pdfs, chunk_size=2)]
+        self.assertEqual([path for path, _ in results], self.pdfs)
+        for path, meta in results:
+            self.assertEqual(meta['name'], os.path.basename(path))
+            self.assertEqual(meta['logical_size'], os.path.getsize(path))
+            self.assertEqual(meta, md.list(path))
+
+    def test_list_many_missing_path(self):
+        paths = [self.pdfs[0], '/no/such/file.pdf', self.pdfs[1]]
+        results = dict(md.list_many(paths))
+        self.assertEqual(results['/no/such/file.pdf'], {})
+        self.assertEqual(results[self.pdfs[1]]['name'], 'lorem_essay.pdf')
+
+    def test_attrs(self):
+        attrs = [metadata.logical_size, 'content_type',
+                 MDAttribute('kMDItemFSNodeCount')]
+        meta = md.list(self.pdfs[0], attrs=attrs)
+        self.assertEqual(meta, {'logical_size': os.path.getsize(self.pdfs[0]),
+                                'content_type': 'com.adobe.pdf'})
+        results = [pair for pair in md.list_many(self.pdfs, attrs=attrs)]
+        self.assertEqual(results[0], (self.pdfs[0], meta))
+        self.assertEqual(sorted(results[2][1]),
+                         ['content_type', 'logical_size'])
+        self.assertRaises(Exception, md.list, self.pdfs[0],
+                          attrs=['no_such_attribute'])
+
+    def test_native_types(self):
+        meta = md.list(self.pdfs[0])
+        self.assertIsInstance(meta['content_creation_date'],
+                              datetime.datetime)
+        self.assertEqual(meta['content_type_tree'][0], 'com.adobe.pdf')
+        self.assertEqual(meta['user_tags'], ['fake', 'tag ☆'])
+        # attributes without a value are left out
+        self.assertNotIn('fs_node_count', meta)
+
+    def test_parse_plists(self):
+        plist = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<plist version="1.0"><dict>'
+                 '<key>kMDItemTitle</key><string>a = "b" &amp; &#x263a;</string>'
+                 '<key>kMDItemKeywords</key><array/>'
+                 '<key>kMDItemDurationSeconds</key><real>1.5</real>'
+                 '<key>kMDItemAuthors</key><array>'
+                 '<string>To\u0304ny</string><string>x, y</string></array>'
+                 '</dict></plist>\n').encode('utf-8')
+        md_dicts = [md_dict for md_dict in md._parse_plists(plist * 2)]
+        self.assertEqual(len(md_dicts), 2)
+        self.assertEqual(md_dicts[1], {'title': 'a = "b" & ☺',
+                                       'keywords': [],
+                                       'duration_seconds': 1.5,
+                                       'authors': ['Tōny', 'x, y']})
+
+    def test_chunk_args(self):
+        chunks = [chunk for chunk in utils.chunk_args('abcdefg', 3)]
+        self.assertEqual(chunks, [['a', 'b', 'c'], ['d', 'e', 'f'], ['g']])
+        # chunks are also bounded by `ARG_MAX`
+        path = '/' + 'x' * 1000
+        count = utils.arg_max() // 1000 + 10
+        chunks = [chunk for chunk in utils.chunk_args([path] * count, 10 ** 6)]
+        self.assertEqual(len(chunks), 2)
+
+
+class IterFindTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(IterFindTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fs_name = MDAttribute('kMDItemFSName')
+
+    def tearDown(self):
+        super(IterFindTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def touch(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        open(path, 'wb').close()
+        return path
+
+    def test_iter_find(self):
+        paths = [self.touch(name) for name in ('a.pdf', 'b.pdf', 'c.txt')]
+        results = md.iter_find(self.fs_name == '*.pdf', only_in=self.tmp_dir)
+        self.assertEqual(sorted(results), paths[:2])
+
+    def test_newline_in_path(self):
+        path = self.touch('new\nline.pdf')
+        results = [p for p in md.iter_find(self.fs_name == '*line*',
+                                           only_in=self.tmp_dir)]
+        self.assertEqual(results, [path])
+
+    def test_limit(self):
+        os.environ['FAKE_MDFIND_RESULTS'] = '1000000'
+        results = [p for p in md.iter_find(self.fs_name == '*', limit=5)]
+        self.assertEqual(len(results), 5)
+        self.assertEqual([p for p in md.iter_find(self.fs_name == '*',
+                                                  limit=0)], [])
+
+    def test_fetch(self):
+        path = self.touch('a = "1".pdf')
+        self.touch('b.txt')
+        fetch = [metadata.logical_size, 'content_type', 'user_tags',
+                 'content_creation_date', MDAttribute('kMDItemFSNodeCount')]
+        results = md.find(self.fs_name == '*.pdf', only_in=self.tmp_dir,
+                          fetch=fetch)
+        self.assertEqual(len(results), 1)
+        result_path, meta = results[0]
+        self.assertEqual(result_path, path)
+        self.assertEqual(sorted(meta), ['content_creation_date',
+                                        'content_type', 'logical_size',
+                                        'user_tags'])
+        self.assertEqual(meta['logical_size'], 0)
+        self.assertEqual(meta['content_type'], 'com.adobe.pdf')
+        self.assertEqual(meta['user_tags'], ['fake', 'tag ☆'])
+        self.assertIsInstance(meta['content_creation_date'],
+                              datetime.datetime)
+        self.assertEqual(meta, md.list(path, attrs=fetch))
+
+    def test_fetch_numeric_text(self):
+        path = self.touch('007')
+        fetch = ['name', 'logical_size']
+        results = md.find(self.fs_name == '007', only_in=self.tmp_dir,
+                          fetch=fetch)
+        self.assertEqual(results, [(path, {'name': '007',
+                                           'logical_size': 0})])
+        self.assertEqual(results[0][1], md.list(path, attrs=fetch))
+
+    def test_split_query(self):
+        paths = [self.touch('{}.pdf'.format(i)) for i in range(30)]
+        self.touch('x.txt')
+        query = MDExpression(' || ', *([self.fs_name == '*.pdf'] +
+                                       [self.fs_name == '{}.pdf'.format(i)
+                                        for i in range(60)]))
+        budget, planner.QUERY_BUDGET = planner.QUERY_BUDGET, 200
+        try:
+            self.assertGreater(len(planner.split(query)), 10)
+            for max_workers in (1, 4):
+                results = md.find(query, only_in=self.tmp_dir,
+                                  max_workers=max_workers)
+                self.assertEqual(sorted(results), sorted(paths))
+            results = [path for path in md.iter_find(query,
+                                                     only_in=self.tmp_dir)]
+            self.assertEqual(sorted(results), sorted(paths))
+            results = md.find(query, only_in=self.tmp_dir,
+                              fetch=['logical_size'])
+            self.assertEqual(sorted(path for path, _ in results),
+                             sorted(paths))
+        finally:
+            planner.QUERY_BUDGET = budget
+
+    def test_split_and(self):
+        pdf = MDAttribute('kMDItemContentType') == 'com.adobe.pdf'
+        names = MDExpression(' || ', *[self.fs_name == name
+                                       for name in 'abcd'])
+        queries = planner.split(pdf & names, budget=110)
+        self.assertEqual([unicode(query) for query in queries], [
+            'kMDItemContentType == "com.adobe.pdf"cd && '
+            '(kMDItemFSName == "a"cd || kMDItemFSName == "b"cd)',
+            'kMDItemContentType == "com.adobe.pdf"cd && '
+            '(kMDItemFSName == "c"cd || kMDItemFSName == "d"cd)'])
+        self.assertEqual(planner.split(pdf & names), [pdf & names])
+
+    def test_early_close_kills_process(self):
+        os.environ['FAKE_MDFIND_RESULTS'] = '1000000'
+        procs = []
+
+        class Recorder(utils.Executor):
+
+            def popen(self, cmd, stdin=False):
+                procs.append(utils.Executor.popen(self, cmd, stdin))
+                return procs[-1]
+
+        previous = utils.set_executor(Recorder())
+        try:
+            results = md.iter_find(self.fs_name == '*')
+            self.assertTrue(next(results).startswith('/Volumes/Fake/'))
+            self.assertIsNone(procs[0].poll())
+            results.close()
+        finally:
+            utils.set_executor(previous)
+        # killed, rather than left to print the rest
+        self.assertEqual(procs[0].poll(), -signal.SIGKILL)
+
+    def test_items(self):
+        paths = [self.touch('{}.pdf'.format(i)) for i in range(5)]
+        commands = []
+
+        class Recorder(utils.Executor):
+
+            def run(self, cmd, stdin=None, timeout=None):
+                commands.append(cmd[0])
+                return utils.Executor.run(self, cmd, stdin, timeout)
+
+        window = metadata.items.PREFETCH_WINDOW
+        metadata.items.PREFETCH_WINDOW = 2
+        previous = utils.set_executor(Recorder())
+        try:
+            items = md.find(self.fs_name == '*.pdf', only_in=self.tmp_dir,
+                            items=True)
+            self.assertEqual(sorted(item.path for item in items), paths)
+            self.assertEqual(commands, ['mdfind'])
+            names = [item.name for item in items]
+            # one `mdls` per window of two results
+            self.assertEqual(commands.count('mdls'), 3)
+            self.assertEqual(names, [item['kMDItemFSName'] for item in items])
+            self.assertEqual(len(commands), 4)
+            self.assertIsNone(items[0].authors)
+            self.assertRaises(KeyError, lambda: items[0]['authors'])
+            self.assertNotIn(MDAttribute('kMDItemAuthors'), items[0])
+            # listed once, for the first window only
+            self.assertEqual(commands.count('mdls'), 4)
+        finally:
+            utils.set_executor(previous)
+            metadata.items.PREFETCH_WINDOW = window
+
+    def test_item_on_its_own(self):
+        path = self.touch('alone.pdf')
+        item = metadata.items.MDItem(path)
+        self.assertEqual(item.name, 'alone.pdf')
+        self.assertEqual(item['kMDItemLogicalSize'], 0)
+        self.assertIsNone(item.authors)
+
+    def test_iter_items(self):
+        for i in range(5):
+            self.touch('{}.pdf'.format(i))
+        items = [item for item in md.iter_find(
+            self.fs_name == '*.pdf', only_in=self.tmp_dir, limit=3,
+            fetch=[self.fs_name], items=True)]
+        self.assertEqual(len(items), 3)
+        self.assertEqual(items[0].name, os.path.basename(items[0].path))
+        self.assertEqual(items[1].logical_size, 0)
+
+    def sized(self, count):
+        paths = []
+        for i in range(count):
+            path = os.path.join(self.tmp_dir, '{:02d}.txt'.format(i))
+            with open(path, 'wb') as f:
+                f.write(b'x' * (i * 7 % 10))
+            paths.append(path)
+        return paths
+
+    def test_order_by(self):
+        paths = self.sized(12)
+        size = MDAttribute('kMDItemLogicalSize')
+        query = self.fs_name == '*.txt'
+        largest = sorted(paths, key=lambda path: (os.path.getsize(path),
+                                                  path), reverse=True)
+        page = md.find(query, only_in=self.tmp_dir, order_by=size,
+                       descending=True, limit=3)
+        self.assertEqual(page, largest[:3])
+        self.assertEqual(page.total, 12)
+        page = md.find(query, only_in=self.tmp_dir, order_by='logical_size',
+                       limit=2, offset=1, fetch=[self.fs_name])
+        self.assertEqual(page, [(path, {'name': os.path.basename(path)})
+                                for path in largest[::-1][1:3]])
+        self.assertEqual(md.find(query, only_in=self.tmp_dir, order_by=size),
+                         largest[::-1])
+        # files without the attribute come last, either way, in order of
+        # their paths
+        authors = MDAttribute('kMDItemAuthors')
+        self.assertEqual(md.find(query, only_in=self.tmp_dir,
+                                 order_by=authors, limit=2), paths[:2])
+        self.assertEqual(md.find(query, only_in=self.tmp_dir,
+                                 order_by=authors, descending=True,
+                                 limit=2), paths[:-3:-1])
+
+    def test_pages(self):
+        paths = self.sized(11)
+        size = MDAttribute('kMDItemLogicalSize')
+        for descending in (False, True):
+            results, cursor = [], None
+            while True:
+                page = md.find(self.fs_name == '*.txt', only_in=self.tmp_dir,
+                               order_by=size, descending=descending,
+                               limit=4, after=cursor)
+                self.assertLessEqual(len(page), 4)
+                results.extend(page)
+                cursor = page.cursor
+                if cursor is None:
+                    break
+            self.assertEqual(results, sorted(
+                paths, key=lambda path: (os.path.getsize(path), path),
+                reverse=descending))
+        # without an order, limit and offset still stop `mdfind` early
+        page = md.find(self.fs_name == '*.txt', only_in=self.tmp_dir,
+                       limit=3, offset=2)
+        self.assertEqual(len(page), 3)
+        self.assertIsNone(page.cursor)
+
+    def test_page_timeout(self):
+        self.sized(4)
+
+        class Slow(utils.Executor):
+
+            def popen(self, cmd, stdin=False):
+                return utils.Executor.popen(self, ['sleep', '10'], stdin)
+
+        previous = utils.set_executor(Slow())
+        try:
+            for kwargs in ({'limit': 3}, {'order_by': 'logical_size'},
+                           {'offset': 1}):
+                start = time.time()
+                self.assertRaises(utils.ProcessTimeout, md.find,
+                                  self.fs_name == '*.txt',
+                                  only_in=self.tmp_dir, timeout=0.2,
+                                  **kwargs)
+                self.assertLess(time.time() - start, 5)
+        finally:
+            utils.set_executor(previous)
+
+    def test_split_pages(self):
+        paths = self.sized(10)
+        query = MDExpression(' || ', *[
+            self.fs_name == os.path.basename(path) for path in paths])
+        budget = planner.QUERY_BUDGET
+        planner.QUERY_BUDGET = 100
+        try:
+            self.assertGreater(len(planner.split(query)), 1)
+            page = md.find(query, only_in=self.tmp_dir, max_workers=2,
+                           order_by='logical_size', limit=4)
+        finally:
+            planner.QUERY_BUDGET = budget
+        self.assertEqual(page, sorted(
+            paths, key=lambda path: (os.path.getsize(path), path))[:4])
+        self.assertEqual(page.total, 10)
+
+
+class BackendConformance(object):
+    """Tests every backend must pass; mixed into one `TestCase` per backend.
+
+    """
+
+    def setUp(self):
+        super(BackendConformance, self).setUp()
+        self.previous = metadata.set_backend(self.make_backend())
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fs_name = MDAttribute('kMDItemFSName')
+        self.size = MDAttribute('kMDItemLogicalSize')
+        self.content_type = MDAttribute('kMDItemContentType')
+        self.paths = [self.make(name, size) for name, size in
+                      (('résumé.pdf', 40), ('a.txt', 3), ('b.txt', 30),
+                       ('sub/c.pdf', 0), ('sub/d.txt', 12))]
+
+    def tearDown(self):
+        metadata.set_backend(self.previous)
+        super(BackendConformance, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def make(self, name, size):
+        path = os.path.join(self.tmp_dir, name)
+        # Python 2 only creates non-ASCII names in a UTF-8 locale
+        fs_path = path if utils.PY3 else path.encode('utf-8')
+        if not os.path.isdir(os.path.dirname(fs_path)):
+            os.makedirs(os.path.dirname(fs_path))
+        with open(fs_path, 'wb') as fp:
+            fp.write(b'x' * size)
+        return path
+
+    def find(self, query, **kwargs):
+        return sorted(md.find(query, only_in=self.tmp_dir, **kwargs))
+
+    def test_name(self):
+        self.assertEqual(self.find(self.fs_name == '*.pdf'),
+                         [self.paths[0], self.paths[3]])
+        # names compare ignoring case and diacritics
+        self.assertEqual(self.find(self.fs_name == 'RESUME*'),
+                         self.paths[:1])
+
+    def test_size(self):
+        txt = self.fs_name == '*.txt'
+        self.assertEqual(self.find(txt & (self.size > 10)),
+                         [self.paths[2], self.paths[4]])
+        # folded into `InRange` by the optimizer
+        self.assertEqual(self.find(txt & (self.size >= 3) &
+                                   (self.size <= 12)),
+                         [self.paths[1], self.paths[4]])
+
+    def test_content_type(self):
+        query = (self.content_type == 'com.adobe.pdf') | \
+            (self.fs_name == 'a.txt')
+        self.assertEqual(self.find(query),
+                         sorted(self.paths[:2] + self.paths[3:4]))
+
+    def test_date(self):
+        modified = MDAttribute('kMDItemContentModificationDate')
+        names = self.fs_name == '*.txt'
+        self.assertEqual(len(self.find(names & (modified > '2000-01-01'))), 3)
+        self.assertEqual(self.find(names & (modified < '2000-01-01')), [])
+
+    def test_only_in(self):
+        results = md.find(self.fs_name == '*.*',
+                          only_in=os.path.join(self.tmp_dir, 'sub'))
+        self.assertEqual(sorted(results), self.paths[3:])
+
+    def test_iter_find(self):
+        results = [path for path in md.iter_find(
+            self.fs_name == '*.txt', only_in=self.tmp_dir, limit=2)]
+        self.assertEqual(len(results), 2)
+
+    def test_fetch(self):
+        results = self.find(self.fs_name == '*.pdf',
+                            fetch=['name', self.size, 'content_type'])
+        self.assertEqual(results, [
+            (self.paths[0], {'name': 'résumé.pdf', 'logical_size': 40,
+                             'content_type': 'com.adobe.pdf'}),
+            (self.paths[3], {'name': 'c.pdf', 'logical_size': 0,
+                             'content_type': 'com.adobe.pdf'})])
+
+    def test_list(self):
+        md_dict = md.list(self.paths[2])
+        for key in ('name', 'display_name', 'logical_size',
+                    'content_type', 'content_creation_date',
+                    'content_modification_date'):
+            self.assertIn(key, md_dict)
+        self.assertEqual(md_dict['name'], 'b.txt')
+        self.assertEqual(md_dict['logical_size'], 30)
+        self.assertEqual(md_dict['content_type'], 'public.plain-text')
+        self.assertIsInstance(md_dict['content_modification_date'],
+                              datetime.datetime)
+        self.assertEqual(md.list(self.paths[2],
+                                 attrs=['name', self.size]),
+                         {'name': 'b.txt', 'logical_size': 30})
+
+    def test_list_many(self):
+        missing = os.path.join(self.tmp_dir, 'missing.txt')
+        pairs = [pair for pair in md.list_many(
+            [self.paths[1], missing, self.paths[0]], attrs=['name'])]
+        self.assertEqual(pairs, [(self.paths[1], {'name': 'a.txt'}),
+                                 (missing, {}),
+                                 (self.paths[0], {'name': 'résumé.pdf'})])
+        self.assertEqual(md.list(missing), {})
+
+
+class SpotlightBackendTests(BackendConformance, FakeToolsTestCase):
+
+    def make_backend(self):
+        return metadata.SpotlightBackend()
+
+
+class LocalBackendTests(BackendConformance, FakeToolsTestCase):
+
+    def make_backend(self):
+        return metadata.LocalBackend()
+
+    def test_no_processes(self):
+        os.environ['PATH'] = ''
+        self.assertEqual(self.find(self.fs_name == '*.pdf'),
+                         [self.paths[0], self.paths[3]])
+
+    def test_magic_bytes(self):
+        pdf = os.path.join(self.tmp_dir, 'scan')
+        with open(pdf, 'wb') as fp:
+            fp.write(b'%PDF-1.4')
+        self.assertEqual(md.list(pdf, attrs=['content_type']),
+                         {'content_type': 'com.adobe.pdf'})
+        self.assertIn(pdf, self.find(self.content_type == 'com.adobe.pdf'))
+
+    def test_tags(self):
+        try:
+            md.write(self.paths[1], ['Red', 'Tōnÿ'])
+        except (IOError, OSError):
+            self.skipTest('filesystem without user extended attributes')
+        self.assertEqual(md.list(self.paths[1], attrs=['user_tags']),
+                         {'user_tags': ['Red', 'Tōnÿ']})
+        tags = MDAttribute('kMDItemUserTags')
+        self.assertEqual(self.find(tags == 'red'), self.paths[1:2])
+
+
+class IndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.name = MDAttribute('kMDItemFSName')
+        self.size = MDAttribute('kMDItemLogicalSize')
+        self.created = MDAttribute('kMDItemContentCreationDate')
+        self.tags = MDAttribute('kMDItemUserTags')
+        words = ['résumé', 'Report', 'photo', 'NOTES', 'data']
+        types = ['com.adobe.pdf', 'public.plain-text', 'public.jpeg']
+        self.records = []
+        for i in range(300):
+            md_dict = {'name': '{} {} {:03d}.{}'.format(
+                words[i % 5], words[i % 3], i, ('pdf', 'txt', 'jpg')[i % 3]),
+                'content_type': types[i % 3],
+                'content_creation_date': datetime.datetime(2015, 1, 1) +
+                datetime.timedelta(days=i * 7)}
+            if i % 4:
+                md_dict['logical_size'] = i * 37 % 1000
+            if i % 5 == 0:
+                md_dict['user_tags'] = [['Red', 'Blue', 'Grün'][i % 3],
+                                        'Work']
+            self.records.append(('/Volumes/Data/{}/{}'.format(
+                i % 10, md_dict['name']), md_dict))
+        self.index = metadata.Index(
+            '/Volumes/Data', attrs=[self.name, self.size, self.created,
+                                    self.tags, 'content_type'],
+            path=os.path.join(self.tmp_dir, 'index'),
+            backend=metadata.LocalBackend())
+        self.index.build(self.records)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def expected(self, query):
+        matches = query.compile()
+        return [path for path, md_dict in self.records if matches(md_dict)]
+
+    def test_queries(self):
+        name, size, created, tags = (self.name, self.size, self.created,
+                                     self.tags)
+        content_type = MDAttribute('kMDItemContentType')
+        case_sensitive = MDAttribute('kMDItemFSName')
+        case_sensitive.ignore_case = False
+        queries = [
+            name == 'résumé photo 015.pdf', name == 'RESUME*',
+            name == '*port*', name == '*.pdf', name == 'no?es*',
+            name != '*data*', case_sensitive == 'NOTES*',
+            case_sensitive == 'notes*', size == 111, size != 111,
+            size > 500, size <= 37, (size >= 100) & (size <= 200),
+            created < '2016-01-01', created > datetime.datetime(2019, 6, 1),
+            tags == 'grun', tags != 'work', tags == 'r*',
+            content_type == 'public.*',
+            (name == '*photo*') & (size > 500) & (content_type != 'x'),
+            (name == 'data*') | (tags == 'red') | (size < 20),
+            ((name == '*.jpg') | (name == '*.txt')) & (created < '2017-01-01'),
+        ]
+        for query in queries:
+            query = optimizer.optimize(query)
+            self.assertEqual(self.index.find(query), self.expected(query),
+                             unicode(query))
+
+    def test_modifiers_captured(self):
+        name = MDAttribute('kMDItemFSName')
+        query = name != 'RESUME*'
+        # changing the attribute later doesn't change the comparison
+        name.ignore_case = False
+        self.assertEqual(self.index.find(query), self.expected(query))
+        self.assertTrue(all(not os.path.basename(path).startswith('résumé')
+                            for path in self.index.find(query)))
+
+    def test_persistent(self):
+        index = metadata.Index('/Volumes/Data', attrs=self.index.attrs,
+                               path=self.index.path,
+                               backend=metadata.LocalBackend())
+        self.assertEqual(len(index), 300)
+        query = self.name == '*port*'
+        self.assertEqual(index.find(query), self.index.find(query))
+        # indexing other attributes starts over
+        index = metadata.Index('/Volumes/Data', attrs=[self.name],
+                               path=self.index.path,
+                               backend=metadata.LocalBackend())
+        self.assertEqual(len(index), 0)
+
+    def test_backend(self):
+        root = os.path.join(self.tmp_dir, 'files')
+        os.makedirs(os.path.join(root, 'sub'))
+        for name in ('a.pdf', 'b.txt', 'sub/c.pdf'):
+            open(os.path.join(root, name), 'wb').close()
+        index = metadata.Index(root, attrs=[self.name],
+                               path=os.path.join(self.tmp_dir, 'files.index'),
+                               backend=metadata.LocalBackend())
+        previous = metadata.set_backend(index)
+        try:
+            pdfs = md.find(self.name == '*.pdf', only_in=root)
+            self.assertEqual(len(index), 4)
+            self.assertEqual(pdfs, [os.path.join(root, 'a.pdf'),
+                                    os.path.join(root, 'sub/c.pdf')])
+            self.assertEqual(md.find(self.name == '*.pdf',
+                                     only_in=os.path.join(root, 'sub')),
+                             pdfs[1:])
+            self.assertEqual([path for path in md.iter_find(
+                self.name == '*.txt', only_in=root)],
+                [os.path.join(root, 'b.txt')])
+            # attributes that aren't indexed are asked of the backend
+            results = md.find((self.name == '*.pdf') & (self.size == 0),
+                              only_in=root)
+            self.assertEqual(sorted(results), pdfs)
+        finally:
+            metadata.set_backend(previous)
+
+    def test_update(self):
+        # a merge after every few changes
+        merge_min = metadata.index.MERGE_MIN
+        metadata.index.MERGE_MIN = 20
+        try:
+            for step in range(12):
+                removed = self.records.pop(step * 7)[0]
+                changed = []
+                for i in range(step, 280, 23):
+                    path, md_dict = self.records[i]
+                    md_dict = dict(md_dict, logical_size=step * 100 + i)
+                    self.records[i] = (path, md_dict)
+                    changed.append((path, md_dict))
+                added = ('/Volumes/Data/new/{}.pdf'.format(step),
+                         {'name': 'new {}.pdf'.format(step)})
+                self.records.append(added)
+                self.index.update(changed + [added], [removed])
+                for query in ((self.name == '*.pdf') & (self.size > 500),
+                              self.name == 'new*', self.size != 111):
+                    self.assertEqual(sorted(self.index.find(query)),
+                                     sorted(self.expected(query)))
+        finally:
+            metadata.index.MERGE_MIN = merge_min
+        # a removed directory takes its files with it
+        self.index.update(removed=['/Volumes/Data/3'])
+        self.records = [(path, md_dict) for path, md_dict in self.records
+                        if not path.startswith('/Volumes/Data/3/')]
+        self.assertEqual(len(self.index), len(self.records))
+        self.index.save()
+        index = metadata.Index('/Volumes/Data', attrs=self.index.attrs,
+                               path=self.index.path,
+                               backend=metadata.LocalBackend())
+        query = self.name == '*o*'
+        self.assertEqual(sorted(index.find(query)),
+                         sorted(self.expected(query)))
+
+
+class UpdaterTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(UpdaterTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp_dir, 'files')
+        os.makedirs(os.path.join(self.root, 'sub'))
+        for name in ('a.txt', 'b.pdf', 'sub/c.txt'):
+            self.write(name, b'x')
+        self.name = MDAttribute('kMDItemFSName')
+        self.index = metadata.Index(
+            self.root, attrs=[self.name, 'logical_size'],
+            path=os.path.join(self.tmp_dir, 'index'),
+            backend=metadata.LocalBackend())
+        self.index.build()
+
+    def tearDown(self):
+        super(UpdaterTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'wb') as f:
+            f.write(data)
+
+    def indexed(self):
+        return sorted(os.path.relpath(path, self.root) for path
+                      in self.index.find(self.name == '*'))
+
+    def settle(self, updater):
+        for _ in range(10):
+            updater.poll(0.02)
+        updater.flush()
+
+    def check_changes(self, inotify):
+        updater = metadata.Updater(delay=0.01, poll_interval=0.01,
+                                   inotify=inotify)
+        updater.add(self.root, self.index)
+        self.assertEqual(updater.events, 0)
+        self.write('a.txt', b'longer')
+        self.write('d.txt', b'')
+        os.remove(os.path.join(self.root, 'b.pdf'))
+        os.makedirs(os.path.join(self.root, 'new', 'deeper'))
+        self.write('new/deeper/e.pdf', b'')
+        self.settle(updater)
+        self.assertEqual(self.indexed(), ['a.txt', 'd.txt', 'new',
+                                          'new/deeper', 'new/deeper/e.pdf',
+                                          'sub', 'sub/c.txt'])
+        self.assertEqual(self.index.list_many(
+            [os.path.join(self.root, 'a.txt')], ['logical_size']),
+            [(os.path.join(self.root, 'a.txt'), {'logical_size': 6})])
+        self.assertEqual(self.index.find(self.name == 'a.txt',
+                                         fetch=['logical_size'])[0][1],
+                         {'logical_size': 6})
+        # changes to a directory, or in it, leave its other files indexed
+        self.write('sub/f.txt', b'')
+        self.settle(updater)
+        os.chmod(os.path.join(self.root, 'sub'), 0o700)
+        self.settle(updater)
+        self.assertEqual([path for path in self.indexed()
+                          if path.startswith('sub')],
+                         ['sub', 'sub/c.txt', 'sub/f.txt'])
+        shutil.rmtree(os.path.join(self.root, 'sub'))
+        self.settle(updater)
+        self.assertNotIn('sub/c.txt', self.indexed())
+        self.assertGreater(updater.batches, 0)
+        self.assertGreaterEqual(updater.paths_removed, 2)
+        self.assertGreater(updater.max_lag, 0)
+        updater.close()
+        self.assertTrue(updater.closed)
+
+    def test_snapshots(self):
+        self.check_changes(inotify=False)
+
+    def test_inotify(self):
+        if not metadata.updater._Inotify.available():
+            self.skipTest('no inotify')
+        self.check_changes(inotify=True)
+
+    def test_catch_up(self):
+        self.index.save()
+        self.write('late.txt', b'')
+        self.write('sub/later.txt', b'')
+        os.remove(os.path.join(self.root, 'a.txt'))
+        index = metadata.Index(self.root, attrs=self.index.attrs,
+                               path=self.index.path,
+                               backend=metadata.LocalBackend())
+        with metadata.Updater(inotify=False) as updater:
+            updater.add(self.root, index)
+        self.index = index
+        self.assertEqual(self.indexed(), ['b.pdf', 'late.txt', 'sub',
+                                          'sub/c.txt', 'sub/later.txt'])
+
+    def test_errors(self):
+        index, errors = self.index, []
+
+        class Flaky(object):
+
+            def stamps(self, root):
+                return index.stamps(root)
+
+            def refresh(self, changed, removed):
+                if not errors:
+                    raise OSError(errno.EIO, 'listing failed')
+                index.refresh(changed, removed)
+
+        updater = metadata.Updater(delay=0.01, poll_interval=0.01,
+                                   inotify=False, on_error=errors.append)
+        updater.add(self.root, Flaky())
+        updater.start()
+        try:
+            self.write('d.txt', b'')
+            for _ in range(500):
+                if errors:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(updater.errors, 1)
+            self.assertIsInstance(updater.last_error, OSError)
+            # the thread carries on with later changes
+            self.write('e.txt', b'')
+            for _ in range(500):
+                if 'e.txt' in self.indexed():
+                    break
+                time.sleep(0.01)
+            self.assertIn('e.txt', self.indexed())
+        finally:
+            updater.close()
+        self.assertEqual(errors, [updater.last_error])
+
+    def test_add_while_running(self):
+        other = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(other)
+        updater = metadata.Updater(delay=0.01, poll_interval=0.01)
+        updater.start()
+        indexes = []
+        try:
+            # roots added while the thread applies the changes of others
+            for i in range(20):
+                root = os.path.join(other, str(i))
+                os.mkdir(root)
+                index = metadata.Index(root, attrs=[self.name],
+                                       backend=metadata.LocalBackend())
+                index.build()
+                updater.add(root, index)
+                indexes.append(index)
+                open(os.path.join(root, 'f.txt'), 'wb').close()
+        finally:
+            updater.close()
+        self.assertEqual(len(updater.roots), 20)
+        self.assertEqual(updater.errors, 0)
+        for index in indexes:
+            self.assertEqual(len(index.find(self.name == 'f.txt')), 1)
+
+    def test_cache(self):
+        cache = metadata.MetadataCache(os.path.join(self.tmp_dir, 'cache'))
+        try:
+            paths = [os.path.join(self.root, name)
+                     for name in ('a.txt', 'sub/c.txt')]
+            [pair for pair in md.list_many(paths, cache=cache)]
+            updater = metadata.Updater(delay=0.01, poll_interval=0.01,
+                                       inotify=False)
+            updater.add(self.root, cache)
+            self.write('a.txt', b'longer')
+            shutil.rmtree(os.path.join(self.root, 'sub'))
+            self.settle(updater)
+            self.assertEqual(cache.get(paths[0])['logical_size'], 6)
+            self.assertIsNone(cache.get(paths[1]))
+            updater.close()
+        finally:
+            cache.close()
+
+
+class ProcessTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(ProcessTests, self).setUp()
+        os.environ['LANG'] = 'C'
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        utils.set_executor(None)
+        super(ProcessTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_shell(self):
+        path = os.path.join(self.tmp_dir, "it's $HOME.pdf")
+        open(path, 'wb').close()
+        query = metadata.name == "it's $HOME.pdf"
+        self.assertEqual(md.find(query, only_in=self.tmp_dir), [path])
+        # the environment of this process is left alone
+        self.assertEqual(os.environ['LANG'], 'C')
+
+    def test_timeout(self):
+        executor = utils.Executor()
+        self.assertEqual(executor.run(['cat'], stdin=b'abc', timeout=5),
+                         b'abc')
+        start = time.time()
+        self.assertRaises(utils.ProcessTimeout, executor.run,
+                          ['sleep', '10'], timeout=0.2)
+        self.assertLess(time.time() - start, 5)
+
+    def test_executor(self):
+        commands = []
+
+        class Recorder(utils.Executor):
+
+            def run(self, cmd, stdin=None, timeout=None):
+                commands.append((cmd, timeout))
+                return b'/a.pdf\0/b.pdf\0'
+
+        previous = utils.set_executor(Recorder())
+        self.assertIs(type(previous), utils.Executor)
+        query = metadata.name == '*.pdf'
+        self.assertEqual(md.find(query, only_in='/', timeout=3),
+                         ['/a.pdf', '/b.pdf'])
+        self.assertEqual(commands, [(['mdfind', '-0', '-onlyin', '/',
+                                      'kMDItemFSName == "*.pdf"cd'], 3)])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio API needs Python 3.5+')
+class AsyncTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(AsyncTests, self).setUp()
+        import asyncio
+        self.asyncio = asyncio
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.pdf_dir = os.path.dirname(os.path.abspath(__file__))
+        self.pdfs = [os.path.join(self.pdf_dir, name)
+                     for name in ('blank.pdf', 'lorem_essay.pdf',
+                                  'lorem_visual.pdf')]
+        self.fs_name = MDAttribute('kMDItemFSName')
+
+    def tearDown(self):
+        self.loop.close()
+        super(AsyncTests, self).tearDown()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def test_imported_on_first_use(self):
+        # `import metadata` alone leaves `asyncio`, which is slow, alone
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        code = ('import sys; sys.path.insert(0, {!r}); import metadata; '
+                'print("asyncio" in sys.modules); metadata.async_find; '
+                'print("asyncio" in sys.modules)'.format(root))
+        output = utils.Executor().run([sys.executable, '-c', code])
+        self.assertEqual(output.split(), [b'False', b'True'])
+
+    def test_async_find(self):
+        paths = self.run_async(metadata.async_find(
+            self.fs_name == 'lorem*.pdf', only_in=self.pdf_dir))
+        self.assertEqual(sorted(paths), self.pdfs[1:])
+
+    def test_async_list(self):
+        meta = self.run_async(metadata.async_list(self.pdfs[0]))
+        self.assertEqual(meta, md.list(self.pdfs[0]))
+
+    def test_async_list_many(self):
+        pairs = self.run_async(metadata.async_list_many(
+            self.pdfs + ['/no/such/file.pdf'], chunk_size=2))
+        self.assertEqual([path for path, _ in pairs],
+                         self.pdfs + ['/no/such/file.pdf'])
+        self.assertEqual(pairs[1][1]['name'], 'lorem_essay.pdf')
+        self.assertEqual(pairs[3][1], {})
+
+    def test_concurrency_limit(self):
+        semaphore = self.asyncio.Semaphore(2)
+        coroutines = [metadata.async_list(path, semaphore=semaphore)
+                      for path in self.pdfs * 4]
+        results = self.run_async(self.asyncio.gather(*coroutines))
+        self.assertEqual(len(results), 12)
+
+    def test_timeout_kills_process(self):
+        os.environ['FAKE_MDFIND_RESULTS'] = '100000000'
+        with self.assertRaises(utils.ProcessTimeout):
+            self.run_async(metadata.async_find(self.fs_name == '*',
+                                               timeout=0.5))
+
+    def test_executor(self):
+        commands = []
+
+        class Recorder(utils.Executor):
+
+            def run(self, cmd, stdin=None, timeout=None):
+                commands.append(cmd[0])
+                return utils.Executor.run(self, cmd, stdin, timeout)
+
+        previous = utils.set_executor(Recorder())
+        try:
+            paths = self.run_async(metadata.async_find(
+                self.fs_name == 'lorem*.pdf', only_in=self.pdf_dir))
+            meta = self.run_async(metadata.async_list(self.pdfs[0]))
+            os.environ['FAKE_MDFIND_RESULTS'] = '100000000'
+            with self.assertRaises(utils.ProcessTimeout):
+                self.run_async(metadata.async_find(self.fs_name == '*',
+                                                   timeout=0.5))
+        finally:
+            utils.set_executor(previous)
+        self.assertEqual(sorted(paths), self.pdfs[1:])
+        self.assertEqual(meta, md.list(self.pdfs[0]))
+        self.assertEqual(commands, ['mdfind', 'mdls', 'mdfind'])
+
+
+class ScanTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(ScanTests, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(25):
+            subdir = os.path.join(self.root, 'dir{}'.format(i % 3))
+            if not os.path.isdir(subdir):
+                os.mkdir(subdir)
+            path = os.path.join(subdir, 'file{}.txt'.format(i))
+            with open(path, 'wb') as f:
+                f.write(b'x' * i)
+            self.paths.append(path)
+
+    def tearDown(self):
+        super(ScanTests, self).tearDown()
+        shutil.rmtree(self.root)
+
+    def test_scan(self):
+        calls = []
+        results = dict(metadata.scan(self.root, workers=3, batch_size=4,
+                                     progress=lambda *a: calls.append(a)))
+        self.assertEqual(sorted(results), sorted(self.paths))
+        for path, meta in results.items():
+            self.assertEqual(meta['logical_size'], os.path.getsize(path))
+        self.assertEqual(calls[-1], (25, 25))
+
+    def test_scan_attrs(self):
+        attrs = [MDAttribute('kMDItemLogicalSize'), 'content_type']
+        for path, meta in metadata.scan(self.root, attrs=attrs):
+            self.assertEqual(sorted(meta), ['content_type', 'logical_size'])
+
+    def test_scan_error_isolation(self):
+        errors = []
+        list_many, list_one = md.list_many, md.list
+
+        def failing_list_many(paths, chunk_size=500, cache=None, attrs=None):
+            if any(path.endswith('file7.txt') for path in paths):
+                raise OSError('listing failed')
+            return list_many(paths, chunk_size, cache, attrs)
+
+        def failing_list(path, cache=None, attrs=None):
+            if path.endswith('file7.txt'):
+                raise OSError('listing failed')
+            return list_one(path, cache, attrs)
+
+        md.list_many, md.list = failing_list_many, failing_list
+        try:
+            results = dict(metadata.scan(self.root, batch_size=5,
+                                         on_error=lambda *a: errors.append(a)))
+        finally:
+            md.list_many, md.list = list_many, list_one
+        self.assertEqual(len(results), 24)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0][0].endswith('file7.txt'))
+
+    def test_scan_stop_early(self):
+        commands = []
+
+        class Recorder(utils.Executor):
+
+            def run(self, cmd, stdin=None, timeout=None):
+                commands.append(cmd[0])
+                return utils.Executor.run(self, cmd, stdin, timeout)
+
+        before = set(threading.enumerate())
+        previous = utils.set_executor(Recorder())
+        try:
+            results = metadata.scan(self.root, workers=2, batch_size=1)
+            next(results)
+            results.close()
+            threads = set(threading.enumerate()) - before
+            for thread in threads:
+                thread.join(10)
+            listed = len(commands)
+            time.sleep(0.3)
+        finally:
+            utils.set_executor(previous)
+        # the walker and the workers are done
+        self.assertEqual(len(threads), 3)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        # after the batches in flight, no more `mdls`
+        self.assertEqual(len(commands), listed)
+        self.assertLess(listed, len(self.paths))
+
+
+class WatchTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(WatchTests, self).setUp()
+        os.environ['FAKE_MDFIND_LIVE_INTERVAL'] = '0.05'
+        self.tmp_dir = tempfile.mkdtemp()
+        self.fs_name = MDAttribute('kMDItemFSName')
+
+    def tearDown(self):
+        super(WatchTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def touch(self, name):
+        path = os.path.join(self.tmp_dir, name)
+        open(path, 'wb').close()
+        return path
+
+    def test_watch_callback(self):
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+        events = queue.Queue()
+        first = self.touch('a.pdf')
+        self.touch('ignored.txt')
+        watcher = metadata.watch(self.fs_name == '*.pdf',
+                                 only_in=self.tmp_dir,
+                                 callback=lambda *e: events.put(e))
+        with watcher:
+            self.assertEqual(events.get(timeout=10), ('added', first))
+            second = self.touch('b.pdf')
+            self.assertEqual(events.get(timeout=10), ('added', second))
+            os.remove(first)
+            self.assertEqual(events.get(timeout=10), ('removed', first))
+        self.assertTrue(watcher.closed)
+        # the callbacks are over once `close` returns
+        self.assertFalse(watcher._thread.is_alive())
+
+    def test_watch_iterate(self):
+        path = self.touch('a.pdf')
+        watcher = metadata.watch(self.fs_name == '*.pdf',
+                                 only_in=self.tmp_dir)
+        events = iter(watcher)
+        self.assertEqual(next(events), ('added', path))
+        watcher.close()
+        self.assertEqual([event for event in events], [])
+
+    def test_watch_newline_in_path(self):
+        path = self.touch('two\nlines.pdf')
+        with metadata.watch(self.fs_name == '*.pdf',
+                            only_in=self.tmp_dir) as watcher:
+            events = iter(watcher)
+            self.assertEqual(next(events), ('added', path))
+            other = self.touch('b.pdf')
+            self.assertEqual(next(events), ('added', other))
+
+
+class DecodeTests(unittest.TestCase):
+
+    def test_cocoa_escapes(self):
+        self.assertEqual(utils.decode(b'T\\U014dn\\U00ff St\\U00E5rk'),
+                         'Tōnÿ Stårk')
+        self.assertEqual(utils.decode('\\Ud83d\\Ude00'),
+                         b'\xf0\x9f\x98\x80'.decode('utf-8'))
+        # other backslashes are left alone
+        self.assertEqual(utils.decode('a\\nb \\U00e9'), 'a\\nb é')
+        self.assertEqual(utils.decode('C:\\Users \\U00e9'), 'C:\\Users é')
+
+    def test_normalization(self):
+        self.assertEqual(utils.decode(b'caf' + b'e\xcc\x81'), 'café')
+        self.assertEqual(utils.decode('caf\u00e9', normalization='NFD'),
+                         'cafe\u0301')
+        self.assertEqual(utils.decode(b'plain'), 'plain')
+        self.assertEqual(utils.decode(5), 5)
+
+    def test_decode_records(self):
+        data = b'/a\0/caf' + b'e\xcc\x81\0\0/b\0'
+        self.assertEqual(utils.decode_records(data), ['/a', '/café', '/b'])
+        # paths aren't Cocoa-escaped
+        self.assertEqual(utils.decode_records(b'/tmp/dir\\U0041b/x.pdf\0'),
+                         ['/tmp/dir\\U0041b/x.pdf'])
+        self.assertEqual(utils.decode_path(b'/caf' + b'e\xcc\x81\\U00e9'),
+                         '/café\\U00e9')
+        # nor is a last record without a delimiter
+        code = 'import sys; sys.stdout.write("/a\\0/b\\\\U0041")'
+        records = utils.iter_process([sys.executable, '-c', code])
+        self.assertEqual([record for record in records],
+                         ['/a', '/b\\U0041'])
+        self.assertEqual(utils.decode_records(b'a\nb\n', b'\n'), ['a', 'b'])
+
+
+class PredicateTests(unittest.TestCase):
+
+    def setUp(self):
+        self.name = MDAttribute('kMDItemFSName')
+        self.authors = MDAttribute('kMDItemAuthors')
+        self.size = MDAttribute('kMDItemLogicalSize')
+        self.created = MDAttribute('kMDItemContentCreationDate')
+        self.essay = {'name': 'lorem_essay.pdf',
+                      'authors': ['Tōnÿ Stårk'],
+                      'logical_size': 149385,
+                      'content_creation_date': '2014-12-10 17:05:10 +0000'}
+        self.blank = {'name': 'Blank.pdf',
+                      'logical_size': 4259,
+                      'content_creation_date': '2014-12-12 09:00:00 +0000'}
+
+    def matches(self, query):
+        return [record['name'] for record in (self.essay, self.blank)
+                if query.compile()(record)]
+
+    def test_wildcards(self):
+        self.assertEqual(self.matches(self.name == '*blank*'), ['Blank.pdf'])
+        self.assertEqual(self.matches(self.name == 'lorem_?ssay.pdf'),
+                         ['lorem_essay.pdf'])
+        self.assertEqual(self.matches(self.name == 'lorem'), [])
+        self.assertEqual(self.matches(self.name != '*essay*'), ['Blank.pdf'])
+
+    def test_modifiers(self):
+        self.assertEqual(self.matches(self.authors == '*stark*'),
+                         ['lorem_essay.pdf'])
+        strict = MDAttribute('kMDItemAuthors', ignore_case=False,
+                             ignore_diacritics=False)
+        self.assertEqual(self.matches(strict == '*stark*'), [])
+        self.assertEqual(self.matches(strict == '*Stårk'),
+                         ['lorem_essay.pdf'])
+        accents = MDAttribute('kMDItemAuthors', ignore_case=False)
+        self.assertEqual(self.matches(accents == 'Tony Stark'),
+                         ['lorem_essay.pdf'])
+
+    def test_missing_attribute(self):
+        self.assertEqual(self.matches(self.authors != '*nobody*'),
+                         ['lorem_essay.pdf'])
+
+    def test_numbers(self):
+        self.assertEqual(self.matches(self.size > 100000),
+                         ['lorem_essay.pdf'])
+        self.assertEqual(self.matches(self.size <= 4259), ['Blank.pdf'])
+        self.assertEqual(self.matches(self.size.in_range(4000, 5000)),
+                         ['Blank.pdf'])
+
+    def test_dates(self):
+        self.assertEqual(self.matches(self.created < '2014-12-11'),
+                         ['lorem_essay.pdf'])
+        self.assertEqual(self.matches(self.created >= '1 day ago'), [])
+        self.assertEqual(
+            self.matches(self.created.in_range('2014-12-01', '2014-12-31')),
+            ['lorem_essay.pdf', 'Blank.pdf'])
+
+    def test_expressions(self):
+        both = (self.name == '*.pdf') & (self.size < 10000)
+        self.assertEqual(self.matches(both), ['Blank.pdf'])
+        either = (self.authors == '*stark*') | (self.size < 10000)
+        self.assertEqual(self.matches(either),
+                         ['lorem_essay.pdf', 'Blank.pdf'])
+        nested = (self.name == '*.pdf') & either
+        self.assertEqual(self.matches(nested),
+                         ['lorem_essay.pdf', 'Blank.pdf'])
+
+    def test_compiled_once(self):
+        comparison = self.name == '*.pdf'
+        self.assertIs(comparison.compile(), comparison.compile())
+
+    def test_dates_in_other_time_zones(self):
+        if not hasattr(time, 'tzset'):
+            self.skipTest('no time.tzset')
+        created = MDAttribute('kMDItemContentCreationDate')
+        # a date as `list` returns it: naive, in UTC
+        value = datetime.datetime(2015, 3, 1, 12, 30)
+        record = {'content_creation_date': value}
+        zone = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        try:
+            for comparison in (created == value, created >= value,
+                               created <= value,
+                               created.in_range(value, value)):
+                self.assertTrue(predicates.compile_query(comparison)(record),
+                                unicode(comparison))
+            self.assertFalse(predicates.compile_query(created > value)(record))
+            self.assertEqual(utils.parse_date(value),
+                             utils.value_timestamp('2015-03-01 12:30:00 +0000'))
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                index = metadata.Index('/Volumes/Data', attrs=[created],
+                                       path=os.path.join(tmp_dir, 'index'),
+                                       backend=metadata.LocalBackend())
+                index.build([('/Volumes/Data/a.pdf', record)])
+                self.assertEqual(index.find(created == value),
+                                 ['/Volumes/Data/a.pdf'])
+            finally:
+                shutil.rmtree(tmp_dir)
+        finally:
+            if zone is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = zone
+            time.tzset()
+
+    def test_relative_date_moves(self):
+        modified = MDAttribute('kMDItemContentModificationDate')
+        comparison = modified < '1 seconds ago'
+        record = {'content_modification_date': datetime.datetime.utcnow()}
+        self.assertFalse(comparison.compile()(record))
+        time.sleep(2.1)
+        # the bound is worked out again, not kept from the first compile
+        self.assertTrue(comparison.compile()(record))
+
+
+class MetadataCacheTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(MetadataCacheTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(5):
+            path = os.path.join(self.tmp_dir, 'file{}.txt'.format(i))
+            with open(path, 'wb') as f:
+                f.write(b'x' * i)
+            self.paths.append(path)
+        self.cache = metadata.MetadataCache(
+            os.path.join(self.tmp_dir, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.close()
+        super(MetadataCacheTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hits_need_no_process(self):
+        first = [pair for pair in md.list_many(self.paths, cache=self.cache)]
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 5))
+        # without `mdls` on `$PATH` only the cache can answer
+        os.environ['PATH'] = os.defpath
+        second = [pair for pair in md.list_many(self.paths, cache=self.cache)]
+        self.assertEqual(second, first)
+        self.assertEqual(self.cache.hits, 5)
+        self.assertEqual(md.list(self.paths[0], cache=self.cache),
+                         first[0][1])
+
+    def test_attrs(self):
+        attrs = ['logical_size']
+        meta = md.list(self.paths[3], cache=self.cache, attrs=attrs)
+        self.assertEqual(meta, {'logical_size': 3})
+        # the cache holds the full listing, to serve any projection
+        self.assertIn('content_type', self.cache.get(self.paths[3]))
+        meta = md.list(self.paths[3], cache=self.cache, attrs=['name'])
+        self.assertEqual(meta, {'name': 'file3.txt'})
+
+    def test_changed_file_is_relisted(self):
+        [pair for pair in md.list_many(self.paths, cache=self.cache)]
+        with open(self.paths[2], 'ab') as f:
+            f.write(b'more')
+        meta = md.list(self.paths[2], cache=self.cache)
+        self.assertEqual(meta['logical_size'], 6)
+        self.assertEqual(self.cache.get(self.paths[2])['logical_size'], 6)
+
+    def test_missing_file_not_cached(self):
+        missing = os.path.join(self.tmp_dir, 'missing.txt')
+        self.assertEqual(md.list(missing, cache=self.cache), {})
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 3
+        for path in self.paths[:3]:
+            self.cache.put(path, {'name': path})
+        # using the first entry makes the second the least recently used
+        self.assertIsNotNone(self.cache.get(self.paths[0]))
+        self.cache.put(self.paths[3], {'name': self.paths[3]})
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get(self.paths[1]))
+        self.assertIsNotNone(self.cache.get(self.paths[0]))
+
+    def test_persistent(self):
+        self.cache.put(self.paths[0], {'authors': ['Tōnÿ Stårk']})
+        self.cache.close()
+        self.cache = metadata.MetadataCache(self.cache.path)
+        self.assertEqual(self.cache.get(self.paths[0]),
+                         {'authors': ['Tōnÿ Stårk']})
+
+
+class FindCacheTests(FakeToolsTestCase):
+
+    def setUp(self):
+        super(FindCacheTests, self).setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sub_dir = os.path.join(self.tmp_dir, 'sub')
+        os.mkdir(self.sub_dir)
+        open(os.path.join(self.sub_dir, 'a.pdf'), 'wb').close()
+        self.fs_name = MDAttribute('kMDItemFSName')
+        self.cache = metadata.FindCache(ttl=60)
+
+    def tearDown(self):
+        super(FindCacheTests, self).tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hits_need_no_process(self):
+        query = self.fs_name == '*.pdf'
+        first = md.find(query, only_in=self.tmp_dir, cache=self.cache)
+        self.assertEqual(len(first), 1)
+        os.environ['PATH'] = os.defpath
+        # an equal query built separately renders to the same key
+        second = md.find(self.fs_name == '*.pdf', only_in=self.tmp_dir,
+                         cache=self.cache)
+        self.assertEqual(second, first)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        self.cache.put(self.fs_name == '*', None, ['/a'])
+        self.assertEqual(self.cache.get(self.fs_name == '*'), ['/a'])
+        self.cache.ttl = -1
+        self.cache.put(self.fs_name == '*', None, ['/a'])
+        self.assertIsNone(self.cache.get(self.fs_name == '*'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_limits(self):
+        self.cache.max_entries = 2
+        self.cache.max_paths = 3
+        for name in ('a', 'b', 'c'):
+            self.cache.put(self.fs_name == name, None, ['/' + name])
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNone(self.cache.get(self.fs_name == 'a'))
+        self.cache.put(self.fs_name == 'd', None, ['/d1', '/d2', '/d3'])
+        self.assertEqual(len(self.cache), 1)
+        self.cache.put(self.fs_name == 'e', None, ['/e1', '/e2', '/e3', '/e4'])
+        self.assertIsNone(self.cache.get(self.fs_name == 'e'))
+
+    def test_invalidate_scope(self):
+        query = self.fs_name == '*'
+        other = os.path.join(os.path.dirname(self.tmp_dir), 'elsewhere')
+        for only_in in (None, self.tmp_dir, self.sub_dir, other):
+            self.cache.put(query, only_in, [])
+        self.cache.invalidate(self.sub_dir)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.get(query, other), [])
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_relative_dates_not_cached(self):
+        created = MDAttribute('kMDItemContentCreationDate')
+        self.cache.put(created > '3 days ago', None, ['/a'])
+        self.cache.put(created.in_range('yesterday', 'today'), None, ['/b'])
+        self.assertEqual(len(self.cache), 0)
+        self.cache.put(created > '2016-01-01', None, ['/c'])
+        self.cache.put(created > datetime.datetime(2016, 1, 1), None, ['/d'])
+        self.assertEqual(len(self.cache), 2)
+
+
+class TagTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i in range(3):
+            path = os.path.join(self.tmp_dir, 'file{}.txt'.format(i))
+            open(path, 'wb').close()
+            self.paths.append(path)
+        try:
+            metadata.write_tags(self.paths[:1], ['probe'])
+        except (IOError, OSError):
+            shutil.rmtree(self.tmp_dir)
+            self.skipTest('filesystem without user extended attributes')
+        metadata.write_tags(self.paths[:1], [])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_no_tags(self):
+        self.assertEqual(metadata.read_tags(self.paths[1:2]),
+                         [(self.paths[1], [])])
+
+    def test_round_trip(self):
+        tags = ['Red', 'Tōnÿ Stårk']
+        written = metadata.write_tags(self.paths, tags)
+        self.assertEqual(written, self.paths)
+        self.assertEqual(metadata.read_tags(self.paths),
+                         [(path, tags) for path in self.paths])
+
+    def test_unchanged_not_written(self):
+        metadata.write_tags(self.paths[:2], ['a', 'b'])
+        written = metadata.write_tags(self.paths, ['a', 'b'])
+        self.assertEqual(written, self.paths[2:])
+        written = metadata.write_tags(self.paths, ['b', 'a'])
+        self.assertEqual(written, self.paths)
+
+    def test_missing_file(self):
+        missing = os.path.join(self.tmp_dir, 'missing.txt')
+        self.assertRaises(OSError, metadata.read_tags, [missing])
+        self.assertRaises(OSError, metadata.write_tags, [missing], ['a'])
+
+    @unittest.skipUnless(hasattr(os, 'setxattr'),
+                         'stand-in `xattr` needs Python 3.3+ on Linux')
+    def test_write_command(self):
+        environ = dict(os.environ)
+        os.environ['PATH'] = FAKE_BIN + os.pathsep + os.environ['PATH']
+        try:
+            md.write(self.paths[0], ['Red', 'Tōnÿ'])
+            output = utils.run_process(['xattr', '-p', 'com.apple.metadata:'
+                                        'kMDItemUserTags', self.paths[0]])
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        self.assertIn('<string>Tōnÿ</string>', output[0])
+
 
 if __name__ == '__main__':
     unittest.main()